@@ -0,0 +1,98 @@
+"""Compare the minimizers on the test cube and on standard problem 3.
+
+usage: python minimizers.py [mesh.fly]
+
+where mesh.fly is a mesh of standard problem 3, created with cube.py and
+tofly3 as in mumag3.py. Without it only the test cube is run. The number of
+energy evaluations, iterations, the solve time and the final energy of every
+problem and minimizer are written to results/minimizers.csv.
+"""
+
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from mammos_mumag.simulation import Simulation
+
+minimizers = ["ncg", "bb", "lbfgs"]
+data = Path(__file__).resolve().parents[3] / "tests" / "data"
+
+mu0 = 4e-7 * np.pi
+Js = 1.05    # T     mu0Ms
+A = 1.3e-11  # J/m   exchange constant
+Km = 0.5 * Js * Js / mu0
+Ku = 0.1 * Km
+
+
+def write_krn(name, K1, Js, A):
+    with open(name + ".krn", "w") as f:
+        f.write(f"0.0 0.0 {K1:.8e} 0.0 {Js} {A}\n")
+        f.write("0.0 0.0 0.0  0.0 0.0  0.0\n")
+        f.write("0.0 0.0 0.0  0.0 0.0  0.0\n")
+
+
+def write_p2(name, state):
+    with open(name + ".p2", "w") as f:
+        s = f"""[mesh]
+size = 1.e-9
+scale = 0.0
+
+[initial state]
+mx = 0.
+my = 0.
+mz = 1.
+state = {state}
+
+[field]
+hstart = 0.0
+hfinal = 0.0
+hstep = -0.02
+hx = 0.
+hy = 0.
+hz = 1.
+
+[minimizer]
+tol_fun = 1e-8
+tol_hmag_factor = 0.01
+precond_iter = 4\n"""
+        f.write(s)
+
+
+def read_stats(filename):
+    text = Path(filename).read_text()
+    values = {}
+    for key in ["Energy evaluations", "NCG iterations", "Solve time"]:
+        values[key] = float(re.findall(rf"{key}: ([-+.\deE]+)", text)[-1])
+    return values
+
+
+Path("results").mkdir(exist_ok=True)
+
+problems = {"cube": (data / "cube.fly", data / "cube.krn", data / "cube.p2")}
+if len(sys.argv) > 1:
+    write_krn("sp3", Ku, Js, A)
+    for state in ["flower", "vortex"]:
+        write_p2(f"sp3_{state}", state)
+        problems[f"sp3_{state}"] = (sys.argv[1], "sp3.krn", f"sp3_{state}.p2")
+
+with open(Path("results") / "minimizers.csv", "w") as file:
+    file.write("problem,minimizer,energy_evaluations,iterations,solve_time,energy\n")
+    for problem, (mesh, krn, p2) in problems.items():
+        sim = Simulation(
+            mesh_filepath=mesh,
+            materials_filepath=krn,
+            parameters_filepath=p2,
+        )
+        for minimizer in minimizers:
+            outdir = Path("results") / f"{problem}_{minimizer}"
+            sim.parameters.minimizer = minimizer
+            sim.run_loop(outdir=outdir, name="cube")
+            stats = read_stats(outdir / "cube_stats.txt")
+            energy = np.loadtxt(outdir / "cube.dat", ndmin=2)[-1, -1]
+            file.write(
+                f"{problem},{minimizer},{int(stats['Energy evaluations'])},"
+                f"{int(stats['NCG iterations'])},{stats['Solve time']},{energy}\n"
+            )
+            print(problem, minimizer, stats, "energy", energy)
@@ -8,7 +8,9 @@ from mammos_mumag import (
     hysteresis,
     materials,
     mesh,
+    mesh_store,
     parameters,
+    series,
     simulation,
     tofly,
 )
@@ -17,7 +19,9 @@ __all__ = [
     "hysteresis",
     "materials",
     "mesh",
+    "mesh_store",
     "parameters",
+    "series",
     "simulation",
     "tofly",
 ]
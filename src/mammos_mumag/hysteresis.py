@@ -2,8 +2,11 @@
 
 from __future__ import annotations
 
+import concurrent.futures
+import os
 import pathlib
-from typing import TYPE_CHECKING
+import queue
+from typing import TYPE_CHECKING, Any, Literal
 
 import mammos_entity as me
 import mammos_units as u
@@ -16,13 +19,38 @@ from pydantic import ConfigDict
 from pydantic.dataclasses import dataclass
 
 from mammos_mumag.materials import Materials
+from mammos_mumag.mesh_store import MeshStore
 from mammos_mumag.parameters import Parameters
+from mammos_mumag.series import (
+    SERIES_SUFFIX,
+    configuration_indices,
+    read_configuration,
+)
 from mammos_mumag.simulation import Simulation
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
     import matplotlib
     import pyvista
 
+ITERATIONS_COLUMNS = [
+    "mu0_Hext",
+    "ncg_iterations",
+    "energy_evaluations",
+    "poisson_cg_iterations",
+    "preconditioner_cg_iterations",
+    "spmv",
+    "line_search_backtracks",
+    "ncg_restarts",
+    "wall_time",
+]
+r"""Columns of `<name>_iterations.dat` and of :py:attr:`Result.iterations`.
+
+The external field :math:`\mu_0 H_{\mathsf{ext}}` is in Tesla, the wall time of
+the field step, including repeated adaptive steps, in seconds.
+"""
+
 
 def run(
     Ms: float | u.Quantity | me.Entity,
@@ -34,6 +62,9 @@ def run(
     hstep: float | u.Quantity | None = None,
     hnsteps: int = 20,
     outdir: str | pathlib.Path = "hystloop",
+    cache_dir: str | pathlib.Path | None = None,
+    compilation_cache_dir: str | pathlib.Path | None = None,
+    snapshots: Literal["vtu", "series"] = "vtu",
 ) -> Result:
     r"""Run hysteresis loop.
 
@@ -48,10 +79,366 @@ def run(
         hstep: Step size.
         hnsteps: Number of steps in the field sweep.
         outdir: Directory where simulation results are written to.
+        cache_dir: Directory of the matrix cache. Matrices are reused by all runs
+            with the same mesh and material parameters.
+        compilation_cache_dir: Directory of the persistent `jax` compilation
+            cache. The compiled solver is reused by all runs with the same mesh
+            and number of field steps.
+        snapshots: Output of the configurations, one `"vtu"` file each or a
+            single `"series"` file, see
+            :py:meth:`~mammos_mumag.simulation.Simulation.run_loop`.
 
     Returns:
        Result object.
 
+    """
+    sim = _simulation(Ms, A, K1, mesh_filepath, hstart, hfinal, hstep, hnsteps)
+    sim.run_loop(
+        outdir=outdir,
+        name="hystloop",
+        cache_dir=cache_dir,
+        compilation_cache_dir=compilation_cache_dir,
+        snapshots=snapshots,
+    )
+    return _read_result(outdir)
+
+
+def run_angles(
+    Ms: float | u.Quantity | me.Entity,
+    A: float | u.Quantity | me.Entity,
+    K1: float | u.Quantity | me.Entity,
+    mesh_filepath: pathlib.Path,
+    hstart: float | u.Quantity,
+    hfinal: float | u.Quantity,
+    directions: list[list[float]],
+    hstep: float | u.Quantity | None = None,
+    hnsteps: int = 20,
+    outdir: str | pathlib.Path = "hystloop_angles",
+    cache_dir: str | pathlib.Path | None = None,
+    compilation_cache_dir: str | pathlib.Path | None = None,
+    snapshots: Literal["vtu", "series"] = "vtu",
+) -> list[Result]:
+    r"""Run hysteresis loops for several directions of the external field.
+
+    All loops are computed in one process. The sparse matrices are assembled and
+    the solver is compiled only once and reused for every direction.
+
+    Args:
+        Ms: Spontaneous magnetisation in :math:`\mathrm{A}/\mathrm{m}`.
+        A: Exchange stiffness constant in :math:`\mathrm{J}/\mathrm{m}`.
+        K1: First magnetocrystalline anisotropy constant in
+            :math:`\mathrm{J}/\mathrm{m}^3`.
+        mesh_filepath: Path of the `fly` mesh, or of the binary `npz` mesh.
+        hstart: Initial strength of the external field.
+        hfinal: Final strength of the external field.
+        directions: List of directions of the external field.
+        hstep: Step size.
+        hnsteps: Number of steps in the field sweep.
+        outdir: Directory where simulation results are written to. The results
+            of the :math:`k`-th direction are written to the subdirectory `<k>`.
+        cache_dir: Directory of the matrix cache. Matrices are reused by all runs
+            with the same mesh and material parameters.
+        compilation_cache_dir: Directory of the persistent `jax` compilation
+            cache. The compiled solver is reused by all runs with the same mesh
+            and number of field steps.
+        snapshots: Output of the configurations, one `"vtu"` file each or a
+            single `"series"` file, see
+            :py:meth:`~mammos_mumag.simulation.Simulation.run_loop`.
+
+    Returns:
+       List of Result objects, one for each direction.
+
+    """
+    sim = _simulation(Ms, A, K1, mesh_filepath, hstart, hfinal, hstep, hnsteps)
+    sim.run_loop(
+        outdir=outdir,
+        name="hystloop",
+        cache_dir=cache_dir,
+        directions=[list(h) for h in directions],
+        compilation_cache_dir=compilation_cache_dir,
+        snapshots=snapshots,
+    )
+    return [_read_result(pathlib.Path(outdir) / str(k)) for k in range(len(directions))]
+
+
+def run_switching(
+    Ms: float | u.Quantity | me.Entity,
+    A: float | u.Quantity | me.Entity,
+    K1: float | u.Quantity | me.Entity,
+    mesh_filepath: pathlib.Path,
+    hstart: float | u.Quantity,
+    hfinal: float | u.Quantity,
+    hstep: float | u.Quantity | None = None,
+    hnsteps: int = 20,
+    tol: float | u.Quantity | None = None,
+    remanence: bool = False,
+    outdir: str | pathlib.Path = "switching",
+    cache_dir: str | pathlib.Path | None = None,
+    compilation_cache_dir: str | pathlib.Path | None = None,
+) -> SwitchingResult:
+    r"""Compute the switching field by bisection.
+
+    The field is swept with step `hstep` until the magnetisation jumps, and the
+    switching field is bisected in the interval of this step, see
+    :py:meth:`~mammos_mumag.simulation.Simulation.run_switching`. This needs
+    far fewer minimizations than a hysteresis loop with step `tol`.
+
+    Args:
+        Ms: Spontaneous magnetisation in :math:`\mathrm{A}/\mathrm{m}`.
+        A: Exchange stiffness constant in :math:`\mathrm{J}/\mathrm{m}`.
+        K1: First magnetocrystalline anisotropy constant in
+            :math:`\mathrm{J}/\mathrm{m}^3`.
+        mesh_filepath: Path of the mesh file.
+        hstart: Initial strength of the external field.
+        hfinal: Final strength of the external field.
+        hstep: Step size of the sweep.
+        hnsteps: Number of steps in the field sweep.
+        tol: Width of the final field interval. Defaults to `hstep / 64`.
+        remanence: Also compute the remanent magnetisation.
+        outdir: Directory where simulation results are written to.
+        cache_dir: Directory of the matrix cache.
+        compilation_cache_dir: Directory of the persistent `jax` compilation
+            cache.
+
+    Returns:
+       SwitchingResult object.
+
+    """
+    sim = _simulation(Ms, A, K1, mesh_filepath, hstart, hfinal, hstep, hnsteps)
+    if tol is None:
+        tol = abs(sim.parameters.hstep) / 64
+    elif isinstance(tol, u.Quantity):
+        tol = tol.to(u.T, equivalencies=u.magnetic_flux_field()).value
+    sim.parameters.hc_tol = tol
+    sim.run_switching(
+        outdir=outdir,
+        name="switching",
+        cache_dir=cache_dir,
+        compilation_cache_dir=compilation_cache_dir,
+        remanence=remanence,
+    )
+    return _read_switching_result(outdir)
+
+
+def run_multistart(
+    Ms: float | u.Quantity | me.Entity,
+    A: float | u.Quantity | me.Entity,
+    K1: float | u.Quantity | me.Entity,
+    mesh_filepath: pathlib.Path,
+    h: float | u.Quantity,
+    starts: list[tuple[str, int]],
+    outdir: str | pathlib.Path = "multistart",
+    cache_dir: str | pathlib.Path | None = None,
+    compilation_cache_dir: str | pathlib.Path | None = None,
+) -> MultistartResult:
+    r"""Minimize the energy from several initial states.
+
+    All starts are minimized together on the same matrices, see
+    :py:meth:`~mammos_mumag.simulation.Simulation.run_multistart`, to find the
+    state with the lowest energy at the field `h`.
+
+    Args:
+        Ms: Spontaneous magnetisation in :math:`\mathrm{A}/\mathrm{m}`.
+        A: Exchange stiffness constant in :math:`\mathrm{J}/\mathrm{m}`.
+        K1: First magnetocrystalline anisotropy constant in
+            :math:`\mathrm{J}/\mathrm{m}^3`.
+        mesh_filepath: Path of the mesh file.
+        h: Strength of the external field.
+        starts: Initial state (`"uniform"`, `"flower"`, `"vortex"`, `"twisted"`
+            or `"random"`) and seed of the random state of each start.
+        outdir: Directory where simulation results are written to.
+        cache_dir: Directory of the matrix cache.
+        compilation_cache_dir: Directory of the persistent `jax` compilation
+            cache.
+
+    Returns:
+       MultistartResult object.
+
+    """
+    sim = _simulation(Ms, A, K1, mesh_filepath, h, h, None, 1)
+    sim.run_multistart(
+        outdir=outdir,
+        name="multistart",
+        starts=starts,
+        cache_dir=cache_dir,
+        compilation_cache_dir=compilation_cache_dir,
+    )
+    return _read_multistart_result(outdir)
+
+
+def run_many(
+    param_list: Iterable[dict[str, Any]],
+    outdir: str | pathlib.Path = "hystloop_many",
+    max_workers: int | None = None,
+    threads_per_worker: int = 1,
+    cache_dir: str | pathlib.Path | None = None,
+    compilation_cache_dir: str | pathlib.Path | None = None,
+    mesh_store: str | pathlib.Path | None = None,
+) -> Iterator[tuple[int, Result | Exception]]:
+    r"""Run hysteresis loops for many sets of parameters in parallel.
+
+    Every loop runs in its own `esys.escript` process, at most `max_workers` of
+    them at the same time. The number of threads of `XLA`, `OpenMP` and `BLAS`
+    in each process is limited to `threads_per_worker` so that the processes do
+    not oversubscribe the cores. On Linux, each running loop is bound to its own
+    `threads_per_worker` CPUs, if there are enough for all workers. Results are
+    yielded as soon as a loop is finished, not in the order of `param_list`. A
+    failed loop yields the raised exception instead of a `Result` and does not
+    stop the other loops.
+
+    Args:
+        param_list: Keyword arguments of :py:func:`run` for each loop, except
+            `outdir`, `cache_dir` and `compilation_cache_dir`. A loop with other
+            keys yields a `ValueError`.
+        outdir: Directory where simulation results are written to. The results
+            of the :math:`i`-th set of parameters are written to the subdirectory
+            `<i>`.
+        max_workers: Maximum number of loops running at the same time. Defaults to
+            the number of cores divided by `threads_per_worker`.
+        threads_per_worker: Number of threads of each loop.
+        cache_dir: Directory of the matrix cache. Matrices are reused by all runs
+            with the same mesh and material parameters.
+        compilation_cache_dir: Directory of the persistent `jax` compilation
+            cache. The compiled solver is reused by all runs with the same mesh
+            and number of field steps.
+        mesh_store: Directory of a :py:class:`~mammos_mumag.mesh_store.MeshStore`.
+            The output directories link to the stored meshes instead of copies,
+            and without `cache_dir` the matrices are cached in the store.
+
+    Yields:
+        Index of the set of parameters in `param_list` and Result object, or the
+        exception raised by the loop.
+
+    """
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    # a running loop takes a set of CPUs from the queue and returns it when done
+    cpu_sets = queue.SimpleQueue()
+    for cpus in _cpu_sets(max_workers, threads_per_worker):
+        cpu_sets.put(cpus)
+    # The loops run in esys.escript processes, threads only wait for them.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                _run_one,
+                params,
+                pathlib.Path(outdir) / str(i),
+                threads_per_worker,
+                cache_dir,
+                compilation_cache_dir,
+                mesh_store,
+                cpu_sets,
+            ): i
+            for i, params in enumerate(param_list)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as exc:
+                yield futures[future], exc
+
+
+# keyword arguments of run accepted in the param_list of run_many
+_RUN_MANY_PARAMS = {
+    "Ms",
+    "A",
+    "K1",
+    "mesh_filepath",
+    "hstart",
+    "hfinal",
+    "hstep",
+    "hnsteps",
+    "snapshots",
+}
+
+
+def _cpu_sets(workers: int, threads: int) -> list[list[int] | None]:
+    """Disjoint sets of CPUs of the workers of :py:func:`run_many`.
+
+    Returns:
+        One list of `threads` CPUs for each worker, or `None` for each worker
+        if CPU affinity is not supported or there are not enough CPUs.
+
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * workers
+    cpus = sorted(os.sched_getaffinity(0))
+    if workers * threads > len(cpus):
+        return [None] * workers
+    return [cpus[k * threads : (k + 1) * threads] for k in range(workers)]
+
+
+def _run_one(
+    params: dict[str, Any],
+    outdir: pathlib.Path,
+    threads: int,
+    cache_dir: str | pathlib.Path | None,
+    compilation_cache_dir: str | pathlib.Path | None,
+    mesh_store: str | pathlib.Path | None = None,
+    cpu_sets: queue.SimpleQueue | None = None,
+) -> Result:
+    """Run one hysteresis loop of :py:func:`run_many`.
+
+    Returns:
+        Result object.
+
+    Raises:
+        ValueError: If `params` has keys that are not arguments of
+            :py:func:`run` or are set by :py:func:`run_many`.
+
+    """
+    unknown = set(params) - _RUN_MANY_PARAMS
+    if unknown:
+        raise ValueError(
+            f"Unknown parameters {sorted(unknown)}, "
+            f"expected a subset of {sorted(_RUN_MANY_PARAMS)}."
+        )
+    hstep = params.get("hstep")
+    hnsteps = params.get("hnsteps", 20)
+    sim = _simulation(
+        params["Ms"],
+        params["A"],
+        params["K1"],
+        params["mesh_filepath"],
+        params["hstart"],
+        params["hfinal"],
+        hstep,
+        hnsteps,
+    )
+    if mesh_store is not None:
+        sim.mesh_store = MeshStore(root=pathlib.Path(mesh_store))
+    cpus = None if cpu_sets is None else cpu_sets.get()
+    try:
+        sim.run_loop(
+            outdir=outdir,
+            name="hystloop",
+            cache_dir=cache_dir,
+            compilation_cache_dir=compilation_cache_dir,
+            threads=threads,
+            cpus=cpus,
+            snapshots=params.get("snapshots", "vtu"),
+        )
+    finally:
+        if cpu_sets is not None:
+            cpu_sets.put(cpus)
+    return _read_result(outdir)
+
+
+def _simulation(
+    Ms: float | u.Quantity | me.Entity,
+    A: float | u.Quantity | me.Entity,
+    K1: float | u.Quantity | me.Entity,
+    mesh_filepath: pathlib.Path,
+    hstart: float | u.Quantity,
+    hfinal: float | u.Quantity,
+    hstep: float | u.Quantity | None,
+    hnsteps: int,
+) -> Simulation:
+    """Set up the simulation of a hysteresis loop.
+
+    Returns:
+        Simulation object.
+
     """
     if hstep is None:
         hstep = (hfinal - hstart) / hnsteps
@@ -63,7 +450,7 @@ def run(
     if not isinstance(Ms, u.Quantity) or Ms.unit != u.A / u.m:
         Ms = me.Ms(Ms, unit=u.A / u.m)
 
-    sim = Simulation(
+    return Simulation(
         mesh_filepath=mesh_filepath,
         materials=Materials(
             domains=[
@@ -108,12 +495,41 @@ def run(
             precond_iter=10,
         ),
     )
-    sim.run_loop(outdir=outdir, name="hystloop")
+
+
+def _read_result(outdir: str | pathlib.Path) -> Result:
+    """Read the result of a hysteresis loop.
+
+    Args:
+        outdir: Directory containing `hystloop.dat`, the `vtu` files or the
+            series file `hystloop_series.npz` and optionally
+            `hystloop_iterations.dat`.
+
+    Returns:
+       Result object.
+
+    """
+    series = pathlib.Path(outdir).resolve() / f"hystloop{SERIES_SUFFIX}"
+    if series.is_file():
+        configurations = {i: series for i in configuration_indices(series)}
+    else:
+        configurations = {
+            i + 1: fname
+            for i, fname in enumerate(
+                sorted(pathlib.Path(outdir).resolve().glob("*.vtu"))
+            )
+        }
     df = pd.read_csv(
         f"{outdir}/hystloop.dat",
         delimiter=" ",
         names=["configuration_type", "mu0_Hext", "polarisation", "energy_density"],
     )
+    iterations_file = pathlib.Path(outdir) / "hystloop_iterations.dat"
+    iterations = (
+        pd.read_csv(iterations_file, delimiter=" ", names=ITERATIONS_COLUMNS)
+        if iterations_file.is_file()
+        else None
+    )
     return Result(
         H=me.Entity(
             "ExternalMagneticField",
@@ -131,13 +547,64 @@ def run(
         energy_density=me.Entity(
             "EnergyDensity", value=df["energy_density"], unit=u.J / u.m**3
         ),
+        configurations=configurations,
+        configuration_type=df["configuration_type"].to_numpy(),
+        iterations=iterations,
+    )
+
+
+def _read_switching_result(outdir: str | pathlib.Path) -> SwitchingResult:
+    """Read the result of a switching field computation.
+
+    Args:
+        outdir: Directory containing `switching_hc.dat` and
+            `switching_switching.dat`.
+
+    Returns:
+       SwitchingResult object.
+
+    """
+    hc, mr = np.loadtxt(f"{outdir}/switching_hc.dat")
+    steps = np.loadtxt(f"{outdir}/switching_switching.dat", ndmin=2)
+    return SwitchingResult(
+        Hc=me.Hc(
+            (abs(hc) * u.T).to(u.A / u.m, equivalencies=u.magnetic_flux_field()),
+            unit=u.A / u.m,
+        ),
+        Mr=None
+        if np.isnan(mr)
+        else me.Mr(
+            (mr * u.T).to(u.A / u.m, equivalencies=u.magnetic_flux_field()),
+            unit=u.A / u.m,
+        ),
+        minimizations=len(steps),
+    )
+
+
+def _read_multistart_result(outdir: str | pathlib.Path) -> MultistartResult:
+    """Read the result of a multi-start minimization.
+
+    Args:
+        outdir: Directory containing `multistart_multistart.dat` and the `vtu`
+            files of the starts.
+
+    Returns:
+       MultistartResult object.
+
+    """
+    outdir = pathlib.Path(outdir).resolve()
+    table = np.loadtxt(outdir / "multistart_multistart.dat", ndmin=2)
+    return MultistartResult(
+        energy_density=me.Entity("EnergyDensity", value=table[:, 2], unit=u.J / u.m**3),
+        M=me.Ms(
+            (table[:, 3] * u.T).to(u.A / u.m, equivalencies=u.magnetic_flux_field()),
+            unit=u.A / u.m,
+        ),
+        states=table[:, 0].astype(int),
+        seeds=table[:, 1].astype(int),
         configurations={
-            i + 1: fname
-            for i, fname in enumerate(
-                sorted(pathlib.Path(outdir).resolve().glob("*.vtu"))
-            )
+            k: outdir / f"multistart_start_{k:04d}.vtu" for k in range(len(table))
         },
-        configuration_type=df["configuration_type"].to_numpy(),
     )
 
 
@@ -154,7 +621,18 @@ class Result:
     configuration_type: np.ndarray | None = None
     """Array of indices of representative configurations for the field strengths."""
     configurations: dict[int, pathlib.Path] | None = None
-    """Mapping of configuration indices to file paths."""
+    """Mapping of configuration indices to file paths.
+
+    With single-file output all indices map to the series file.
+    """
+    iterations: pandas.DataFrame | None = None
+    """Counters of each field step, one row per row of :py:attr:`dataframe`.
+
+    The columns are listed in :py:data:`ITERATIONS_COLUMNS`. The counters are
+    accumulated inside the compiled loop and the wall time is taken on the host
+    when the rows of a field step are written, so the loop is not synchronized
+    for them.
+    """
 
     @property
     def dataframe(self) -> pandas.DataFrame:
@@ -237,6 +715,9 @@ class Result:
         is based on the assumption that the user will want to further modify the plot
         before displaying/saving it when passing a plotter.
 
+        Configurations in a series file are read one at a time, without the
+        other configurations of the file.
+
         Args:
             idx: Index of the configuration.
             jupyter_backend: Plotting backend.
@@ -244,7 +725,11 @@ class Result:
                 created if no plotter is passed.
 
         """
-        config = pv.read(self.configurations[idx])
+        filepath = self.configurations[idx]
+        if filepath.name.endswith(SERIES_SUFFIX):
+            config = read_configuration(filepath, idx)
+        else:
+            config = pv.read(filepath)
         config["m_norm"] = np.linalg.norm(config["m"], axis=1)
         glyphs = config.glyph(
             orient="m",
@@ -262,3 +747,54 @@ class Result:
         pl.show_axes()
         if plotter is None:
             pl.show(jupyter_backend=jupyter_backend)
+
+
+@dataclass(config=ConfigDict(arbitrary_types_allowed=True, frozen=True))
+class SwitchingResult:
+    """Switching field Result."""
+
+    Hc: me.Entity
+    """Coercive field, the magnitude of the switching field.
+
+    `nan` if the magnetisation did not switch in the field range.
+    """
+    Mr: me.Entity | None = None
+    """Remanent magnetisation, if computed."""
+    minimizations: int = 0
+    """Number of energy minimizations."""
+
+
+@dataclass(config=ConfigDict(arbitrary_types_allowed=True, frozen=True))
+class MultistartResult:
+    """Multi-start minimization Result."""
+
+    energy_density: me.Entity
+    """Array of energy densities of the final states of the starts."""
+    M: me.Entity
+    """Array of magnetisation values parallel to the field of the starts."""
+    states: np.ndarray
+    """Array of ids of the initial states.
+
+    0 uniform, 1 flower, 2 vortex, 3 twisted and 4 random.
+    """
+    seeds: np.ndarray
+    """Array of seeds of the random initial states."""
+    configurations: dict[int, pathlib.Path]
+    """Mapping of start indices to the files of the final configurations."""
+
+    @property
+    def lowest(self) -> int:
+        """Index of the start with the lowest energy."""
+        return int(np.argmin(self.energy_density.value))
+
+    @property
+    def dataframe(self) -> pandas.DataFrame:
+        """Dataframe containing the result data of the starts."""
+        return pd.DataFrame(
+            {
+                "state": self.states,
+                "seed": self.seeds,
+                "energy_density": self.energy_density.q,
+                "M": self.M.q,
+            }
+        )
@@ -1,8 +1,161 @@
 """Mesh functions."""
 
+import itertools
 import pathlib
+import tempfile
+
+import numpy as np
+
+from mammos_mumag import tofly
 
 _MESH_DIR = pathlib.Path(__file__).parent / "mesh"
 
 CUBE_20_nm = _MESH_DIR / "CUBE_20_nm.fly"
 """Cube with 20 nanometer sides."""
+
+MESH_SUFFIXES = (".fly", ".npz")
+"""Suffixes of the supported mesh files, text and binary."""
+
+NPZ_VERSION = 1
+"""Version of the binary mesh format."""
+
+DOMAIN_DUMP_SUFFIX = "_domain.nc"
+"""Suffix of the `esys.finley` dump of the domain of a binary mesh."""
+
+
+def read_fly(filepath: str | pathlib.Path) -> dict[str, np.ndarray]:
+    """Read a `fly` mesh into arrays.
+
+    The node and element blocks are parsed in bulk. The arrays are
+
+    * `name`: name of the mesh.
+
+    * `node_ids`, `node_dofs`, `node_tags`: ids, degrees of freedom and tags
+      of the nodes.
+
+    * `x`: node coordinates of shape `(N, d)`.
+
+    * `sections`: element types of the element, face element, contact
+      element and point sections, in the order of the file.
+
+    * `ids{k}`, `tags{k}`, `nodes{k}`: ids, tags and node ids of the elements
+      of the `k`-th section.
+
+    * `tag_names`, `tag_values`: names and values of the tags.
+
+    Args:
+        filepath: Path of the `fly` file.
+
+    Returns:
+        Dictionary of arrays.
+
+    """
+    arrays = {}
+    sections = []
+    tags = []
+    with open(filepath, "rb") as file:
+        arrays["name"] = np.array(file.readline().strip().decode())
+        header, num = file.readline().split()[:2]
+        dim = int(header.split(b"D")[0])
+        data = _read_block(file, int(num), np.float64).reshape(-1, dim + 3)
+        for i, key in enumerate(("node_ids", "node_dofs", "node_tags")):
+            arrays[key] = _compact(data[:, i].astype(np.int64))
+        arrays["x"] = data[:, 3:].copy()
+        line = file.readline()
+        while line and not line.startswith(b"Tags"):
+            etype, num = line.split()[:2]
+            k = len(sections)
+            data = _read_block(file, int(num), np.int64)
+            data = data.reshape(int(num), -1) if int(num) else data.reshape(0, 2)
+            arrays[f"ids{k}"] = _compact(data[:, 0])
+            arrays[f"tags{k}"] = _compact(data[:, 1])
+            arrays[f"nodes{k}"] = _compact(data[:, 2:])
+            sections.append(etype.decode())
+            line = file.readline()
+        for line in file:
+            words = line.split()
+            if len(words) == 2:
+                tags.append((words[0].decode(), int(words[1])))
+    arrays["sections"] = np.array(sections, dtype=str)
+    arrays["tag_names"] = np.array([t[0] for t in tags], dtype=str)
+    arrays["tag_values"] = np.array([t[1] for t in tags], dtype=np.int64)
+    return arrays
+
+
+def write_npz(arrays: dict[str, np.ndarray], filepath: str | pathlib.Path) -> None:
+    """Write mesh arrays to a binary `npz` mesh.
+
+    The archive is not compressed, so that its arrays can be memory mapped by
+    the scripts.
+
+    Args:
+        arrays: Mesh arrays as returned by :py:func:`read_fly`.
+        filepath: Path of the `npz` file.
+
+    """
+    with open(filepath, "wb") as file:
+        np.savez(file, version=np.array(NPZ_VERSION), **arrays)
+
+
+def convert_to_npz(
+    mesh_filepath: str | pathlib.Path,
+    npz_filepath: str | pathlib.Path | None = None,
+    exclude_list: list[int] | None = None,
+) -> pathlib.Path:
+    """Convert a `fly` or `unv` mesh to the binary `npz` mesh format.
+
+    The binary mesh holds the nodes, the element connectivity and the tags as
+    uncompressed arrays, see :py:func:`read_fly`. It can be used as mesh of a
+    :py:class:`~mammos_mumag.simulation.Simulation` instead of the `fly` file.
+    It is smaller than the `fly` file and the scripts read its arrays without
+    parsing text. `esys.finley` builds its domain only from a mesh file,
+    though. The first run on a binary mesh writes it to a temporary `fly` file
+    for the domain, which takes longer than reading the `fly` file, and saves
+    the domain as `esys.finley` dump `<stem>_domain.nc` next to the `npz` file,
+    or next to the stored mesh with a mesh store. Later runs load the domain
+    from the dump as long as it is newer than the `npz` file. The dump needs
+    `esys.escript` with NetCDF support.
+
+    Args:
+        mesh_filepath: Path of the `fly` or `unv` file.
+        npz_filepath: Path of the `npz` file. Defaults to `mesh_filepath` with
+            suffix `.npz`.
+        exclude_list: Dimensions excluded from the conversion of `unv` files,
+            see :py:func:`mammos_mumag.tofly.convert`. Defaults to `[1, 2]`.
+
+    Returns:
+        Path of the `npz` file.
+
+    """
+    mesh_filepath = pathlib.Path(mesh_filepath)
+    if npz_filepath is None:
+        npz_filepath = mesh_filepath.with_suffix(".npz")
+    npz_filepath = pathlib.Path(npz_filepath)
+    npz_filepath.parent.mkdir(exist_ok=True, parents=True)
+    if mesh_filepath.suffix.lower() == ".unv":
+        with tempfile.TemporaryDirectory() as tmp:
+            fly_filepath = pathlib.Path(tmp) / "mesh.fly"
+            tofly.convert(
+                mesh_filepath,
+                fly_filepath,
+                [1, 2] if exclude_list is None else exclude_list,
+            )
+            arrays = read_fly(fly_filepath)
+    else:
+        arrays = read_fly(mesh_filepath)
+    write_npz(arrays, npz_filepath)
+    return npz_filepath
+
+
+def _read_block(file, num: int, dtype: type) -> np.ndarray:
+    """Read `num` lines of numbers as a flat array."""
+    text = b"".join(itertools.islice(file, num)).decode()
+    return np.fromstring(text, dtype=dtype, sep=" ")
+
+
+def _compact(a: np.ndarray) -> np.ndarray:
+    """Store integers as 32 bit integers if they fit."""
+    info = np.iinfo(np.int32)
+    if a.size == 0 or (a.min() >= info.min and a.max() <= info.max):
+        return a.astype(np.int32)
+    return a
@@ -0,0 +1,151 @@
+"""Content-addressed mesh store."""
+
+import hashlib
+import os
+import pathlib
+import shutil
+import stat
+import tempfile
+from typing import Literal
+
+from pydantic.dataclasses import dataclass
+
+from mammos_mumag.tools import check_dir, check_path
+
+_hashes: dict[tuple[str, int, int], str] = {}
+
+
+@dataclass
+class MeshStore:
+    """Content-addressed store of meshes and of artifacts derived from them.
+
+    Each mesh is stored once in the directory `<root>/<hash>`, where `<hash>` is
+    the SHA-256 hash of the mesh file. Run directories reference the stored mesh
+    by a hard link, or by a symbolic link if `root` is on another file system,
+    instead of a copy. Stored meshes are read-only.
+
+    Artifacts derived from a mesh are kept next to it in subdirectories of
+    `<root>/<hash>`, see :py:meth:`artifact_dir`. The matrix cache of a
+    :py:class:`~mammos_mumag.simulation.Simulation` with a mesh store is the
+    subdirectory `matrices`.
+
+    Args:
+        root: Directory of the store.
+        link: How stored meshes are referenced from run directories.
+            `"hardlink"` falls back to a symbolic link and then to a copy,
+            `"symlink"` falls back to a copy.
+
+    """
+
+    root: pathlib.Path
+    link: Literal["hardlink", "symlink", "copy"] = "hardlink"
+
+    def key(self, mesh_filepath: str | pathlib.Path) -> str:
+        """Hash of a mesh file.
+
+        The hash is computed once per process for every file, size and
+        modification time.
+
+        Args:
+            mesh_filepath: Path of the mesh file.
+
+        Returns:
+            Hexadecimal SHA-256 hash of the file content.
+
+        """
+        path = check_path(mesh_filepath)
+        st = path.stat()
+        cache_key = (str(path), st.st_size, st.st_mtime_ns)
+        if cache_key not in _hashes:
+            h = hashlib.sha256()
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    h.update(chunk)
+            _hashes[cache_key] = h.hexdigest()
+        return _hashes[cache_key]
+
+    def entry(self, mesh_filepath: str | pathlib.Path) -> pathlib.Path:
+        """Directory of a mesh in the store.
+
+        Args:
+            mesh_filepath: Path of the mesh file.
+
+        Returns:
+            Directory `<root>/<hash>`.
+
+        """
+        return pathlib.Path(self.root) / self.key(mesh_filepath)
+
+    def add(self, mesh_filepath: str | pathlib.Path) -> pathlib.Path:
+        """Add a mesh to the store.
+
+        The mesh is copied to a temporary file in the store and renamed, so
+        that concurrent runs never see a partially written mesh. Adding a mesh
+        that is already stored does not copy it again.
+
+        Args:
+            mesh_filepath: Path of the mesh file.
+
+        Returns:
+            Path of the stored mesh, `<root>/<hash>/mesh<suffix>`.
+
+        """
+        mesh_filepath = check_path(mesh_filepath)
+        entry = check_dir(self.entry(mesh_filepath))
+        stored = entry / f"mesh{mesh_filepath.suffix}"
+        if not stored.exists():
+            fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=entry)
+            os.close(fd)
+            shutil.copyfile(mesh_filepath, tmp)
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp, stored)
+        return stored
+
+    def link_to(
+        self, mesh_filepath: str | pathlib.Path, target: str | pathlib.Path
+    ) -> pathlib.Path:
+        """Add a mesh to the store and reference it from `target`.
+
+        An existing `target` is replaced.
+
+        Args:
+            mesh_filepath: Path of the mesh file.
+            target: Path of the reference, e.g. `<outdir>/<name>.fly`.
+
+        Returns:
+            Path of the stored mesh.
+
+        """
+        stored = self.add(mesh_filepath)
+        target = pathlib.Path(target)
+        check_dir(target.parent)
+        target.unlink(missing_ok=True)
+        if self.link == "hardlink":
+            try:
+                os.link(stored, target)
+                return stored
+            except OSError:
+                pass
+        if self.link in ("hardlink", "symlink"):
+            try:
+                os.symlink(stored.resolve(), target)
+                return stored
+            except OSError:
+                pass
+        shutil.copy2(stored, target)
+        return stored
+
+    def artifact_dir(
+        self, mesh_filepath: str | pathlib.Path, kind: str
+    ) -> pathlib.Path:
+        """Directory of artifacts derived from a mesh.
+
+        Args:
+            mesh_filepath: Path of the mesh file.
+            kind: Kind of the artifacts, e.g. `"matrices"`.
+
+        Returns:
+            Directory `<root>/<hash>/<kind>`, created if it does not exist.
+
+        """
+        return check_dir(self.entry(mesh_filepath) / kind)
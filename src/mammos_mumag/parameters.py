@@ -29,13 +29,68 @@ class Parameters:
         h_vect: External field vector :math:`\mathbf{h}`.
         mstep: TODO
         mfinal: TODO
+        hstep_levels: Number of doublings of the field step in adaptive stepping.
+            If positive, the field step is `hstep` times a power of two up to
+            :math:`2^{\mathsf{hstep\_levels}}`. It is doubled after a step that
+            changes the magnetic polarisation parallel to the field by less than
+            `hstep_dm_grow` with at most `hstep_iter_grow` iterations of the
+            optimizer, and it is halved and the step repeated if the polarisation
+            changes by more than `hstep_dm_jump`. The fields are a subset of the
+            fields of the uniform loop with step `hstep`, so switching fields are
+            resolved to `hstep`. If 0, the step is `hstep`.
+        hstep_dm_grow: Change of the polarisation in Tesla below which the field
+            step is doubled.
+        hstep_dm_jump: Change of the polarisation in Tesla above which the field
+            step is halved and repeated.
+        hstep_iter_grow: Number of optimizer iterations up to which the field step
+            is doubled.
+        hc_tol: Width of the field interval in Tesla to which the switching field
+            is bisected, see
+            :py:meth:`~mammos_mumag.simulation.Simulation.run_switching`.
         iter_max: Max number of iterations of optimizer. TODO NOT USED AT THE MOMENT.
         precond_iter: conjugate gradient iterations for inverse Hessian approximation.
+        precond_recycle: Number of approximate eigenvectors of the slowest modes
+            of the conjugate gradient iterations of the inverse Hessian
+            approximation that deflate these iterations. The vectors are
+            updated from the search directions of each approximation and kept
+            over all iterations and field steps of a loop. 0 does not deflate.
         tol_fun: Tolerance of the total energy.
         tol_hmag_factor: Factor defining the tolerance for the magnetostatic scalar
             potential.
         tol_u: TODO
-        verbose: verbosity
+        tol_hmag_adaptive: Factor :math:`\eta` of the inexact solve for the
+            magnetic scalar potential. If positive, the relative tolerance of the
+            Poisson solve is :math:`\eta \|\mathbf{g}\|_\infty` of the projected
+            gradient of the previous energy evaluation, limited to the interval
+            between `tol_u` and its square root. If 0, `tol_u` is used.
+        extrapolate: 1 or 0 indicating whether the initial magnetization and
+            scalar potential of each field step are extrapolated linearly from
+            the previous two field steps (1) or taken from the previous field step
+            (0).
+        hmag_precond: Preconditioner of the conjugate gradient solver for the
+            magnetic scalar potential. `jacobi` uses the diagonal of the stiffness
+            matrix, `amg` a smoothed aggregation algebraic multigrid V-cycle that is
+            built once before the loop.
+        layout: Memory layout of the magnetization in the solver. `aos` stores
+            the components of each node next to each other in a vector of length
+            :math:`3N`, `soa` stores them as an array of shape :math:`(3, N)` of
+            the :math:`x`, :math:`y` and :math:`z` components.
+        precision: Floating point precision of the solver. `double` computes
+            everything in float64. `mixed` runs the preconditioning conjugate
+            gradient iterations of the minimizer and the conjugate gradient
+            iterations of the Poisson solve with float32 copies of their
+            matrices. The Poisson solution is refined in float64 to the
+            tolerance of `double`. Energies, gradients, convergence checks and
+            the magnetization are float64.
+        minimizer: Minimization algorithm. `ncg` is the preconditioned
+            Hestenes-Stiefel nonlinear conjugate gradient method, `bb` a
+            Barzilai-Borwein descent without line search and `lbfgs` a limited
+            memory BFGS method on the unit spheres. `bb` and `lbfgs` do not use
+            the inner conjugate gradient iterations of `precond_iter`.
+        verbose: Verbosity. With `verbose > 0` the iteration counts of each
+            field step are printed once the step is completed. Events inside
+            the minimizer, such as line search backtracks and restarts, are
+            only counted, see `<name>_iterations.dat`.
         filepath: TODO
     """
 
@@ -58,11 +113,23 @@ class Parameters:
     )
     mstep: float = 1.0
     mfinal: float = -0.8
+    hstep_levels: int = 0
+    hstep_dm_grow: float = 0.005
+    hstep_dm_jump: float = 0.05
+    hstep_iter_grow: int = 50
+    hc_tol: float = 1e-3
     iter_max: int = 1000
     precond_iter: int = 10
+    precond_recycle: int = 0
     tol_fun: float = 1e-10
     tol_hmag_factor: float = 1.0
     tol_u: float = 1e-10
+    tol_hmag_adaptive: float = 0.0
+    extrapolate: int = 0
+    hmag_precond: str = "jacobi"
+    layout: str = "aos"
+    precision: str = "double"
+    minimizer: str = "ncg"
     verbose: int = 0
     filepath: pathlib.Path | None = Field(default=None, repr=False)
 
@@ -150,17 +217,41 @@ class Parameters:
             self.mstep = float(field["mstep"])
         if "mfinal" in field:
             self.mfinal = float(field["mfinal"])
+        if "hstep_levels" in field:
+            self.hstep_levels = int(field["hstep_levels"])
+        if "hstep_dm_grow" in field:
+            self.hstep_dm_grow = float(field["hstep_dm_grow"])
+        if "hstep_dm_jump" in field:
+            self.hstep_dm_jump = float(field["hstep_dm_jump"])
+        if "hstep_iter_grow" in field:
+            self.hstep_iter_grow = int(field["hstep_iter_grow"])
+        if "hc_tol" in field:
+            self.hc_tol = float(field["hc_tol"])
 
         minimizer = pars["minimizer"]
         if "iter_max" in minimizer:
             self.iter_max = int(minimizer["iter_max"])
         if "precond_iter" in minimizer:
             self.precond_iter = int(minimizer["precond_iter"])
+        if "precond_recycle" in minimizer:
+            self.precond_recycle = int(minimizer["precond_recycle"])
         if "tol_fun" in minimizer:
             self.tol_fun = float(minimizer["tol_fun"])
         if "tol_hmag_factor" in minimizer:
             self.tol_hmag_factor = float(minimizer["tol_hmag_factor"])
         self.tol_u = self.tol_fun * self.tol_hmag_factor
+        if "tol_hmag_adaptive" in minimizer:
+            self.tol_hmag_adaptive = float(minimizer["tol_hmag_adaptive"])
+        if "extrapolate" in minimizer:
+            self.extrapolate = int(minimizer["extrapolate"])
+        if "hmag_precond" in minimizer:
+            self.hmag_precond = str(minimizer["hmag_precond"])
+        if "layout" in minimizer:
+            self.layout = str(minimizer["layout"])
+        if "precision" in minimizer:
+            self.precision = str(minimizer["precision"])
+        if "minimizer" in minimizer:
+            self.minimizer = str(minimizer["minimizer"])
         if "truncation" in minimizer:
             self.truncation = int(minimizer["truncation"])
         if "verbose" in minimizer:
@@ -226,12 +317,24 @@ class Parameters:
                 "hx": self.h[0],
                 "hy": self.h[1],
                 "hz": self.h[2],
+                "hstep_levels": self.hstep_levels,
+                "hstep_dm_grow": self.hstep_dm_grow,
+                "hstep_dm_jump": self.hstep_dm_jump,
+                "hstep_iter_grow": self.hstep_iter_grow,
+                "hc_tol": self.hc_tol,
             },
             "minimizer": {
                 "iter_max": self.iter_max,
                 "tol_fun": self.tol_fun,
                 "tol_hmag_factor": self.tol_hmag_factor,
+                "tol_hmag_adaptive": self.tol_hmag_adaptive,
+                "extrapolate": self.extrapolate,
+                "hmag_precond": self.hmag_precond,
+                "layout": self.layout,
+                "precision": self.precision,
+                "minimizer": self.minimizer,
                 "precond_iter": self.precond_iter,
+                "precond_recycle": self.precond_recycle,
                 "verbose": self.verbose,
             },
         }
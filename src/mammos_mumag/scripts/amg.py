@@ -0,0 +1,138 @@
+import sys
+from time import time
+
+import jax
+jax.config.update("jax_enable_x64", True)
+import jax.numpy as np
+import numpy
+import scipy.sparse
+
+from converters import csr2bcoo, bcoo2csr
+
+# Smoothed aggregation algebraic multigrid for the magnetostatic Poisson problem
+# (Vanek, Mandel, Brezina, Computing 56 (1996) 179-196).
+# The hierarchy is built with scipy at setup and stored as jax arrays,
+#   (levels, coarse) with levels[l] = A, R, P, w
+# where w is the scaled inverse diagonal of the Jacobi smoother and coarse the
+# dense inverse of the coarsest matrix. solvers.vcycle applies it inside jit.
+
+THETA = 0.08          # strength of connection
+MAX_COARSE = 500      # size of the coarsest matrix
+MAX_LEVELS = 10
+
+# largest eigenvalue of D^-1 A by power iteration
+def spectral_radius(A, Dinv, iters=15, seed=0):
+    x = numpy.random.default_rng(seed).random(A.shape[0])
+    rho = 1.0
+    for _ in range(iters):
+        y = Dinv * (A @ x)
+        rho = numpy.linalg.norm(y) / numpy.linalg.norm(x)
+        x = y / numpy.linalg.norm(y)
+    return rho
+
+# strong connections |a_ij| >= theta sqrt(|a_ii a_jj|), with diagonal
+def strength(A, theta=THETA):
+    A = A.tocoo()
+    d = numpy.abs(A.diagonal())
+    keep = numpy.abs(A.data) >= theta * numpy.sqrt(d[A.row] * d[A.col])
+    keep |= A.row == A.col
+    n = A.shape[0]
+    S = scipy.sparse.csr_matrix(
+        (numpy.ones(keep.sum(), dtype=bool), (A.row[keep], A.col[keep])), shape=(n, n)
+    )
+    return S + scipy.sparse.identity(n, dtype=bool, format="csr")
+
+# aggregates from a distance-2 maximal independent set of the strength graph:
+# the roots are chosen in parallel Jones-Plassmann steps, every node joins the
+# aggregate of a root at distance 1, else at distance 2
+def aggregate(S, seed=0):
+    n = S.shape[0]
+    starts = S.indptr[:-1]
+    weight = numpy.random.default_rng(seed).permutation(n)
+
+    def reduce1(ufunc, v):
+        return ufunc.reduceat(v[S.indices], starts)
+
+    def reduce2(ufunc, v):
+        return reduce1(ufunc, reduce1(ufunc, v))
+
+    root = numpy.zeros(n, dtype=bool)
+    undecided = numpy.ones(n, dtype=bool)
+    while undecided.any():
+        new = undecided & (reduce2(numpy.maximum, numpy.where(undecided, weight, -1)) == weight)
+        root |= new
+        undecided &= reduce2(numpy.maximum, root.astype(numpy.int8)) == 0
+    agg = numpy.full(n, -1)
+    agg[root] = numpy.arange(root.sum())
+    agg = reduce1(numpy.maximum, agg)
+    agg = numpy.where(agg >= 0, agg, reduce1(numpy.maximum, agg))
+    return agg, int(root.sum())
+
+# prolongator: tentative piecewise constant prolongator smoothed by one
+# damped Jacobi step, P = (I - 4/3/rho D^-1 A) T
+def prolongator(A, Dinv, seed=0):
+    n = A.shape[0]
+    agg, nagg = aggregate(strength(A), seed)
+    size = numpy.bincount(agg, minlength=nagg)
+    T = scipy.sparse.csr_matrix((1.0 / numpy.sqrt(size[agg]), (numpy.arange(n), agg)), shape=(n, nagg))
+    omega = 4.0 / 3.0 / spectral_radius(A, Dinv, seed=seed)
+    P = T - omega * scipy.sparse.diags(Dinv) @ (A @ T)
+    return P.tocsr()
+
+# hierarchy of the symmetric positive definite matrix A (scipy or BCOO)
+def amg_hierarchy(A, seed=0):
+    if not scipy.sparse.issparse(A):
+        A = bcoo2csr(A)
+    A = scipy.sparse.csr_matrix(A)
+    levels = []
+    while A.shape[0] > MAX_COARSE and len(levels) < MAX_LEVELS - 1:
+        Dinv = 1.0 / A.diagonal()
+        P = prolongator(A, Dinv, seed)
+        if P.shape[1] >= A.shape[0]:
+            break
+        w = 4.0 / 3.0 / spectral_radius(A, Dinv, seed=seed) * Dinv
+        levels.append((csr2bcoo(A), csr2bcoo(P.T.tocsr()), csr2bcoo(P), np.array(w)))
+        A = (P.T @ A @ P).tocsr()
+    coarse = np.array(numpy.linalg.pinv(A.toarray()))
+    return tuple(levels), coarse
+
+# preconditioner of the Poisson solve selected by hmag_precond (min_pars[6]):
+# 0 Jacobi with the diagonal of the stiffness matrix, 1 algebraic multigrid
+def set_hmag_precond(pars):
+    if pars['min_pars'][6] == 1:
+        if 'hmag_precond' not in pars:
+            pars['hmag_precond'] = amg_hierarchy(pars['hmag_pars'][3])
+    else:
+        pars.pop('hmag_precond', None)
+
+# iterations and time of the Poisson solve for a uniformly magnetized state,
+# Jacobi versus algebraic multigrid
+if __name__ == "__main__":
+    from mapping import escript2arrays
+    from solvers import pcg
+
+    try:
+        name = sys.argv[1]
+    except IndexError:
+        sys.exit("usage run-escript amg.py modelname")
+
+    m, pars, _ = escript2arrays(name)
+    dx, dy, dz, A, D, _, _, _ = pars['hmag_pars']
+    m = np.tile(np.array([0.0, 0.0, 1.0]), len(m)//3) * np.repeat(pars['meas'] > 0, 3)
+    b = dx@m[0::3] + dy@m[1::3] + dz@m[2::3]
+    u0 = np.zeros(len(b))
+
+    t0 = time()
+    amg = amg_hierarchy(A)
+    setup_time = time() - t0
+
+    with open(name + "_precond.csv", "w") as file:
+        file.write("preconditioner,tol,iterations,setup_time,solve_time\n")
+        for precond, M, t_setup in (('jacobi', D, 0.0), ('amg', amg, setup_time)):
+            for tol in (1e-6, 1e-8, 1e-10):
+                jax.block_until_ready(pcg(A, M, b, u0, tol))
+                t0 = time()
+                _, k = jax.block_until_ready(pcg(A, M, b, u0, tol))
+                file.write(f"{precond},{tol},{int(k)},{t_setup},{time() - t0}\n")
+    sizes = [int(level[0].shape[0]) for level in amg[0]] + [int(amg[1].shape[0])]
+    print('levels', sizes)
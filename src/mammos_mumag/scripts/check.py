@@ -8,7 +8,7 @@ import os
 from energies import external_eg, exani_eg, hmag_eg, total_eg
 from mapping import escript2arrays, check_external, check_anisotropy, check_hmag, update_pars, initial_m
 from tools import write_stats, get_memory_usage, get_mu0
-from store import pickle2jax
+from store import cache2jax
 from escript_tools import readmesh_get_tags
 
 import jax.numpy as np
@@ -22,9 +22,9 @@ if __name__ == "__main__":
     print('\n')
     print('MAP FINITE ELEMENT BACKEND (esys-escript) TO JAX \n')
     print('Memory before conversion to jax ', get_memory_usage(), "MB") 
-    if os.path.exists(f'{name}.pkl'):
+    pars = cache2jax(name)
+    if pars is not None:
         print('read stored matrices')
-        m, pars = pickle2jax(name)
         tags    = readmesh_get_tags(name)
         update_pars(name, pars)
         m = initial_m(tags.getDomain(),pars)
@@ -50,16 +50,16 @@ if __name__ == "__main__":
 
     args = tol_u, field_value, pars    
     
-    stats = 0
+    stats = 0, 0
     t0 = time()
     energy, _, _, stats = total_eg(m, args, (u0,None,), stats)
-    function_calls = stats
+    function_calls, _ = stats
     total_time = time() - t0
         
-    stats = 0
+    stats = 0, 0
     t0 = time()
     energy, _, _, stats = total_eg(m, args, (u0,None,), stats)
-    function_calls = stats
+    function_calls, _ = stats
 
     write_stats('timing and statistics',
                 total_time, 0, function_calls,0)
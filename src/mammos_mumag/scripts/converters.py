@@ -1,57 +1,217 @@
-from jax.experimental import sparse
-import jax.numpy as np
-import scipy
-import tempfile
-import numpy
-
-import esys.escript as e
-
-# escript operator to scikit-sparse matrix
-def operator2csr(operator):
-  with tempfile.NamedTemporaryFile(suffix=".mtx", delete=True) as temp_file:
-    filename = temp_file.name  # Get the temporary filename
-    operator.saveMM(filename)  # Save matrix to temporary file
-    return scipy.io.mmread(filename).tocsr()  
-
-# scipy csr to jax BCOO
-def csr2bcoo(A):
-    return sparse.BCOO.from_scipy_sparse(A).sort_indices()
-    
-# escript operator to matrix
-def operator2matrix(operator,fm='bcoo',diag=True):
-    A = operator2csr(operator)
-    if diag:
-      D = np.array(A.diagonal())
-    else:
-      D = None        
-    if fm.lower()=='bcoo':
-      A = csr2bcoo(A) 
-    return A, D
-
-# escript array to numpy
-def escript2numpy(v):
-    return numpy.array(e.convertToNumpy(v).T.flatten())
-
-# escript array to jax
-def escript2jax(v):
-    return np.array(e.convertToNumpy(v).T.flatten())
-
-# escript array to numpy
-def escript2numpy(v):
-    return e.convertToNumpy(v).T.flatten()
-
-# jax.np array of shape (3N,) to escript Vector
-def toEscriptVector(x,domain):
-    y = numpy.array(x.reshape(-1,3))  
-    m = e.Vector(0.,e.Solution(domain))
-    for i,mm in enumerate(y):
-       m.setValueOfDataPoint(i,mm)
-    return m
-
-# jax.np array of shape (N,) to escript Scalar
-def toEscriptScalar(x,domain):
-    y = numpy.array(x)  
-    u = e.Scalar(0.,e.Solution(domain))
-    for i,uu in enumerate(y):
-       u.setValueOfDataPoint(i,uu)
-    return u
+from jax.experimental import sparse
+import jax.numpy as np
+import scipy
+import scipy.sparse
+import tempfile
+import numpy
+import sys
+from time import time
+
+import esys.escript as e
+
+from mesh import read_fly_arrays
+
+# escript operator to scikit-sparse matrix
+# with a pattern the matrix is probed in memory, otherwise it is
+# written to a MatrixMarket file and read back
+def operator2csr(operator,pattern=None,block=1):
+    if pattern is not None:
+        A = pattern.csr(operator,block)
+        if pattern.check(operator,A,block):
+            return A
+        print('probed operator does not match, read MatrixMarket file')
+    return mm2csr(operator)
+
+# escript operator to scikit-sparse matrix via a MatrixMarket text file
+def mm2csr(operator):
+  with tempfile.NamedTemporaryFile(suffix=".mtx", delete=True) as temp_file:
+    filename = temp_file.name  # Get the temporary filename
+    operator.saveMM(filename)  # Save matrix to temporary file
+    return scipy.io.mmread(filename).tocsr()  
+
+# scipy csr to jax BCOO
+def csr2bcoo(A):
+    return sparse.BCOO.from_scipy_sparse(A).sort_indices()
+    
+# jax BCOO to scipy csr
+def bcoo2csr(A):
+    indices = numpy.asarray(A.indices)
+    return scipy.sparse.csr_matrix((numpy.asarray(A.data), (indices[:, 0], indices[:, 1])), shape=A.shape)
+
+# escript operator to matrix
+def operator2matrix(operator,fm='bcoo',diag=True,pattern=None,block=1):
+    A = operator2csr(operator,pattern,block)
+    if diag:
+      D = np.array(A.diagonal())
+    else:
+      D = None        
+    if fm.lower()=='bcoo':
+      A = csr2bcoo(A) 
+    return A, D
+
+# Sparsity pattern of the finite element node graph with a distance-2 coloring.
+# Columns of one color never share a row, so a single operator application to
+# the indicator vector of a color gives all entries of these columns
+# (Curtis, Powell, Reid, IMA J. Appl. Math. 13 (1974) 117-119).
+class Pattern:
+    def __init__(self, name, domain, seed=0):
+        self.domain = domain
+        node_ids, _, elements, _ = read_fly_arrays(name)
+        ids = numpy.array(e.Solution(domain).getReferenceIDs())
+        n = len(ids)
+        order = numpy.argsort(ids)
+        rows, cols = [numpy.arange(n)], [numpy.arange(n)]
+        for _, _, nodes in elements.values():
+            nodes = order[numpy.searchsorted(ids[order], nodes)]        # node ids to samples
+            k = nodes.shape[1]
+            rows.append(numpy.repeat(nodes, k, axis=1).ravel())
+            cols.append(numpy.tile(nodes, (1, k)).ravel())
+        rows = numpy.concatenate(rows)
+        cols = numpy.concatenate(cols)
+        S = scipy.sparse.csr_matrix((numpy.ones(len(rows), dtype=bool), (rows, cols)), shape=(n, n))
+        S.sum_duplicates()
+        self.rows = numpy.repeat(numpy.arange(n), numpy.diff(S.indptr))
+        self.cols = S.indices.astype(numpy.int64)
+        self.color = color_graph(S, seed)
+        self.ncolors = int(self.color.max()) + 1
+        self._color = toEscriptScalar(self.color, domain)
+        # group the nonzeros by the color of their column
+        col_color = self.color[self.cols]
+        self._order = numpy.argsort(col_color, kind="stable")
+        self._bounds = numpy.searchsorted(col_color[self._order], numpy.arange(self.ncolors + 1))
+
+    # operator with block size 1 (scalar) or 3 (vector) to csr
+    def csr(self, operator, block=1):
+        n = len(self.color)
+        vals = numpy.zeros((len(self.rows), block, block))
+        for c in range(self.ncolors):
+            sel = self._order[self._bounds[c]:self._bounds[c + 1]]
+            rows = self.rows[sel]
+            mask = e.whereZero(self._color - c)
+            for b in range(block):
+                if block == 1:
+                    v = mask
+                else:
+                    v = e.Vector(0.0, e.Solution(self.domain))
+                    v[b] = mask
+                y = e.convertToNumpy(operator.of(v)).T.reshape(n, block)
+                vals[sel, :, b] = y[rows]
+        k = numpy.arange(block)
+        r = block * self.rows[:, None, None] + k[None, :, None]
+        c = block * self.cols[:, None, None] + k[None, None, :]
+        r, c = numpy.broadcast_arrays(r, c)
+        A = scipy.sparse.csr_matrix((vals.ravel(), (r.ravel(), c.ravel())), shape=(block * n, block * n))
+        A.eliminate_zeros()
+        return A
+
+    # compare one product of the escript operator with the probed matrix
+    def check(self, operator, A, block=1, rtol=1e-10):
+        x = e.interpolate(self.domain.getX(), e.Solution(self.domain))
+        if block == 1:
+            x = x[0]
+        y = escript2numpy(operator.of(x))
+        err = numpy.linalg.norm(A @ escript2numpy(x) - y)
+        return err <= rtol * numpy.linalg.norm(y) + numpy.finfo(float).tiny
+
+# distance-2 coloring of the graph of the symmetric pattern S (with diagonal)
+# by parallel Jones-Plassmann steps: a node that has the largest random weight
+# among its uncolored distance-2 neighbors takes the smallest color not used by
+# its neighbors; used colors are kept as bit masks in 64 bit words
+def color_graph(S, seed=0):
+    n = S.shape[0]
+    starts = S.indptr[:-1]
+    weight = numpy.random.default_rng(seed).permutation(n)
+    color = numpy.full(n, -1, dtype=numpy.int64)
+
+    def reduce2(ufunc, v):
+        v = ufunc.reduceat(v[S.indices], starts, axis=0)
+        return ufunc.reduceat(v[S.indices], starts, axis=0)
+
+    nwords = 1
+    uncolored = color < 0
+    while uncolored.any():
+        winner = uncolored & (reduce2(numpy.maximum, numpy.where(uncolored, weight, -1)) == weight)
+        bits = numpy.zeros((n, nwords), dtype=numpy.uint64)
+        done = numpy.flatnonzero(~uncolored)
+        bits[done, color[done] // 64] = numpy.left_shift(numpy.uint64(1), (color[done] % 64).astype(numpy.uint64))
+        free = ~reduce2(numpy.bitwise_or, bits)[winner]
+        word = numpy.argmax(free != 0, axis=1)
+        low = free[numpy.arange(len(word)), word]
+        low = low & (~low + numpy.uint64(1))                                  # lowest free bit
+        new = numpy.where(low == 0, 64 * nwords, 64 * word + numpy.log2(numpy.maximum(low, 1).astype(float)).astype(numpy.int64))
+        color[winner] = new
+        nwords = max(nwords, int(new.max()) // 64 + 1)
+        uncolored = color < 0
+    return color
+
+# escript array to numpy
+def escript2numpy(v):
+    return numpy.array(e.convertToNumpy(v).T.flatten())
+
+# escript array to jax
+def escript2jax(v):
+    return np.array(e.convertToNumpy(v).T.flatten())
+
+# escript array to numpy
+def escript2numpy(v):
+    return e.convertToNumpy(v).T.flatten()
+
+# jax.np array of shape (3N,) to escript Vector
+def toEscriptVector(x,domain):
+    y = numpy.array(x.reshape(-1,3))  
+    m = e.Vector(0.,e.Solution(domain))
+    for i,mm in enumerate(y):
+       m.setValueOfDataPoint(i,mm)
+    return m
+
+# jax.np array of shape (N,) to escript Scalar
+def toEscriptScalar(x,domain):
+    y = numpy.array(x)  
+    u = e.Scalar(0.,e.Solution(domain))
+    for i,uu in enumerate(y):
+       u.setValueOfDataPoint(i,uu)
+    return u
+
+# setup time of the operators used in mapping.escript2arrays:
+# MatrixMarket round trip versus probing
+if __name__ == "__main__":
+    from materials import Materials
+    from matrix import exani_matrix, dx, dy, dz, gx, gy, gz, stiffness_matrix
+
+    try:
+        name = sys.argv[1]
+    except IndexError:
+        sys.exit("usage run-escript converters.py modelname")
+
+    materials = Materials(name)
+    t0 = time()
+    pattern = Pattern(name, materials.getDomain())
+    pattern_time = time() - t0
+
+    operators = {
+        'exani': (exani_matrix(materials.A, materials.K, materials.u, materials.volume), 3),
+        'dx': (dx(materials.Js), 1),
+        'dy': (dy(materials.Js), 1),
+        'dz': (dz(materials.Js), 1),
+        'stiffness': (stiffness_matrix(materials.Js, materials.volume), 1),
+        'gx': (gx(materials.Js, materials.volume), 1),
+        'gy': (gy(materials.Js, materials.volume), 1),
+        'gz': (gz(materials.Js, materials.volume), 1),
+    }
+
+    mm_total, probe_total = 0.0, pattern_time
+    with open(name + "_setup.csv", "w") as file:
+        file.write("operator,nnz,mm_time,probe_time,max_difference\n")
+        file.write(f"pattern,{len(pattern.rows)},0.0,{pattern_time},0.0\n")
+        for key, (operator, block) in operators.items():
+            t0 = time()
+            A_mm = mm2csr(operator)
+            mm_time = time() - t0
+            t0 = time()
+            A_probe = pattern.csr(operator, block)
+            probe_time = time() - t0
+            diff = abs(A_mm - A_probe).max() if A_mm.nnz else 0.0
+            mm_total += mm_time
+            probe_total += probe_time
+            file.write(f"{key},{A_probe.nnz},{mm_time},{probe_time},{diff}\n")
+    print(f"colors {pattern.ncolors}  MatrixMarket {mm_total} s  probing {probe_total} s")
@@ -1,105 +1,221 @@
-import sys
-import jax.numpy as np
-from jax import jit, lax
-import jax
-from solvers import jax_scipy_cg
-
-@jit
-def external_g(value,params):
-    direction,meas,volume = params
-    return np.concatenate([(-value*direction[0]/volume)*meas,
-                           (-value*direction[1]/volume)*meas,
-                           (-value*direction[2]/volume)*meas]).reshape(3,-1).T.flatten()
-    
-@jit
-def external_e(m,value,params):
-    return np.dot(m, external_g(value,params))
-    
-@jit
-def external_eg(m,value,params):
-    g = external_g(value,params)
-    return np.dot(m, g), g
-@jit
-def exani_g(m, mat_exani):
-    return mat_exani @ m
-
-@jit
-def exani_e(m, mat_exani):
-    return 0.5*np.dot(m,mat_exani@m)
-
-@jit
-def exani_eg(m, mat_exani):
-    g = mat_exani@m
-    return 0.5*np.dot(m,g), g
-
-
-@jit
-def hmag_g(m, u0, tol, params):
-    dx, dy, dz, A, D, gx, gy, gz = params
-
-    #def Afunc(x):
-    #    return A @ x
-
-    b = dx@m[0::3] + dy@m[1::3] + dz@m[2::3] 
-    u = jax_scipy_cg(A, D, b, u0, tol)
-    g = np.concatenate([gx@u,gy@u,gz@u]).reshape(3,-1).T.flatten()
-    return g, u
-
-@jit
-def hmag_e(m, u0, tol, params):
-    g, u = hmag_g(m, u0, tol, params)
-    return 0.5 * np.dot(m, g), u
-    
-@jit
-def hmag_eg(m, u0, tol, params):
-    #jax.debug.print('u in  hmag {out}',out=u0[4729])
-    #jax.debug.print('tol_u {tol}',tol=tol)
-    g, u = hmag_g(m, u0, tol, params)
-    #jax.debug.print('u out hmag {out}',out=u[4729])
-    return 0.5 * np.dot(m, g), g, u
-
-@jit
-def projection(m, g):  # eq (15) Computer Physics Communications 235 (2019) 179–186
-    m_ = np.reshape(m,(-1,3))
-    g_ = np.reshape(g,(-1,3))
-    return np.cross(m_, np.cross(g_, m_)).flatten()
-    
-@jit
-def total_eg(m, args, other, stats):
-    u0, _ = other
-    tol, field_value, pars = args
-    calls = stats
-    external_pars = pars['hext_pars'][0], pars['meas'], pars['volume']
-    energy, gradient = external_eg(m,field_value,external_pars)
-    
-    exani_A = pars['exani_pars'][0] 
-    exani_D = pars['exani_pars'][1] 
-    e, g_exani = exani_eg(m,exani_A)
-    energy    += e
-    gradient  += g_exani 
-    
-    def hmag_true(_):
-        return hmag_eg(m, u0, tol, pars['hmag_pars'])
-    
-    def hmag_false(_):
-        zero_energy = 0.0
-        zero_gradient = np.zeros_like(gradient)  
-        return zero_energy, zero_gradient, u0
-
-    e_hmag, g_hmag, u = lax.cond(
-        pars['hmag_on'] > 0,
-        hmag_true,
-        hmag_false,
-        operand=None
-    )
-    
-    energy   += e_hmag
-    gradient += g_hmag
-
-    return energy, projection(m,gradient), (u, gradient), calls+1  
-    
-if __name__ == "__main__":
-    try:
-        name = sys.argv[1]
-    except IndexError:
-        sys.exit("usage run-escript energies.py modelname")
+import sys
+import jax.numpy as np
+from jax import jit, lax
+import jax
+from solvers import pcg, pcg_mixed
+
+@jit
+def external_g(value,params):
+    direction,meas,volume = params
+    return np.concatenate([(-value*direction[0]/volume)*meas,
+                           (-value*direction[1]/volume)*meas,
+                           (-value*direction[2]/volume)*meas]).reshape(3,-1).T.flatten()
+    
+@jit
+def external_e(m,value,params):
+    return np.dot(m, external_g(value,params))
+    
+@jit
+def external_eg(m,value,params):
+    if m.ndim == 2:                                  # (3,N) layout, see jax_tools.to_soa
+        direction,meas,volume = params
+        g = np.outer((-value/volume)*np.asarray(direction), meas)
+        return np.vdot(m, g), g
+    g = external_g(value,params)
+    return np.dot(m, g), g
+@jit
+def exani_g(m, mat_exani):
+    return (mat_exani @ m.reshape(-1)).reshape(m.shape)
+
+@jit
+def exani_e(m, mat_exani):
+    return 0.5*np.vdot(m,exani_g(m,mat_exani))
+
+@jit
+def exani_eg(m, mat_exani):
+    g = exani_g(m, mat_exani)
+    return 0.5*np.vdot(m,g), g
+
+
+# Poisson solve; params may end with the float32 matrix and preconditioner
+# of the mixed precision solve (see jax_tools.mixed_pars)
+def poisson(b, u0, tol, params):
+    A, D = params[3:5]
+    if len(params) > 8:
+        return pcg_mixed(A, *params[8], b, u0, tol)
+    return pcg(A, D, b, u0, tol)
+
+@jit
+def hmag_g(m, u0, tol, params):
+    dx, dy, dz, A, D, gx, gy, gz = params[:8]
+
+    #def Afunc(x):
+    #    return A @ x
+
+    if m.ndim == 2:                                  # (3,N) layout
+        b = dx@m[0] + dy@m[1] + dz@m[2]
+        u, k = poisson(b, u0, tol, params)
+        return np.stack([gx@u,gy@u,gz@u]), u, k
+    b = dx@m[0::3] + dy@m[1::3] + dz@m[2::3] 
+    u, k = poisson(b, u0, tol, params)
+    g = np.concatenate([gx@u,gy@u,gz@u]).reshape(3,-1).T.flatten()
+    return g, u, k
+
+@jit
+def hmag_e(m, u0, tol, params):
+    g, u, _ = hmag_g(m, u0, tol, params)
+    return 0.5 * np.vdot(m, g), u
+    
+@jit
+def hmag_eg(m, u0, tol, params):
+    #jax.debug.print('u in  hmag {out}',out=u0[4729])
+    #jax.debug.print('tol_u {tol}',tol=tol)
+    g, u, k = hmag_g(m, u0, tol, params)
+    #jax.debug.print('u out hmag {out}',out=u[4729])
+    return 0.5 * np.vdot(m, g), g, u, k
+
+# inexact Poisson solve: the relative tolerance follows the projected gradient
+# of the previous evaluation, eta*|g|, between tol and sqrt(tol); it is tol if
+# eta is 0 or there is no previous gradient
+@jit
+def hmag_tol(m, gradF, tol, eta):
+    if gradF is None:
+        return tol
+    gnorm = np.max(np.abs(project(m, gradF)))
+    return np.where(eta > 0, np.clip(eta*gnorm, tol, np.sqrt(tol)), tol)
+
+@jit
+def projection(m, g):  # eq (15) Computer Physics Communications 235 (2019) 179–186
+    if m.ndim == 2:                                  # (3,N) layout
+        return np.cross(m, np.cross(g, m, axis=0), axis=0)
+    m_ = np.reshape(m,(-1,3))
+    g_ = np.reshape(g,(-1,3))
+    return np.cross(m_, np.cross(g_, m_)).flatten()
+    
+# projection with m x (g x m) = g (m.m) - m (m.g), a single elementwise pass
+@jit
+def project(m, g):
+    axis = 0 if m.ndim == 2 else 1
+    m_ = m if m.ndim == 2 else m.reshape(-1,3)
+    g_ = g if g.ndim == 2 else g.reshape(-1,3)
+    mm = np.sum(m_*m_, axis=axis, keepdims=True)
+    mg = np.sum(m_*g_, axis=axis, keepdims=True)
+    return (g_*mm - m_*mg).reshape(g.shape)
+
+# Zeeman, exchange and anisotropy energy and gradient: the Zeeman gradient is
+# broadcast from meas and the field direction into the sum with C@m, so the
+# only full length temporary is the SpMV result
+@jit
+def local_eg(m, value, params):
+    C, direction, meas, volume = params
+    direction = np.asarray(direction)
+    Cm = exani_g(m, C)
+    if m.ndim == 2:
+        h = direction[:,None] * meas[None,:]
+    else:
+        h = (meas[:,None] * direction[None,:]).reshape(-1)
+    g = Cm - (value/volume) * h
+    return np.vdot(m, 0.5*Cm - (value/volume) * h), g
+
+# stats: number of calls and of Poisson CG iterations, other: u0 and gradF;
+# further entries of both belong to the caller and are passed through
+@jit
+def total_eg(m, args, other, stats):
+    u0, gradF = other[:2]
+    tol, field_value, pars = args
+    calls, hmag_iter = stats[:2]
+    local_pars = pars['exani_pars'][0], pars['hext_pars'][0], pars['meas'], pars['volume']
+    energy, gradient = local_eg(m, field_value, local_pars)
+    
+    tol = hmag_tol(m, gradF, tol, pars['min_pars'][4])
+    hmag_pars = pars['hmag_pars']
+    if 'hmag_precond' in pars:                       # replaces the diagonal, see amg.py
+        hmag_pars = hmag_pars[:4] + (pars['hmag_precond'],) + hmag_pars[5:]
+    if 'hmag32' in pars:                             # mixed precision, see jax_tools.mixed_pars
+        hmag_pars = hmag_pars + (pars['hmag32'],)
+
+    def hmag_true(_):
+        return hmag_eg(m, u0, tol, hmag_pars)
+    
+    def hmag_false(_):
+        zero_energy = 0.0
+        zero_gradient = np.zeros_like(gradient)  
+        return zero_energy, zero_gradient, u0, 0
+
+    e_hmag, g_hmag, u, k = lax.cond(
+        pars['hmag_on'] > 0,
+        hmag_true,
+        hmag_false,
+        operand=None
+    )
+    
+    energy   += e_hmag
+    gradient += g_hmag
+
+    return energy, project(m,gradient), (u, gradient) + other[2:], (calls+1, hmag_iter+k) + stats[2:]
+    
+# time and temporary memory of total_eg with interleaved (3N,) and (3,N)
+# layout of the magnetization, with and without magnetostatics, and of the
+# fused local terms
+if __name__ == "__main__":
+    from time import time
+    from jax_tools import to_soa, soa_pars
+    from mapping import escript2arrays
+
+    try:
+        name = sys.argv[1]
+    except IndexError:
+        sys.exit("usage run-escript energies.py modelname")
+
+    n_eval = 20
+    m, pars, _ = escript2arrays(name)
+    h, start, final, step = pars['hext_pars']
+    tol_u = pars['min_pars'][0]
+    with open(name + "_layout.csv", "w") as file:
+        file.write("layout,hmag_on,nodes,time_per_evaluation,temp_bytes\n")
+        for layout, x, p in (('aos', m, pars), ('soa', to_soa(m), soa_pars(pars))):
+            for hmag_on in (0, 1):
+                args = tol_u, start, dict(p, hmag_on=hmag_on)
+                other = np.zeros(x.size//3), np.zeros_like(x)
+                compiled = total_eg.lower(x, args, other, (0, 0)).compile()
+                memory = compiled.memory_analysis()
+                jax.block_until_ready(compiled(x, args, other, (0, 0)))
+                t0 = time()
+                for _ in range(n_eval):
+                    out = compiled(x, args, other, (0, 0))
+                jax.block_until_ready(out)
+                elapsed = (time() - t0) / n_eval
+                temp_bytes = getattr(memory, 'temp_size_in_bytes', -1)
+                file.write(f"{layout},{hmag_on},{x.size//3},{elapsed},{temp_bytes}\n")
+                print(layout, 'hmag_on', hmag_on, 'time', elapsed, 's', 'temp', temp_bytes, 'bytes')
+
+    # local terms: composition of external_eg, exani_eg and projection
+    # versus the fused local_eg and project
+    @jit
+    def composed(m, value, pars):
+        e1, g1 = external_eg(m, value, (pars['hext_pars'][0], pars['meas'], pars['volume']))
+        e2, g2 = exani_eg(m, pars['exani_pars'][0])
+        return e1 + e2, projection(m, g1 + g2)
+
+    @jit
+    def fused(m, value, pars):
+        e, g = local_eg(m, value, (pars['exani_pars'][0], pars['hext_pars'][0], pars['meas'], pars['volume']))
+        return e, project(m, g)
+
+    with open(name + "_fused.csv", "w") as file:
+        file.write("layout,kernel,nodes,time_per_evaluation,temp_bytes,max_difference\n")
+        for layout, x, p in (('aos', m, pars), ('soa', to_soa(m), soa_pars(pars))):
+            reference = composed(x, start, p)
+            for kernel, f in (('composed', composed), ('fused', fused)):
+                compiled = f.lower(x, start, p).compile()
+                memory = compiled.memory_analysis()
+                e, g = jax.block_until_ready(compiled(x, start, p))
+                t0 = time()
+                for _ in range(n_eval):
+                    out = compiled(x, start, p)
+                jax.block_until_ready(out)
+                elapsed = (time() - t0) / n_eval
+                temp_bytes = getattr(memory, 'temp_size_in_bytes', -1)
+                diff = float(np.max(np.abs(g - reference[1])))
+                file.write(f"{layout},{kernel},{x.size//3},{elapsed},{temp_bytes},{diff}\n")
+                print(layout, kernel, 'time', elapsed, 's', 'temp', temp_bytes, 'bytes')
@@ -1,9 +1,9 @@
 import esys.escript as e
-from esys.finley import ReadMesh
 from esys.escript.linearPDEs import LinearSinglePDE
 from esys.weipa import saveVTK
 import numpy
 from converters import toEscriptScalar, toEscriptVector
+from mesh import read_mesh
 
 def dot(a, b):
     np_a = e.convertToNumpy(a)
@@ -17,7 +17,7 @@ def get_meas(Js):
     return pde.getRightHandSide()
     
 def readmesh_get_tags(name):
-    domain = ReadMesh(name + ".fly")
+    domain = read_mesh(name)
     return e.makeTagMap(e.Function(domain))
     
 def write_m(name,counter,m,tags):
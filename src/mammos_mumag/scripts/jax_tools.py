@@ -1,8 +1,15 @@
-from jax import jit
+import os
+
+import jax
+from jax import jit, monitoring
+from jax.experimental import sparse
 import jax.numpy as np
 
 @jit
 def normalize_vectors(m):
+    if m.ndim == 2:                                  # (3,N) layout
+        norms = np.linalg.norm(m, axis=0, keepdims=True)
+        return m / np.where(norms == 0, 1.0, norms)
     vectors = m.reshape(-1, 3)
     norms = np.linalg.norm(vectors, axis=1, keepdims=True)
     normalized_vectors = vectors / np.where(norms == 0, 1.0, norms)
@@ -17,8 +24,73 @@ def update_m(m,step,d):
    m1 =  m + step*d
    return normalize_vectors(m1)
 
+# maximum norm of a vector in either layout
+@jit
+def norm_inf(x):
+    return np.max(np.abs(x))
+
+# Structure of arrays layout: the magnetization is a (3,N) array of its
+# components instead of the interleaved (3N,) vector mx0,my0,mz0,mx1,...
+# The energy functions select the layout from m.ndim; conversions are done
+# at setup and output only.
+def to_soa(x):
+    return x.reshape(-1, 3).T
+
+def from_soa(x):
+    return x.T.reshape(-1)
+
+# pars for the (3,N) layout: rows and columns of the exchange and anisotropy
+# matrix are renumbered from interleaved to component blocks
+def soa_pars(pars):
+    C, D = pars['exani_pars']
+    n = C.shape[0] // 3
+    indices = (C.indices % 3) * n + C.indices // 3
+    C = sparse.BCOO((C.data, indices), shape=C.shape).sort_indices()
+    pars = dict(pars)
+    pars['exani_pars'] = C, to_soa(D)
+    return pars
+
+# Mixed precision: the inner solves, the preconditioning CG of the minimizer
+# and the Poisson CG, run with float32 copies of their matrices; the float64
+# matrices are kept for energies and gradients. Integer leaves (sparse
+# indices) are not converted.
+def to_float32(tree):
+    def convert(a):
+        return a.astype(np.float32) if np.issubdtype(a.dtype, np.floating) else a
+    return jax.tree_util.tree_map(convert, tree)
+
+# pars with the float32 matrices, after soa_pars and the Poisson
+# preconditioner (amg.set_hmag_precond) are set up
+def mixed_pars(pars):
+    A, D = pars['hmag_pars'][3:5]
+    pars = dict(pars)
+    pars['exani32'] = to_float32(pars['exani_pars'])
+    pars['hmag32'] = to_float32((A, pars.get('hmag_precond', D)))
+    return pars
+
 @jit   
 def dot_magnetizations(a, b):
     a_vectors = a.reshape((-1, 3))
     b_vectors = b.reshape((-1, 3))
     return np.sum(a_vectors * b_vectors, axis=1, keepdims=True)
+
+# persistent compilation cache, enabled if the environment variable is set
+COMPILATION_CACHE_VARIABLE = "MAMMOS_MUMAG_COMPILATION_CACHE_DIR"
+compilation_cache_events = {'hits': 0, 'misses': 0}
+
+def count_compilation_cache_event(event, **kwargs):
+    if event.endswith('/compilation_cache/cache_hits'):
+        compilation_cache_events['hits'] += 1
+    elif event.endswith('/compilation_cache/cache_misses'):
+        compilation_cache_events['misses'] += 1
+
+def setup_compilation_cache():
+    cache_dir = os.environ.get(COMPILATION_CACHE_VARIABLE)
+    if cache_dir:
+        jax.config.update("jax_compilation_cache_dir", cache_dir)
+        jax.config.update("jax_persistent_cache_min_compile_time_secs", 0.0)
+        jax.config.update("jax_persistent_cache_min_entry_size_bytes", 0)
+        if not compilation_cache_events.get('listening'):
+            monitoring.register_event_listener(count_compilation_cache_event)
+            compilation_cache_events['listening'] = True
+    return cache_dir
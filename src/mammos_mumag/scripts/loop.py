@@ -1,174 +1,478 @@
-import inspect
-import jax
-jax.config.update("jax_enable_x64", True)
-import sys
-from time import time
-from functools import partial
-import os
-
-import jax.numpy as np
-from jax import jit, lax
-import numpy
-
-from energies import total_eg, projection
-from mapping import escript2arrays, update_pars, initial_m
-from minimizers import hestenes_stiefel_ncg
-from solvers import truncated_cg_diag_precond_jit, truncated_cg_jit, jax_scipy_cg
-from store import pickle2jax
-from tools import write_mh, write_stats, get_memory_usage
-from jax_tools import update_m, dot_magnetizations
-
-from escript_tools import write_magnetization_and_potential, readmesh_get_tags
-
-import gc
-
-@jit
-def compute_mh(m, pars):
-    direction, meas, volume = pars 
-    return (
-        np.dot(
-            (
-                  direction[0] * m[0::3]
-                + direction[1] * m[1::3]
-                + direction[2] * m[2::3]
-            ),
-            meas,
-        )
-        / volume
-    )
-                  
-@jit
-def M_inv(x,g,func_args,alt_args):
-   tol, field_value, pars = func_args
-   C = pars['exani_pars'][0] 
-   D = pars['exani_pars'][1] 
-   #D = np.ones(len(x))
-   _, gradF = alt_args
-   min_pars = pars['min_pars']
-   precond_iter =  min_pars[2]
-   
-   def A(v):                                         # eq (22) Computer Physics Communications 235 (2019) 179–186
-       r1 = projection(m,C@v) 
-       r2 = dot_magnetizations(m,gradF)*v.reshape(-1,3)
-       return r1 - r2.flatten() 
-       
-   return truncated_cg_diag_precond_jit(A,-g,D,max_iter=precond_iter) 
-
-
-@jit
-def minimize(m, field_value, pars, alt_args, stats):
-  min_pars = pars['min_pars']
-  tol_u = min_pars[0]
-  tol_fun = min_pars[1]
-  args = tol_u, field_value, pars
-  energy, m, cg_iter, alt_args, stats = hestenes_stiefel_ncg(m, total_eg, args, alt_args, stats, tol_fun, update_m, M_inv)
-  return energy, m, cg_iter, alt_args, stats
-  
-def save_callback(m,u,counter):
-    write_magnetization_and_potential(name,counter+1,m,u,tags)
-    return counter + 1
-  
-@partial(jit, static_argnums=(0,3,))
-def solve(name, m0, pars, max_steps):
-    mfinal = pars['mag_pars'][2]
-    mstep  = pars['mag_pars'][-3]
-    hdir   = pars['hext_pars'][0]
-    hstart = pars['hext_pars'][1]
-    hstep  = pars['hext_pars'][3]
-
-    stats = 0
-    mh = np.finfo(m0.dtype).max
-
-    rec = np.zeros((max_steps, 4)) 
-    u0 = np.zeros(len(m0)//3)
-    gradF = np.zeros(len(m0))
-    alt_args = (u0, gradF)
-    
-    save_counter = 0
-    last_saved_mh = mh
-    
-    def cond(state):
-        _, mh, _, _, _, _, _, idx, _, _ = state
-        return np.logical_and(
-            mh > mfinal,
-            idx < max_steps
-        )
-
-    def body(state):
-        m, mh, hext, cum_iter, alt_args, stats, rec, idx, counter, last_saved_mh  = state
-        energy, m, cg_iter, alt_args, stats = minimize(m, hext, pars, alt_args, stats)
-        u, _ = alt_args
-        mh = compute_mh(m, (hdir, pars['meas'], pars['volume']))
-        # jax.debug.print("--> demag {hext} {mh}", hext=hext, mh=mh)
-        should_save = (last_saved_mh - mh) > mstep
-      
-        def true_fun(_):
-            new_counter = jax.experimental.io_callback(
-                save_callback,
-                jax.ShapeDtypeStruct((), np.int64),
-                m, u, counter
-            )
-            return new_counter, mh
-
-        def false_fun(_):
-            return counter, last_saved_mh
-
-        counter, last_saved_mh = lax.cond(should_save, true_fun, false_fun, operand=None)
-        rec = rec.at[idx].set(np.array([counter, hext, mh, energy]))
-        
-        return m, mh, hext+hstep, cum_iter+cg_iter, alt_args, stats, rec, idx+1, counter, last_saved_mh
-
-    state = m0, mh, hstart, 0, alt_args, stats, rec, 0, save_counter, last_saved_mh
-    _, _, _, cum_iter, _, stats, rec, idx, _, _ = lax.while_loop(cond, body, state)
-
-    return cum_iter, stats, rec, idx
-
-def loop(name,m,pars):
-    # print(pars)
-    hstart = pars['hext_pars'][1]
-    hfinal = pars['hext_pars'][2]
-    hstep  = pars['hext_pars'][3]
-    max_iter = int(abs(hfinal-hstart)/abs(hstep))+1
-    
-    t0 = time()    
-    cg_iter, stats, rec, idx = solve(name,m,pars,max_iter)
-    total_time  = time()-t0
-    
-    hmag_iter = 0
-    
-    function_calls = stats
-    # write_stats('done',total_time,cg_iter,function_calls,hmag_iter)
-                
-    write_mh(name,rec[:idx])
-
-if __name__ == "__main__":
-    try:
-        name = sys.argv[1]
-    except IndexError:
-        sys.exit("usage run-escript loop.py modelname")
-    
-    memory_pre = get_memory_usage()
-    if os.path.exists(f'{name}.pkl'):
-        print('read stored matrices')
-        m, pars = pickle2jax(name)
-        tags    = readmesh_get_tags(name)
-        update_pars(name, pars)
-        m = initial_m(tags.getDomain(),pars)
-    else:
-        m, pars, tags = escript2arrays(name,0)
-    memory_post = get_memory_usage()
-    gc.collect()
-    memory_collected = get_memory_usage()
-
-    with open(name + "_stats.txt", "w") as file:
-        file.write(
-            inspect.cleandoc(
-                f"""
-                Memory before escript2jax: {memory_pre} MB.
-                Memory after  escript2jax: {memory_post} MB.
-                Memory after garbage collection: {memory_collected} MB.
-                """
-            )
-        )
-    
-    loop(name,m,pars) 
+import inspect
+import jax
+jax.config.update("jax_enable_x64", True)
+import sys
+from time import time
+from functools import partial
+import os
+
+import jax.numpy as np
+from jax import jit, lax
+import numpy
+
+from amg import set_hmag_precond
+from energies import total_eg, project, exani_g
+from mapping import escript2arrays, update_pars, initial_m, pars2jax
+from minimizers import MINIMIZERS
+from solvers import truncated_cg_recycled, ritz_basis, truncated_cg_jit, jax_scipy_cg
+from store import cache2jax, cache_enabled, cache_key, to_cache
+from tools import write_mh, write_iterations, write_stats, get_memory_usage, read_directions, read_step_params, normalize, get_mu0
+from jax_tools import update_m, normalize_vectors, dot_magnetizations, to_soa, soa_pars, mixed_pars, setup_compilation_cache, compilation_cache_events
+
+from escript_tools import readmesh_get_tags
+from vtu import get_writer, snapshot_writer, AsyncWriter
+
+import gc
+
+@jit
+def compute_mh(m, pars):
+    direction, meas, volume = pars 
+    if m.ndim == 2:                                  # (3,N) layout
+        return np.dot(np.asarray(direction) @ m, meas) / volume
+    return (
+        np.dot(
+            (
+                  direction[0] * m[0::3]
+                + direction[1] * m[1::3]
+                + direction[2] * m[2::3]
+            ),
+            meas,
+        )
+        / volume
+    )
+                  
+# preconditioned gradient by truncated CG with the projected Hessian of the
+# exchange and anisotropy at the initial magnetization of the loop. With
+# precond_recycle > 0 the CG is deflated by the Ritz vectors of its slowest
+# modes, kept in alt_args[2] and updated from the directions of each CG (see
+# solvers.truncated_cg_recycled); the products with C are counted in stats[2]
+@jit
+def M_inv(x,g,func_args,alt_args,stats):
+   tol, field_value, pars = func_args
+   C = pars['exani_pars'][0] 
+   D = pars['exani_pars'][1] 
+   #D = np.ones(len(x))
+   gradF = alt_args[1]
+   m = pars['m_init']                                # initial magnetization of the loop
+   min_pars = pars['min_pars']
+   precond_iter =  min_pars[2]
+   dtype = g.dtype
+   if 'exani32' in pars:                             # mixed precision, see jax_tools.mixed_pars
+       C, D = pars['exani32']
+       m, g, gradF = (v.astype(np.float32) for v in (m, g, gradF))
+   
+   if m.ndim == 2:                                   # (3,N) layout, CG on the flattened components
+       def K(v):
+           return project(m,exani_g(v.reshape(m.shape),C)).reshape(-1)
+       s = np.broadcast_to(np.sum(m*gradF,axis=0), m.shape).reshape(-1)
+   else:
+       def K(v):                                     # eq (22) Computer Physics Communications 235 (2019) 179–186
+           return project(m,C@v)
+       s = np.broadcast_to(dot_magnetizations(m,gradF), (m.size//3, 3)).reshape(-1)
+
+   recycle = len(alt_args) > 2
+   if recycle:
+       W, KW = alt_args[2]
+   else:
+       W = KW = np.zeros((0, g.size))
+   W, KW = W.astype(g.dtype), KW.astype(g.dtype)
+   p, i, V, KV = truncated_cg_recycled(K, s, -g.reshape(-1), D.reshape(-1), W, KW, max_iter=precond_iter)
+   if recycle:
+       W, KW = ritz_basis(W, KW, V, KV, D.reshape(-1))
+       alt_args = alt_args[:2] + ((W.astype(dtype), KW.astype(dtype)),)
+   return p.reshape(g.shape).astype(dtype), alt_args, stats[:2] + (stats[2] + i,) + stats[3:]
+
+# alt_args of the minimizer: Poisson solution, gradient and, with
+# precond_recycle > 0, the recycled basis of the preconditioner
+def initial_alt_args(m0, pars):
+    alt_args = np.zeros(m0.size//3, dtype=m0.dtype), np.zeros_like(m0)
+    k = int(pars['min_pars'][9])
+    if k > 0:
+        basis = np.zeros((k, m0.size), dtype=m0.dtype)
+        alt_args += ((basis, basis),)
+    return alt_args
+
+# engine: index of minimizers.MINIMIZERS, min_pars[10] on the host
+@partial(jit, static_argnums=(5,))
+def minimize(m, field_value, pars, alt_args, stats, engine=0):
+  min_pars = pars['min_pars']
+  tol_u = min_pars[0]
+  tol_fun = min_pars[1]
+  args = tol_u, field_value, pars
+  energy, m, cg_iter, alt_args, stats = MINIMIZERS[engine](m, total_eg, args, alt_args, stats, tol_fun, update_m, M_inv)
+  return energy, m, cg_iter, alt_args, stats
+  
+# prefix of the files written during the loop and the background writer of
+# the snapshots, set by loop()
+output_name = None
+snapshots = None
+
+def save_callback(m,u,counter):
+    if m.ndim == 2:                                  # (3,N) layout
+        m = m.T.reshape(-1)
+    snapshots.write(counter + 1, m=m, u=u)
+    return counter + 1
+
+# Checkpoints: the state of the loop is written to <prefix>_checkpoint.npz
+# every MAMMOS_MUMAG_CHECKPOINT_INTERVAL field steps (pars['checkpoint_steps'],
+# 0 for none), and a loop started with MAMMOS_MUMAG_RESUME continues from it.
+# A completed loop leaves the checkpoint of its final state; resuming it
+# computes no field steps unless mfinal was lowered. The rows of <prefix>.dat
+# and <prefix>_iterations.dat are appended after every field step; only these
+# rows are passed to the host, the state only when a checkpoint is due. Rows
+# and checkpoints go through the queue of the snapshot writer, so a checkpoint
+# is written after the snapshots it refers to. The wall time of a field step,
+# including repeated steps, is the host time between the calls of
+# step_callback; it stays on the host and is put into the last column of iters
+# of the checkpoints and of the final table. With verbose > 0 the counters of
+# a field step are printed here, once per step.
+CHECKPOINT_INTERVAL_VARIABLE = "MAMMOS_MUMAG_CHECKPOINT_INTERVAL"
+RESUME_VARIABLE = "MAMMOS_MUMAG_RESUME"
+WORKER_VARIABLE = "MAMMOS_MUMAG_WORKER"
+checkpoint = {'filename': None}
+diagnostics = {'time': 0.0, 'verbose': 0, 'wall_time': None}
+
+def write_checkpoint(filename, leaves):
+    with open(filename + ".tmp", "wb") as f:
+        numpy.savez(f, **{f"leaf_{i}": a for i, a in enumerate(leaves)})
+    os.replace(filename + ".tmp", filename)
+
+# state with the structure and types of the given state
+def read_checkpoint(filename, state):
+    leaves, treedef = jax.tree_util.tree_flatten(state)
+    with numpy.load(filename) as data:
+        loaded = [data[f"leaf_{i}"] for i in range(len(leaves))]
+    for a, b in zip(leaves, loaded):
+        if numpy.shape(a) != b.shape or numpy.result_type(a) != b.dtype:
+            raise RuntimeError(f"{filename} does not match the loop")
+    return jax.tree_util.tree_unflatten(treedef, [np.asarray(b) for b in loaded])
+
+# iters with the wall times measured on the host
+def with_wall_time(state):
+    iters = numpy.array(state[7])
+    iters[:, -1] = diagnostics['wall_time']
+    return state[:7] + (iters,) + state[8:]
+
+# rows of field step idx (counted from 0)
+def step_callback(rec, iters, idx):
+    now = time()
+    iters = numpy.array(iters)
+    iters[-1] = diagnostics['wall_time'][idx] = now - diagnostics['time']
+    diagnostics['time'] = now
+    snapshots.call(write_mh, output_name, numpy.array(rec)[None], "a")
+    snapshots.call(write_iterations, output_name, iters[None], "a")
+    if diagnostics['verbose'] > 0:
+        hext, cg_iter, calls, hmag_iter, precond_iter, _, backtracks, restarts, wall_time = iters
+        print(f"field step {idx+1}: hext {hext} NCG iterations {int(cg_iter)} energy evaluations {int(calls)} "
+              f"Poisson CG {int(hmag_iter)} preconditioner CG {int(precond_iter)} backtracks {int(backtracks)} "
+              f"restarts {int(restarts)} time {wall_time:.3f} s", flush=True)
+
+def checkpoint_callback(state):
+    leaves = [numpy.array(a) for a in jax.tree_util.tree_leaves(with_wall_time(state))]
+    snapshots.call(write_checkpoint, checkpoint['filename'], leaves)
+  
+# start of a field step: magnetization and scalar potential of the previous
+# step, or if extrapolate is set, linear extrapolation from the previous two steps;
+# ratio is the current over the previous field step
+@jit
+def predict(m, u, m_prev, u_prev, idx, extrapolate, ratio):
+    def extrapolation(_):
+        return normalize_vectors((1+ratio)*m - ratio*m_prev), (1+ratio)*u - ratio*u_prev
+    def previous(_):
+        return m, u
+    return lax.cond(np.logical_and(extrapolate > 0, idx >= 2), extrapolation, previous, operand=None)
+
+# sparse matrix-vector products: per energy evaluation C@m and, with
+# magnetostatics, dx, dy, dz, the initial Poisson residual and gx, gy, gz;
+# one per Poisson CG iteration and one per preconditioner CG iteration. The
+# multigrid preconditioner is applied once per Poisson solve and once per
+# iteration, with four products per level (see solvers.vcycle). The mixed
+# precision solve is counted as a single refinement step: the residuals and
+# the preconditioner applications of further steps are not included
+def spmv_count(stats, pars):
+    calls, hmag_iter, precond_spmv = stats[:3]
+    hmag_on = pars['hmag_on']
+    count = calls*(1 + 7*hmag_on) + hmag_iter + precond_spmv
+    if 'hmag_precond' in pars:
+        count += 4*len(pars['hmag_precond'][0]) * (hmag_iter + calls*hmag_on)
+    return count
+
+# state of the loop: m, mh, hext, NCG iterations, alt_args, stats (energy
+# evaluations, Poisson CG iterations, preconditioner CG iterations, line
+# search backtracks, restarts; all counted on the device), rec, iters, idx,
+# counter, last_saved_mh, m_prev, u_prev, k, dk, dk_prev, repeated steps;
+# built on the host, so that a loop can be resumed from a checkpoint
+def initial_state(m0, pars, max_steps):
+    i, f = numpy.int64, numpy.dtype(m0.dtype).type
+    mh = f(numpy.finfo(m0.dtype).max)
+    alt_args = initial_alt_args(m0, pars)
+    rec = np.zeros((max_steps, 4))
+    iters = np.zeros((max_steps, 9))
+    return (m0, mh, f(pars['hext_pars'][1]), i(0), alt_args, (i(0),)*5, rec, iters,
+            i(0), i(0), mh, m0, alt_args[0], i(0), i(1), i(1), i(0))
+
+# field steps on the grid hstart + k*hstep, k = 0..max_steps-1; with
+# adaptive steps (see tools.read_step_params) the step dk is a power of two
+# in units of hstep, doubled only where k is a multiple of the doubled step,
+# so the fields of a coarse step are fields of the uniform loop. A step with a
+# jump of mh is repeated from the last state with half the step.
+@partial(jit, static_argnums=(0,3,4,))
+def solve(name, state, pars, max_steps, engine):
+    mfinal = pars['mag_pars'][2]
+    mstep  = pars['mag_pars'][-3]
+    hdir   = pars['hext_pars'][0]
+    hstep  = pars['hext_pars'][3]
+    extrapolate = pars['min_pars'][5]
+    levels, dm_grow, dm_jump, iter_grow = pars['step_pars']
+    checkpoint_steps = pars['checkpoint_steps']
+    kmax = max_steps - 1
+
+    def cond(state):
+        _, mh, _, _, _, _, _, _, idx, _, _, _, _, k, _, _, _ = state
+        return np.logical_and(
+            mh > mfinal,
+            np.logical_and(idx < max_steps, k <= kmax)
+        )
+
+    def body(state):
+        m, mh, hext, cum_iter, alt_args, stats, rec, iters, idx, counter, last_saved_mh, m_prev, u_prev, k, dk, dk_prev, rejected = state
+        m1, u1 = predict(m, alt_args[0], m_prev, u_prev, idx, extrapolate, dk/dk_prev)
+        energy, m1, cg_iter, alt_args1, stats1 = minimize(m1, hext, pars, (u1,) + alt_args[1:], stats, engine)
+        u1 = alt_args1[0]
+        mh1 = compute_mh(m1, (hdir, pars['meas'], pars['volume']))
+        # jax.debug.print("--> demag {hext} {mh}", hext=hext, mh=mh1)
+        dmh = np.abs(mh1 - mh)
+        reject = np.logical_and(np.logical_and(idx > 0, dk > 1), dmh > dm_jump)
+
+        def repeat(_):
+            half = dk // 2
+            return (m, mh, hext - (dk-half)*hstep, cum_iter+cg_iter, alt_args, stats1, rec, iters, idx,
+                    counter, last_saved_mh, m_prev, u_prev, k - (dk-half), half, dk_prev, rejected+1)
+
+        def accept(_):
+            should_save = (last_saved_mh - mh1) > mstep
+
+            def true_fun(_):
+                new_counter = jax.experimental.io_callback(
+                    save_callback,
+                    jax.ShapeDtypeStruct((), np.int64),
+                    m1, u1, counter
+                )
+                return new_counter, mh1
+
+            def false_fun(_):
+                return counter, last_saved_mh
+
+            new_counter, new_saved_mh = lax.cond(should_save, true_fun, false_fun, operand=None)
+            rec_row = np.array([new_counter, hext, mh1, energy])
+            new_rec = rec.at[idx].set(rec_row)
+            # columns of <prefix>_iterations.dat, see tools.write_iterations
+            dstats = tuple(b - a for a, b in zip(stats, stats1))
+            iters_row = np.array([hext, cg_iter, *dstats[:3], spmv_count(dstats, pars), *dstats[3:], 0.0])
+            new_iters = iters.at[idx].set(iters_row)
+            grow = np.logical_and(np.logical_and(dmh < dm_grow, cg_iter <= iter_grow),
+                                  np.logical_and(2*dk <= 2**levels, k % (2*dk) == 0))
+            dk_next = np.minimum(np.where(grow, 2*dk, dk), np.maximum(kmax - k, 1))
+            new_state = (m1, mh1, hext + dk_next*hstep, cum_iter+cg_iter, alt_args1, stats1, new_rec, new_iters, idx+1,
+                         new_counter, new_saved_mh, m, alt_args[0], k + dk_next, dk_next, dk, rejected)
+            # the rows of the step and checkpoints are written on the host
+            jax.experimental.io_callback(step_callback, None, rec_row, iters_row, idx, ordered=True)
+            due = np.logical_and(checkpoint_steps > 0, (idx+1) % np.maximum(checkpoint_steps, 1) == 0)
+            lax.cond(due, lambda: jax.experimental.io_callback(checkpoint_callback, None, new_state, ordered=True),
+                     lambda: None)
+            return new_state
+
+        return lax.cond(reject, repeat, accept, operand=None)
+
+    return lax.while_loop(cond, body, state)
+
+# compiled solve for each signature of state and pars (e.g. the recycled basis,
+# the preconditioner and the nnz of the matrices), number of steps and
+# minimizer, reused by all loops of the process;
+# compilation uses the persistent cache if enabled
+compiled_solve = {}
+compilation_cache = None
+
+# structure, shapes and dtypes of a pytree; an executable is only valid for
+# arguments with the same signature (e.g. sparse matrices with the same nnz)
+def signature(tree):
+    leaves, treedef = jax.tree_util.tree_flatten(tree)
+    return treedef, tuple((numpy.shape(a), numpy.result_type(a).str) for a in leaves)
+
+def compile_solve(name, state, pars, max_steps):
+    engine = int(pars['min_pars'][10])
+    key = name, signature(state), signature(pars), max_steps, engine
+    if key not in compiled_solve:
+        compiled_solve[key] = solve.lower(name, state, pars, max_steps, engine).compile()
+    return compiled_solve[key]
+
+# output is written to files starting with prefix (default: name)
+def loop(name,m,pars,prefix=None):
+    global output_name, snapshots
+    output_name = name if prefix is None else prefix
+    # print(pars)
+    hstart = pars['hext_pars'][1]
+    hfinal = pars['hext_pars'][2]
+    hstep  = pars['hext_pars'][3]
+    max_iter = int(abs(hfinal-hstart)/abs(hstep))+1
+    
+    state = initial_state(m, pars, max_iter)
+    checkpoint_file = output_name + "_checkpoint.npz"
+    checkpoint['filename'] = checkpoint_file
+    pars['checkpoint_steps'] = numpy.int64(os.environ.get(CHECKPOINT_INTERVAL_VARIABLE, 0))
+    resume_counter = None
+    if os.environ.get(RESUME_VARIABLE) and os.path.exists(checkpoint_file):
+        state = read_checkpoint(checkpoint_file, state)
+        idx, resume_counter = int(state[8]), int(state[9])
+        print(f'{output_name}: resume at field step {idx}')
+        write_mh(output_name, numpy.array(state[6][:idx]))
+        write_iterations(output_name, numpy.array(state[7][:idx]))
+    else:
+        write_mh(output_name, [])
+        write_iterations(output_name, [])
+
+    hits, misses = compilation_cache_events['hits'], compilation_cache_events['misses']
+    t0 = time()
+    solver = compile_solve(name,state,pars,max_iter)
+    compile_time = time()-t0
+
+    # the solve time includes writing the last snapshots
+    t0 = time()    
+    snapshots = AsyncWriter(snapshot_writer(writer, output_name, resume_counter))
+    diagnostics.update(time=time(), verbose=int(pars.get('verbose', 0)), wall_time=numpy.array(state[7][:, -1]))
+    try:
+        state = jax.block_until_ready(solver(state,pars))
+    finally:
+        snapshot_errors = snapshots.close()
+    total_time  = time()-t0
+    
+    state = with_wall_time(state)
+    _, _, _, cg_iter, _, stats, rec, iters, idx, _, _, _, _, _, _, _, rejected = state
+    function_calls, hmag_iter, precond_iter, backtracks, restarts = stats
+    spmv_note = ' (without refinement steps after the first)' if 'hmag32' in pars else ''
+                
+    mh = numpy.array(rec[:idx])
+    write_mh(output_name,mh)
+    write_iterations(output_name,iters[:idx])
+
+    with open(output_name + "_stats.txt", "a") as file:
+        file.write(
+            "\n" + inspect.cleandoc(
+                f"""
+                Compilation cache: {compilation_cache or 'off'}.
+                Compilation cache hits: {compilation_cache_events['hits'] - hits}.
+                Compilation cache misses: {compilation_cache_events['misses'] - misses}.
+                Compile time: {compile_time} s.
+                Solve time: {total_time} s.
+                NCG iterations: {cg_iter}.
+                Energy evaluations: {function_calls}.
+                Poisson CG iterations: {hmag_iter}.
+                Preconditioner CG iterations: {precond_iter}.
+                Line search backtracks: {backtracks}.
+                Restarts: {restarts}.
+                SpMVs{spmv_note}: {spmv_count(stats, pars)}.
+                Field steps: {idx}.
+                Repeated field steps: {rejected}.
+                """
+            ) + "\n"
+        )
+
+    if snapshot_errors:
+        raise RuntimeError("snapshots not written:\n" + "\n".join(snapshot_errors))
+    if pars['checkpoint_steps'] > 0:
+        write_checkpoint(checkpoint_file, [numpy.array(a) for a in jax.tree_util.tree_leaves(state)])
+    elif os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    mh[:,3] /= get_mu0()
+    return mh
+
+# one loop per field direction in the same process; the matrices and the
+# compiled solve are reused, as only the values of hdir change.
+# results of direction k are written to the subdirectory k
+def loop_directions(name,m,pars,directions):
+    h, hstart, hfinal, hstep = pars['hext_pars']
+    results = []
+    for k, hdir in enumerate(directions):
+        os.makedirs(str(k), exist_ok=True)
+        pars['hext_pars'] = [float(v) for v in normalize(hdir)], hstart, hfinal, hstep
+        results.append(loop(name,m,pars,os.path.join(str(k),name)))
+    pars['hext_pars'] = h, hstart, hfinal, hstep
+    return results
+
+# matrices and mesh tags of the last system, kept in memory between runs in the
+# worker process of the in-process backend (see worker.py); the key is the one
+# of the matrix cache, it hashes the mesh and is only computed in the worker or
+# if the cache is enabled
+systems = {}
+
+def setup(name):
+    keep = WORKER_VARIABLE in os.environ
+    key = cache_key(name) if keep or cache_enabled() else None
+    if keep and systems.get('key') == key:
+        print('reuse matrices')
+        pars, tags = systems['pars'], systems['tags']
+        update_pars(name, pars)
+        set_hmag_precond(pars)
+        return initial_m(tags.getDomain(),pars), pars, tags
+    systems.clear()                                # free the previous system first
+    pars = cache2jax(name, key) if cache_enabled() else None
+    if pars is not None:
+        print('read stored matrices')
+        tags    = readmesh_get_tags(name)
+        update_pars(name, pars)
+        m = initial_m(tags.getDomain(),pars)
+    elif cache_enabled():
+        m, pars, tags = escript2arrays(name,0,'numpy')
+        to_cache(name, pars, key)
+        pars2jax(pars)
+        m = np.array(m)
+    else:
+        m, pars, tags = escript2arrays(name,0)
+    if keep:
+        systems.update(key=key, pars=pars, tags=tags)
+    set_hmag_precond(pars)
+    return m, pars, tags
+
+# returns the table of <name>.dat, or a list of tables for several directions
+def run(name):
+    global writer, compilation_cache
+    compilation_cache = setup_compilation_cache()
+
+    memory_pre = get_memory_usage()
+    m, pars, tags = setup(name)
+    writer = get_writer(name, tags.getDomain())
+    memory_post = get_memory_usage()
+    gc.collect()
+    memory_collected = get_memory_usage()
+
+    with open(name + "_stats.txt", "w") as file:
+        file.write(
+            inspect.cleandoc(
+                f"""
+                Memory before escript2jax: {memory_pre} MB.
+                Memory after  escript2jax: {memory_post} MB.
+                Memory after garbage collection: {memory_collected} MB.
+                """
+            )
+        )
+    
+    if pars['min_pars'][7] == 1:
+        m = to_soa(m)
+        pars = soa_pars(pars)
+    if pars['min_pars'][8] == 1:
+        pars = mixed_pars(pars)
+    pars['m_init'] = m
+    pars['step_pars'] = read_step_params(name)
+    directions = read_directions(name)
+    if directions is None:
+        return loop(name,m,pars)
+    else:
+        return loop_directions(name,m,pars,directions) 
+
+if __name__ == "__main__":
+    try:
+        name = sys.argv[1]
+    except IndexError:
+        sys.exit("usage run-escript loop.py modelname")
+    
+    run(name)
@@ -6,9 +6,9 @@ import sys
 from materials import Materials
 from tools import read_params
 
-def randomM(domain):
+def randomM(domain, seed=1):
   fs = e.Solution(domain)
-  return e.normalize(2.0*e.RandomData((3,),fs,1)-1.0)
+  return e.normalize(2.0*e.RandomData((3,),fs,seed)-1.0)
 
 def getVortex(domain):
     m = e.Vector(0, e.Solution(domain))
@@ -51,7 +51,8 @@ def getTwisted(domain):
     return m
 
 
-def getM(mask, v, state=None):
+# seed: seed of the random state
+def getM(mask, v, state=None, seed=1):
     domain = mask.getDomain()
     if state == 2:
         m = mask * getVortex(domain)
@@ -62,7 +63,7 @@ def getM(mask, v, state=None):
     elif state == 3:
         m = mask * getTwisted(domain)
     elif state == 4:
-        m = mask * randomM(domain)
+        m = mask * randomM(domain, seed)
         print('create random magnetization')
     else:
         m = mask * e.Vector(v, e.Solution(domain))
@@ -1,24 +1,218 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import itertools
+import os
+import struct
 import sys
+import tempfile
+import zipfile
+from time import time
 
-from esys.finley import ReadMesh
+import numpy
+from esys.finley import LoadMesh, ReadMesh
 
 
 class Mesh:
     def __init__(self, name):
-        # print("read mesh from " + name + ".fly")
-        self._domain = ReadMesh(name + ".fly")
+        # print("read mesh from " + mesh_file(name))
+        self._domain = read_mesh(name)
 
     def getDomain(self):
         return self._domain
 
 
+# The mesh of a system is the text mesh <name>.fly or the binary mesh
+# <name>.npz written by mammos_mumag.mesh.convert_to_npz: an uncompressed
+# numpy archive with the arrays of the fly file
+#   name, node_ids, node_dofs, node_tags, x, sections,
+#   ids<k>, tags<k>, nodes<k> for the k-th element section, tag_names, tag_values
+def mesh_file(name):
+    if os.path.exists(name + ".npz"):
+        return name + ".npz"
+    return name + ".fly"
+
+# arrays of an npz archive; arrays of uncompressed members are memory mapped
+def load_npz(path):
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            key = info.filename[:-len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[key] = numpy.lib.format.read_array(member)
+                continue
+            f.seek(info.header_offset + 26)                  # local file header
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(name_length + extra_length, 1)
+            version = numpy.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject or len(shape) == 0 or numpy.prod(shape) == 0:
+                with archive.open(info) as member:
+                    arrays[key] = numpy.lib.format.read_array(member)
+            else:
+                arrays[key] = numpy.memmap(path, dtype=dtype, mode="r", offset=f.tell(),
+                                           shape=shape, order="F" if fortran else "C")
+    return arrays
+
+# write the arrays of a binary mesh as fly file, one formatting operation per block
+def write_fly(arrays, path, block=1 << 16):
+    x = arrays['x']
+    n, d = x.shape
+    with open(path, "wb") as f:
+        f.write(b"%s\n" % str(arrays['name']).encode())
+        f.write(b"%dD-nodes %d\n" % (d, n))
+        fmt = b"%d %d %d" + b" %.17g" * d + b"\n"
+        for i in range(0, n, block):
+            s = slice(i, i + block)
+            columns = [arrays[key][s].tolist() for key in ('node_ids', 'node_dofs', 'node_tags')]
+            columns += numpy.asarray(x[s]).T.tolist()
+            f.write(fmt * len(columns[0]) % tuple(itertools.chain.from_iterable(zip(*columns))))
+        for k, etype in enumerate(arrays['sections']):
+            ids, tags, nodes = arrays[f'ids{k}'], arrays[f'tags{k}'], arrays[f'nodes{k}']
+            f.write(b"%s %d\n" % (str(etype).encode(), len(ids)))
+            fmt = b"%d %d" + b" %d" * nodes.shape[1] + b"\n"
+            for i in range(0, len(ids), block):
+                s = slice(i, i + block)
+                columns = [ids[s].tolist(), tags[s].tolist()] + numpy.asarray(nodes[s]).T.tolist()
+                f.write(fmt * len(columns[0]) % tuple(itertools.chain.from_iterable(zip(*columns))))
+        f.write(b"Tags\n")
+        for tag, value in zip(arrays['tag_names'], arrays['tag_values']):
+            f.write(b"%s %d\n" % (str(tag).encode(), value))
+
+# finley domain of a mesh file. finley builds a domain only from a file
+# (ReadMesh, ReadGmsh, LoadMesh), not from arrays. The domain of a binary mesh
+# <name>.npz is loaded with LoadMesh from its finley dump <name>_domain.nc if
+# the dump is newer than the mesh. Otherwise it is built from a temporary fly
+# file, in memory if /dev/shm exists, and dumped for the next run. The dump is
+# written where <name>_domain.nc links to, next to the original or the stored
+# mesh (see Simulation.copy_mesh); it needs an escript built with NetCDF.
+def read_domain(path):
+    if not path.endswith(".npz"):
+        return ReadMesh(path)
+    dump = os.path.realpath(domain_dump_file(path))
+    if os.path.exists(dump) and os.stat(dump).st_mtime_ns >= os.stat(path).st_mtime_ns:
+        return LoadMesh(dump)
+    domain = build_domain(path)
+    tmp = f"{dump}.{os.getpid()}.tmp"
+    try:
+        domain.dump(tmp)
+        os.replace(tmp, dump)
+    except (OSError, RuntimeError):                # read-only directory or no NetCDF
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return domain
+
+def domain_dump_file(path):
+    return path[:-len(".npz")] + "_domain.nc"
+
+# finley domain of a binary mesh via a temporary fly file
+def build_domain(path):
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(dir=shm) as tmp:
+        fly = os.path.join(tmp, "mesh.fly")
+        write_fly(load_npz(path), fly)
+        return ReadMesh(fly)
+
+# the domain of the last mesh is kept and reused as long as the mesh file is
+# unchanged, Mesh, readmesh_get_tags and loop.py read the mesh only once
+domains = {}
+
+def read_mesh(name):
+    path = os.path.abspath(mesh_file(name))
+    stat = os.stat(path)
+    key = path, stat.st_mtime_ns, stat.st_size
+    if domains.get('key') != key:
+        domains.clear()
+        domains['domain'] = read_domain(path)
+        domains['key'] = key
+    return domains['domain']
+
+# nodes, elements and tags of a mesh as numpy arrays
+#   node_ids : (N,)   node ids
+#   x        : (N,d)  node coordinates
+#   elements : {type: (element ids, tags, node ids of the element)}
+#   tags     : {tag name: tag}
+def read_fly_arrays(name):
+    path = mesh_file(name)
+    if path.endswith(".npz"):
+        return read_npz_arrays(path)
+    return read_fly_file(path)
+
+def read_fly_file(path):
+    elements = {}
+    tags = {}
+    with open(path) as f:
+        f.readline()                                         # mesh name
+        num_nodes = int(f.readline().split()[1])             # <d>D-nodes <N>
+        data = numpy.loadtxt(itertools.islice(f, num_nodes), ndmin=2)
+        node_ids = data[:, 0].astype(numpy.int64)
+        x = data[:, 3:]
+        line = f.readline()
+        while line and not line.startswith("Tags"):
+            etype, num = line.split()[:2]
+            num = int(num)
+            if num > 0:
+                data = numpy.loadtxt(itertools.islice(f, num), dtype=numpy.int64, ndmin=2)
+                elements[etype] = data[:, 0], data[:, 1], data[:, 2:]
+            line = f.readline()
+        for line in f:
+            words = line.split()
+            if len(words) == 2:
+                tags[words[0]] = int(words[1])
+    return node_ids, x, elements, tags
+
+def read_npz_arrays(path):
+    arrays = load_npz(path)
+    elements = {}
+    for k, etype in enumerate(arrays['sections']):
+        if len(arrays[f'ids{k}']) > 0:
+            elements[str(etype)] = tuple(
+                numpy.asarray(arrays[f'{key}{k}'], dtype=numpy.int64) for key in ('ids', 'tags', 'nodes'))
+    tags = {str(t): int(v) for t, v in zip(arrays['tag_names'], arrays['tag_values'])}
+    return numpy.asarray(arrays['node_ids'], dtype=numpy.int64), arrays['x'], elements, tags
+
+# load times of the text and the binary mesh: arrays and finley domain,
+# the binary mesh is <name>.npz written by mammos_mumag.mesh.convert_to_npz;
+# its domain is built from a temporary fly file (npz) and loaded from the
+# finley dump (npz_dump)
+def benchmark(name, repeat=3):
+    npz = os.path.abspath(name + ".npz")
+    dump = domain_dump_file(npz)
+    if os.path.exists(npz):
+        build_domain(npz).dump(dump)
+    loaders = (
+        ("fly", name + ".fly", read_fly_file, ReadMesh),
+        ("npz", npz, read_npz_arrays, build_domain),
+        ("npz_dump", dump, lambda path: read_npz_arrays(npz), LoadMesh),
+    )
+    with open(name + "_meshload.csv", "w") as file:
+        file.write("format,size,arrays_time,domain_time\n")
+        for label, path, read_arrays, read_domain_file in loaders:
+            path = os.path.abspath(path)
+            if not os.path.exists(path):
+                continue
+            arrays_time, domain_time = [], []
+            for _ in range(repeat):
+                t0 = time()
+                read_arrays(path)
+                arrays_time.append(time() - t0)
+                t0 = time()
+                read_domain_file(path)
+                domain_time.append(time() - t0)
+            file.write(f"{label},{os.path.getsize(path)},{min(arrays_time)},{min(domain_time)}\n")
+
+
 if __name__ == "__main__":
     print("mesh:")
     try:
-        mesh = Mesh(sys.argv[1])
-
+        name = sys.argv[1]
     except IndexError:
-        print("Argument `name` missing.")
+        sys.exit("Argument `name` missing.")
+    if len(sys.argv) > 2 and sys.argv[2] == "benchmark":
+        benchmark(name)
+    else:
+        mesh = Mesh(name)
@@ -1,251 +1,411 @@
-import jax
-jax.config.update("jax_enable_x64", True)
-import jax.numpy as np
-from jax import jit, lax
-from jax.experimental import sparse
-from jax.scipy.optimize import minimize
-from functools import partial
-import scipy.sparse as sp
-import sys
-from time import time
-
-from jax_tools import update_x
-from solvers import jax_scipy_cg
-
-# Finite difference interval of algorithm 2 in AIP Advances 7, 045310 (2017)
-@jit
-def compute_h(x, d):
-    eps_m = np.finfo(x.dtype).eps
-    sqrt_eps_m = np.sqrt(eps_m)
-    
-    norm_x_2 = np.linalg.norm(x, ord=2)
-    norm_d_2 = np.linalg.norm(d, ord=2)
-    norm_d_inf = np.linalg.norm(d, ord=np.inf)
-
-    term1 = 2.0 * sqrt_eps_m * (1.0 + norm_x_2) / norm_d_2
-    term2 = sqrt_eps_m / norm_d_inf
-
-    return lax.cond(term1 < term2,
-                    lambda _: term1,
-                    lambda _: term2,
-                    operand=None)
-
-# Initial step length of algorithm 2 in AIP Advances 7, 045310 (2017)
-@jit
-def alpha_init(f0,      # energy of previous iteration
-               f,g,d,   # energy, gradient, search direction
-               g1,      # gradient at x + h*d
-               h,       # finite difference step siz
-               c=0.1,   # step length scale factor for negative curvature
-               o=0.99   # o < 1 takes more often alpha_0 from nocedal, wright eq 3.60
-               ):   
-    gd = np.dot(g,d)
-    term1 = -h*(gd/(np.dot(g1,d)-gd))
-    term1 = lax.cond(term1 < 0,
-                 lambda t: c * np.abs(t),  # negative curvature
-                 lambda t: t,
-                 term1)
-    term2 = 2.0*(f-f0)/gd
-    term2 = lax.cond(term2 < 0,
-                 lambda t: 1.0e30,        # use high value, select term1 afterwards
-                 lambda t: t,
-                 term2)
-    # jax.debug.print('initial step length {a} {b} {x}',a=term1,b=term2,x=term1<o*term2)
-    return lax.cond(term1 < o*term2,
-                    lambda _: term1,
-                    lambda _: term2,
-                    operand=None)
-
-'''
-o = 1
-iterations                1196
-  function calls          2553
-  
-o = 0.99
-iterations                1192
-  function calls          2545
-
-o = 0.98
-iterations                1215
-  function calls          2591
-
-o = 0.95
-iterations                1264
-  function calls          2689
-
-o = 0.9  
-iterations                1262
-  function calls          2685  
-  
-o = 1.01
-iterations                1203
-  function calls          2567
-
-
-o = 1.10
---> done
-iterations                1199
-  function calls          2559
-
-'''
-
-@partial(jit, static_argnums=(5,9,))
-def line_search(x,      # current magnetization
-                f0,     # energy of previous interation
-                f,g,d,  # energy, gradient, search direction  
-                func, func_args, alt_args, stats,
-                update_x):
-    
-    rho=0.5
-    c=1e-4
-    delta=0.1
-    eps=1e-6                                                          # see section 5 of hager zhang paper  
-    max_iter=20
-    
-    h  = compute_h(x, d)
-
-    x1 = update_x(x, h, d)
-    f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
-    alpha = alpha_init(f0,f,g,d,g1,h)   
-                       
-    gd = np.dot(g, d)
-    
-    def cond(state):
-        i, gd1, f1, alpha, _, _, _, _ = state
-        eps_k = eps*np.abs(f)                                         # eq 4.3 in hager zhang paper 
-        wolfe = np.logical_and((2*delta-1)*gd >= gd1,f1 <= f + eps_k) # approximate Wolfe  SIAM J. OPTIM. Vol. 16, No. 1, pp. 170–192
-        done  = np.logical_or(wolfe, f1 <= f + c * alpha * gd)        # or armijo 
-        done  = np.logical_or(done, i > max_iter)   # maximum iterations exceeded
-        return np.logical_not(done)
-  
-    def body(state):
-        i, _, _, alpha, _, _, alt_args, stats = state
-        alpha *= rho
-        jax.debug.print('STEP SIZE DECREASED to {alpha} {i}',alpha=alpha, i=i)
-        x1 = update_x(x, alpha, d)
-        f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
-        gd1 = np.dot(g1, d)         
-        return i+1, gd1, f1, alpha, x1, g1, alt_args, stats
-  
-    x1 = update_x(x, alpha, d)
-    f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
-    gd1 = np.dot(g1, d)         
-    state = 0, gd1, f1, alpha, x1, g1, alt_args, stats
-    
-    _, gd1, f1, alpha, x1, g1, alt_args, stats = lax.while_loop(cond, body, state)
-    
-    return x1, f1, g1, alt_args, stats
-
-# Algorithm 4 Computer Physics Communications 235 (2019) 179–186
-@partial(jit, static_argnums=(1,6,7,))
-def hestenes_stiefel_ncg(x, func, func_args, alt_args, stats, tol, update_x, M_inv):
-    iter_max = 100000
-    
-    f0 = np.finfo(x.dtype).max
-    f, g, alt_args, stats = func(x, func_args, alt_args, stats)
-    d = -M_inv(x, g, func_args, alt_args) # Initial search direction
-    k = 1
-    n_restart = 20
-
-    def print_restart_z1(_):
-        jax.debug.print("restart: -z1 is not a sufficient downhill direction")
-        return None
-
-    def print_restart_d(_):
-        jax.debug.print("restart:  d  is not a sufficient downhill direction")
-        return None
-
-    def no_op(_):
-        return None
-
-    def cond(state):
-        k, x0, f0, x, f, g, _, _, _ = state
-        # jax.debug.print('    min   {k} {f}',k=k,f=f)
-        a = (f0-f) > tol*(1+np.abs(f))                # gill, murray, wright, practical optimization, section 8.2.3.2
-        b = np.logical_or(np.linalg.norm((x0-x),ord=np.inf) > np.sqrt(tol)*(1+np.linalg.norm(x,ord=np.inf)),k==0)
-        c = np.linalg.norm(g,ord=np.inf) > np.cbrt(tol)*(1+np.abs(f))
-        return np.logical_and(np.logical_or(a, np.logical_or(b, c)),k < iter_max)
-
-    def body(state):
-        k, _, f0, x, f, g, d, alt_args, stats = state
-        condition = np.dot(d,g) > -0.001*np.linalg.norm(d)*np.linalg.norm(g)   # eq 2.15, Andrei, Open Problems in Nonlinear Conjugate Gradient ...
-        jax.lax.cond(condition, print_restart_z1, no_op, operand=None)
-        d = jax.lax.select(condition, -g, d)                                   # use -g, if d not downhill
-        x1, f1, g1, alt_args, stats = line_search(x,f0, f,g,d, func, func_args, alt_args, stats, update_x) 
-        z1 = M_inv(x, g1, func_args, alt_args)
-        y = g1 - g
-        beta = np.maximum(np.dot(y,z1) / np.dot(y,d), 0.)  
-                                                          # HS+, Hager, Zhang, A SURVEY OF NONLINEAR CONJUGATE GRADIENT METHODS
-        # condition = (k % n_restart) == 0
-        # beta = jax.lax.select(condition, 0.0, beta)
-        d = -z1 + beta * d
-        condition = np.dot(d,g) > -0.001*np.linalg.norm(d)*np.linalg.norm(g)   # eq 2.15, Andrei, Open Problems in Nonlinear Conjugate Gradient ...
-        jax.lax.cond(condition, print_restart_d, no_op, operand=None)
-        d = jax.lax.select(condition, -z1, d)                                  # use -z1, if d not downhill
-        return k+1, x, f, x1, f1, g1, d, alt_args, stats
-
-    state = k, x, f0, x, f, g, d, alt_args, stats
-    k, _, _, x1, f1, g1, _, alt_args, stats = lax.while_loop(cond, body, state)
-                    
-    return f1, x1, k, alt_args, stats
-
-# Example usage:
-if __name__ == '__main__':
-    
-    # parameters for minimizer
-    tol      = 1e-10     # tolerance for stopping
-    precond_iter = 20    # cg step for preconditioning
-    iter_max = 1000      
-        
-    # Define a simple quadratic function:
-    # f(x) = 0.5 * x^T A x - b^T x, where A is positive-definite.
-    n = 2000
-    A = sp.random(n, n, density=0.2, format='csr')  # constant part of A(x)
-    A = A.T @ A + sp.eye(n)                         # make it positive definite
-    D = np.array(A.diagonal())
-    A = sparse.BCOO.from_scipy_sparse(A).sort_indices()
-    key = jax.random.PRNGKey(42)
-    b   = jax.random.uniform(key, shape=(n,))
-    
-    @jit
-    def M_inv(x,g,func_args,alt_args):
-       A, D, _, precond_iter = func_args
-       norm_g = np.linalg.norm(g)
-       atol = np.minimum(0.5,np.sqrt(norm_g))*norm_g         # nocedal, wright, algorithm 7.1
-       return jax_scipy_cg(A, D, g, np.zeros(len(g)), tol=0, atol=atol, maxiter=precond_iter)
-
-    @jit
-    def func(x,func_args,alt_args,stats):
-        A, D, b, _ = func_args
-        calls = stats
-        Ax = A @ x
-        e  = 0.5 * np.dot(x, Ax) - np.dot(b, x)
-        g  = Ax - b
-        return e, g, alt_args, calls+1
-    
-    # Initial guess
-    x0 = np.zeros(n)
-    alt_args = np.zeros(1)  # dummy array
-    
-    func_time = 0
-    calls     = 0
-    stats = calls
-    f_hs, x_hs, iterations_hs, _, _ = hestenes_stiefel_ncg(x0, func, (A,D,b,precond_iter,), (alt_args,), stats, tol, update_x, M_inv)
-                                                        
-    t0 = time()
-    func_time = 0
-    calls    = 0
-    stats = calls
-    f_hs, x_hs, iterations_hs, _, stats = hestenes_stiefel_ncg(x0, func, (A,D,b,precond_iter,), (alt_args,), stats, tol, update_x, M_inv)
-    elapsed_time = time()-t0
-    func_calls = stats
-    
-    print("\n")
-    print("Hestenes-Stiefel NCG")
-    print("total time      :", elapsed_time)
-    print("function value  :", f_hs)
-    print("function calls  :", func_calls)
-    print("iterations      :", iterations_hs)
-
-
-    
+import jax
+jax.config.update("jax_enable_x64", True)
+import jax.numpy as np
+from jax import jit, lax
+from jax.experimental import sparse
+from jax.scipy.optimize import minimize
+from functools import partial
+import scipy.sparse as sp
+import sys
+from time import time
+
+from jax_tools import update_x, norm_inf
+from solvers import jax_scipy_cg
+
+# Finite difference interval of algorithm 2 in AIP Advances 7, 045310 (2017)
+@jit
+def compute_h(x, d):
+    eps_m = np.finfo(x.dtype).eps
+    sqrt_eps_m = np.sqrt(eps_m)
+    
+    norm_x_2 = np.linalg.norm(x)
+    norm_d_2 = np.linalg.norm(d)
+    norm_d_inf = norm_inf(d)
+
+    term1 = 2.0 * sqrt_eps_m * (1.0 + norm_x_2) / norm_d_2
+    term2 = sqrt_eps_m / norm_d_inf
+
+    return lax.cond(term1 < term2,
+                    lambda _: term1,
+                    lambda _: term2,
+                    operand=None)
+
+# Initial step length of algorithm 2 in AIP Advances 7, 045310 (2017)
+@jit
+def alpha_init(f0,      # energy of previous iteration
+               f,g,d,   # energy, gradient, search direction
+               g1,      # gradient at x + h*d
+               h,       # finite difference step siz
+               c=0.1,   # step length scale factor for negative curvature
+               o=0.99   # o < 1 takes more often alpha_0 from nocedal, wright eq 3.60
+               ):   
+    gd = np.vdot(g,d)
+    term1 = -h*(gd/(np.vdot(g1,d)-gd))
+    term1 = lax.cond(term1 < 0,
+                 lambda t: c * np.abs(t),  # negative curvature
+                 lambda t: t,
+                 term1)
+    term2 = 2.0*(f-f0)/gd
+    term2 = lax.cond(term2 < 0,
+                 lambda t: 1.0e30,        # use high value, select term1 afterwards
+                 lambda t: t,
+                 term2)
+    # jax.debug.print('initial step length {a} {b} {x}',a=term1,b=term2,x=term1<o*term2)
+    return lax.cond(term1 < o*term2,
+                    lambda _: term1,
+                    lambda _: term2,
+                    operand=None)
+
+'''
+o = 1
+iterations                1196
+  function calls          2553
+  
+o = 0.99
+iterations                1192
+  function calls          2545
+
+o = 0.98
+iterations                1215
+  function calls          2591
+
+o = 0.95
+iterations                1264
+  function calls          2689
+
+o = 0.9  
+iterations                1262
+  function calls          2685  
+  
+o = 1.01
+iterations                1203
+  function calls          2567
+
+
+o = 1.10
+--> done
+iterations                1199
+  function calls          2559
+
+'''
+
+# the stats of the loop are the tuple (energy evaluations, Poisson CG
+# iterations, preconditioner CG iterations, line search backtracks, restarts).
+# Events of the minimizers are added to their counter on the device instead of
+# printed from the jitted loop; other stats, e.g. a plain call counter, are
+# passed through
+BACKTRACKS, RESTARTS = 3, 4
+
+def count_events(stats, index, n):
+    if isinstance(stats, tuple) and len(stats) > index:
+        return stats[:index] + (stats[index] + n,) + stats[index+1:]
+    return stats
+
+@partial(jit, static_argnums=(5,9,))
+def line_search(x,      # current magnetization
+                f0,     # energy of previous interation
+                f,g,d,  # energy, gradient, search direction  
+                func, func_args, alt_args, stats,
+                update_x):
+    
+    rho=0.5
+    c=1e-4
+    delta=0.1
+    eps=1e-6                                                          # see section 5 of hager zhang paper  
+    max_iter=20
+    
+    h  = compute_h(x, d)
+
+    x1 = update_x(x, h, d)
+    f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
+    alpha = alpha_init(f0,f,g,d,g1,h)   
+                       
+    gd = np.vdot(g, d)
+    
+    def cond(state):
+        i, gd1, f1, alpha, _, _, _, _ = state
+        eps_k = eps*np.abs(f)                                         # eq 4.3 in hager zhang paper 
+        wolfe = np.logical_and((2*delta-1)*gd >= gd1,f1 <= f + eps_k) # approximate Wolfe  SIAM J. OPTIM. Vol. 16, No. 1, pp. 170–192
+        done  = np.logical_or(wolfe, f1 <= f + c * alpha * gd)        # or armijo 
+        done  = np.logical_or(done, i > max_iter)   # maximum iterations exceeded
+        return np.logical_not(done)
+  
+    def body(state):
+        i, _, _, alpha, _, _, alt_args, stats = state
+        alpha *= rho
+        x1 = update_x(x, alpha, d)
+        f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
+        gd1 = np.vdot(g1, d)         
+        return i+1, gd1, f1, alpha, x1, g1, alt_args, stats
+  
+    x1 = update_x(x, alpha, d)
+    f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
+    gd1 = np.vdot(g1, d)         
+    state = 0, gd1, f1, alpha, x1, g1, alt_args, stats
+    
+    i, gd1, f1, alpha, x1, g1, alt_args, stats = lax.while_loop(cond, body, state)
+    
+    return x1, f1, g1, alt_args, count_events(stats, BACKTRACKS, i)
+
+# stopping rule of the minimizers: gill, murray, wright, practical
+# optimization, section 8.2.3.2
+@jit
+def not_converged(k, x0, f0, x, f, g, tol, iter_max):
+    a = (f0-f) > tol*(1+np.abs(f))
+    b = np.logical_or(norm_inf(x0-x) > np.sqrt(tol)*(1+norm_inf(x)),k==0)
+    c = norm_inf(g) > np.cbrt(tol)*(1+np.abs(f))
+    return np.logical_and(np.logical_or(a, np.logical_or(b, c)),k < iter_max)
+
+# Armijo backtracking along update_x from the unit step
+@partial(jit, static_argnums=(4,8,))
+def backtracking(x, f, g, d, func, func_args, alt_args, stats, update_x):
+    rho=0.5
+    c=1e-4
+    max_iter=20
+    gd = np.vdot(g, d)
+
+    def cond(state):
+        i, alpha, _, f1, _, _, _ = state
+        return np.logical_and(f1 > f + c*alpha*gd, i < max_iter)
+
+    def body(state):
+        i, alpha, _, _, _, alt_args, stats = state
+        alpha *= rho
+        x1 = update_x(x, alpha, d)
+        f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
+        return i+1, alpha, x1, f1, g1, alt_args, stats
+
+    x1 = update_x(x, 1.0, d)
+    f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
+    state = 0, 1.0, x1, f1, g1, alt_args, stats
+    i, _, x1, f1, g1, alt_args, stats = lax.while_loop(cond, body, state)
+    return x1, f1, g1, alt_args, count_events(stats, BACKTRACKS, i)
+
+# first step length: at most 0.1 along each component of the gradient
+@jit
+def initial_step(g):
+    g_max = norm_inf(g)
+    return 0.1 / np.where(g_max > 0, g_max, 1.0)
+
+# Algorithm 4 Computer Physics Communications 235 (2019) 179–186
+# M_inv(x, g, func_args, alt_args, stats) returns the preconditioned gradient,
+# alt_args and stats; like func it may update both (e.g. a recycled basis)
+@partial(jit, static_argnums=(1,6,7,))
+def hestenes_stiefel_ncg(x, func, func_args, alt_args, stats, tol, update_x, M_inv):
+    iter_max = 100000
+    
+    f0 = np.finfo(x.dtype).max
+    f, g, alt_args, stats = func(x, func_args, alt_args, stats)
+    z, alt_args, stats = M_inv(x, g, func_args, alt_args, stats)
+    d = -z                                 # Initial search direction
+    k = 1
+    n_restart = 20
+
+    def cond(state):
+        k, x0, f0, x, f, g, _, _, _ = state
+        # jax.debug.print('    min   {k} {f}',k=k,f=f)
+        return not_converged(k, x0, f0, x, f, g, tol, iter_max)
+
+    def body(state):
+        k, _, f0, x, f, g, d, alt_args, stats = state
+        condition = np.vdot(d,g) > -0.001*np.linalg.norm(d)*np.linalg.norm(g)   # eq 2.15, Andrei, Open Problems in Nonlinear Conjugate Gradient ...
+        stats = count_events(stats, RESTARTS, condition.astype(int))
+        d = jax.lax.select(condition, -g, d)                                   # use -g, if d not downhill
+        x1, f1, g1, alt_args, stats = line_search(x,f0, f,g,d, func, func_args, alt_args, stats, update_x) 
+        z1, alt_args, stats = M_inv(x, g1, func_args, alt_args, stats)
+        y = g1 - g
+        beta = np.maximum(np.vdot(y,z1) / np.vdot(y,d), 0.)  
+                                                          # HS+, Hager, Zhang, A SURVEY OF NONLINEAR CONJUGATE GRADIENT METHODS
+        # condition = (k % n_restart) == 0
+        # beta = jax.lax.select(condition, 0.0, beta)
+        d = -z1 + beta * d
+        condition = np.vdot(d,g) > -0.001*np.linalg.norm(d)*np.linalg.norm(g)   # eq 2.15, Andrei, Open Problems in Nonlinear Conjugate Gradient ...
+        stats = count_events(stats, RESTARTS, condition.astype(int))
+        d = jax.lax.select(condition, -z1, d)                                  # use -z1, if d not downhill
+        return k+1, x, f, x1, f1, g1, d, alt_args, stats
+
+    state = k, x, f0, x, f, g, d, alt_args, stats
+    k, _, _, x1, f1, g1, _, alt_args, stats = lax.while_loop(cond, body, state)
+                    
+    return f1, x1, k, alt_args, stats
+
+# Barzilai-Borwein descent without line search, J. Appl. Phys. 115, 17D118
+# (2014): x1 = update_x(x, tau, -g) with the alternating step lengths
+# tau = s.s/s.y and s.y/y.y of the differences s, y of x and g; the previous
+# step length is kept if s.y <= 0. The energy is not monotone. M_inv is not used
+@partial(jit, static_argnums=(1,6,7,))
+def barzilai_borwein(x, func, func_args, alt_args, stats, tol, update_x, M_inv):
+    iter_max = 100000
+
+    f0 = np.finfo(x.dtype).max
+    f, g, alt_args, stats = func(x, func_args, alt_args, stats)
+    k = 1
+
+    def cond(state):
+        k, x0, f0, x, f, g, _, _, _ = state
+        return not_converged(k, x0, f0, x, f, g, tol, iter_max)
+
+    def body(state):
+        k, _, f0, x, f, g, tau, alt_args, stats = state
+        x1 = update_x(x, tau, -g)
+        f1, g1, alt_args, stats = func(x1, func_args, alt_args, stats)
+        s = x1 - x
+        y = g1 - g
+        sy = np.vdot(s, y)
+        tau1 = np.where(k % 2 == 1, np.vdot(s, s) / sy, sy / np.vdot(y, y))
+        tau1 = np.where(np.logical_and(sy > 0, np.isfinite(tau1)), tau1, tau)
+        return k+1, x, f, x1, f1, g1, tau1, alt_args, stats
+
+    state = k, x, f0, x, f, g, initial_step(g), alt_args, stats
+    k, _, _, x1, f1, g1, _, alt_args, stats = lax.while_loop(cond, body, state)
+
+    return f1, x1, k, alt_args, stats
+
+# L-BFGS on the unit spheres: the direction of the two-loop recursion
+# (nocedal, wright, algorithm 7.4) from the last LBFGS_MEMORY pairs of
+# differences of x and g in the embedding space, the step along update_x
+# (normalization, a retraction) by Armijo backtracking from the unit step.
+# Pairs with s.y <= 0 are not stored, a direction that is not downhill is
+# replaced by the scaled gradient. M_inv is not used
+LBFGS_MEMORY = 10
+
+@partial(jit, static_argnums=(1,6,7,))
+def lbfgs(x, func, func_args, alt_args, stats, tol, update_x, M_inv):
+    iter_max = 100000
+    n_mem = LBFGS_MEMORY
+
+    f0 = np.finfo(x.dtype).max
+    f, g, alt_args, stats = func(x, func_args, alt_args, stats)
+    k = 1
+
+    # unused pairs have rho = 0 and do not change the direction
+    def direction(g, S, Y, rho, newest, gamma):
+        def newest_first(i, state):
+            q, a = state
+            j = (newest - i) % n_mem
+            aj = rho[j] * np.vdot(S[j], q)
+            return q - aj * Y[j], a.at[j].set(aj)
+
+        def oldest_first(i, r):
+            j = (newest + 1 + i) % n_mem
+            b = rho[j] * np.vdot(Y[j], r)
+            return r + (a[j] - b) * S[j]
+
+        q, a = lax.fori_loop(0, n_mem, newest_first, (g, np.zeros(n_mem, dtype=g.dtype)))
+        return -lax.fori_loop(0, n_mem, oldest_first, gamma * q)
+
+    def cond(state):
+        k, x0, f0, x, f, g, _, _, _, _, _, _, _ = state
+        return not_converged(k, x0, f0, x, f, g, tol, iter_max)
+
+    def body(state):
+        k, _, f0, x, f, g, S, Y, rho, count, gamma, alt_args, stats = state
+        d = direction(g, S, Y, rho, (count - 1) % n_mem, gamma)
+        d = jax.lax.select(np.vdot(d, g) < 0, d, -gamma * g)
+        x1, f1, g1, alt_args, stats = backtracking(x, f, g, d, func, func_args, alt_args, stats, update_x)
+        s = x1 - x
+        y = g1 - g
+        sy = np.vdot(s, y)
+        store = sy > 1e-10 * np.linalg.norm(s) * np.linalg.norm(y)
+        j = count % n_mem
+        S = np.where(store, S.at[j].set(s), S)
+        Y = np.where(store, Y.at[j].set(y), Y)
+        rho = np.where(store, rho.at[j].set(1.0 / np.where(store, sy, 1.0)), rho)
+        gamma = np.where(store, sy / np.vdot(y, y), gamma)
+        return k+1, x, f, x1, f1, g1, S, Y, rho, count + store, gamma, alt_args, stats
+
+    S = np.zeros((n_mem,) + x.shape, dtype=x.dtype)
+    rho = np.zeros(n_mem, dtype=x.dtype)
+    state = k, x, f0, x, f, g, S, S, rho, 0, initial_step(g), alt_args, stats
+    k, _, _, x1, f1, g1, _, _, _, _, _, alt_args, stats = lax.while_loop(cond, body, state)
+
+    return f1, x1, k, alt_args, stats
+
+# minimizers with the arguments and results of hestenes_stiefel_ncg, selected
+# by the minimizer parameter (min_pars[10])
+MINIMIZERS = (hestenes_stiefel_ncg, barzilai_borwein, lbfgs)
+
+# Example usage:
+if __name__ == '__main__':
+    
+    # parameters for minimizer
+    tol      = 1e-10     # tolerance for stopping
+    precond_iter = 20    # cg step for preconditioning
+    iter_max = 1000      
+        
+    # Define a simple quadratic function:
+    # f(x) = 0.5 * x^T A x - b^T x, where A is positive-definite.
+    n = 2000
+    A = sp.random(n, n, density=0.2, format='csr')  # constant part of A(x)
+    A = A.T @ A + sp.eye(n)                         # make it positive definite
+    D = np.array(A.diagonal())
+    A = sparse.BCOO.from_scipy_sparse(A).sort_indices()
+    key = jax.random.PRNGKey(42)
+    b   = jax.random.uniform(key, shape=(n,))
+    
+    @jit
+    def M_inv(x,g,func_args,alt_args,stats):
+       A, D, _, precond_iter = func_args
+       norm_g = np.linalg.norm(g)
+       atol = np.minimum(0.5,np.sqrt(norm_g))*norm_g         # nocedal, wright, algorithm 7.1
+       return jax_scipy_cg(A, D, g, np.zeros(len(g)), tol=0, atol=atol, maxiter=precond_iter), alt_args, stats
+
+    @jit
+    def func(x,func_args,alt_args,stats):
+        A, D, b, _ = func_args
+        calls = stats
+        Ax = A @ x
+        e  = 0.5 * np.dot(x, Ax) - np.dot(b, x)
+        g  = Ax - b
+        return e, g, alt_args, calls+1
+    
+    # Initial guess
+    x0 = np.zeros(n)
+    alt_args = np.zeros(1)  # dummy array
+    
+    func_time = 0
+    calls     = 0
+    stats = calls
+    f_hs, x_hs, iterations_hs, _, _ = hestenes_stiefel_ncg(x0, func, (A,D,b,precond_iter,), (alt_args,), stats, tol, update_x, M_inv)
+                                                        
+    t0 = time()
+    func_time = 0
+    calls    = 0
+    stats = calls
+    f_hs, x_hs, iterations_hs, _, stats = hestenes_stiefel_ncg(x0, func, (A,D,b,precond_iter,), (alt_args,), stats, tol, update_x, M_inv)
+    elapsed_time = time()-t0
+    func_calls = stats
+    
+    print("\n")
+    print("Hestenes-Stiefel NCG")
+    print("total time      :", elapsed_time)
+    print("function value  :", f_hs)
+    print("function calls  :", func_calls)
+    print("iterations      :", iterations_hs)
+
+    # overhead of a host callback per energy evaluation, as the former prints
+    # of the line search and the restarts, against the counters in stats
+    @jit
+    def func_counted(x,func_args,alt_args,stats):
+        e, g, alt_args, calls = func(x,func_args,alt_args,stats[0])
+        return e, g, alt_args, (calls,) + stats[1:]
+
+    @jit
+    def func_callback(x,func_args,alt_args,stats):
+        jax.debug.callback(lambda calls: None, stats[0])
+        return func_counted(x,func_args,alt_args,stats)
+
+    with open("minimizers_callbacks.csv", "w") as file:
+        file.write("diagnostics,time,function_calls,backtracks,restarts\n")
+        for label, f in [('counters', func_counted), ('callbacks', func_callback)]:
+            stats = (0, 0, 0, 0, 0)
+            hestenes_stiefel_ncg(x0, f, (A,D,b,precond_iter,), (alt_args,), stats, tol, update_x, M_inv)[0].block_until_ready()
+            t0 = time()
+            _, _, _, _, stats = hestenes_stiefel_ncg(x0, f, (A,D,b,precond_iter,), (alt_args,), stats, tol, update_x, M_inv)
+            stats = jax.block_until_ready(stats)
+            elapsed_time = time()-t0
+            file.write(f"{label},{elapsed_time},{int(stats[0])},{int(stats[BACKTRACKS])},{int(stats[RESTARTS])}\n")
+            print(label, "time", elapsed_time, "function calls", int(stats[0]))
+
+
+    
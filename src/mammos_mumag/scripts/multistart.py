@@ -0,0 +1,106 @@
+import inspect
+import sys
+from time import time
+
+import jax
+import jax.numpy as np
+import numpy
+
+from loop import setup, minimize, compute_mh, initial_alt_args
+from mapping import initial_m
+from tools import read_starts, get_mu0
+from jax_tools import to_soa, soa_pars, mixed_pars, setup_compilation_cache
+from vtu import get_writer
+
+# Minimization of a batch of initial states at the field hstart with the same
+# matrices. loop.minimize is mapped with jax.vmap over the magnetization, the
+# alt_args, the stats and m_init, the magnetization of the preconditioner; all
+# other pars are shared. The while loops of the minimizer run until the last
+# start has converged, converged starts are kept unchanged.
+# The starts are read from <name>_starts.txt (see tools.read_starts); without
+# the file the initial state of the p2 file is the only start.
+# Output:
+#   <name>_multistart.dat: one line per start: state id, seed, energy
+#       density, mh, NCG iterations, energy evaluations
+#   <name>_start_<k>.vtu: final configuration of start k
+#   <name>_lowest.vtu: final configuration with the lowest energy
+
+def stack(trees):
+    return jax.tree_util.tree_map(lambda *a: np.stack(a), *trees)
+
+def multistart(m0, pars, engine):
+    hdir, hstart, _, _ = pars['hext_pars']
+    mh_pars = hdir, pars['meas'], pars['volume']
+    alt_args = stack([initial_alt_args(m, pars) for m in m0])
+    stats = (np.zeros(len(m0), dtype=np.int64),)*5
+    in_axes = {key: None for key in pars}
+    in_axes['m_init'] = 0
+
+    def relax(m, pars, alt_args, stats):
+        energy, m1, cg_iter, alt_args1, stats1 = minimize(m, hstart, pars, alt_args, stats, engine)
+        return energy, m1, cg_iter, alt_args1, stats1, compute_mh(m1, mh_pars)
+
+    solve = jax.jit(jax.vmap(relax, in_axes=(0, in_axes, 0, 0)))
+    return solve(np.stack(m0), dict(pars, m_init=np.stack(m0)), alt_args, stats)
+
+# returns the table of <name>_multistart.dat
+def run(name):
+    setup_compilation_cache()
+    m, pars, tags = setup(name)
+    domain = tags.getDomain()
+    starts = read_starts(name)
+    if starts is None:
+        starts = [(int(pars['mag_pars'][3]), 1)]
+    m0 = [initial_m(domain, pars, state, seed) for state, seed in starts]
+    if pars['min_pars'][7] == 1:
+        m0 = [to_soa(m) for m in m0]
+        pars = soa_pars(pars)
+    if pars['min_pars'][8] == 1:
+        pars = mixed_pars(pars)
+    pars['m_init'] = m0[0]
+
+    t0 = time()
+    energy, m1, cg_iter, alt_args, stats, mh = jax.block_until_ready(
+        multistart(m0, pars, int(pars['min_pars'][10]))
+    )
+    total_time = time() - t0
+
+    table = numpy.array([
+        [state, seed, e/get_mu0(), h, k, calls]
+        for (state, seed), e, h, k, calls in zip(starts, numpy.array(energy), numpy.array(mh), numpy.array(cg_iter), numpy.array(stats[0]))
+    ])
+    with open(name + "_multistart.dat", "w") as f:
+        for state, seed, e, h, k, calls in table:
+            f.write(f'{int(state)} {int(seed)} {e} {h} {int(k)} {int(calls)}\n')
+
+    writer = get_writer(name, domain)
+    u = numpy.array(alt_args[0])
+    m1 = numpy.array(m1)
+    if m1.ndim == 3:                                 # (3,N) layout
+        m1 = m1.transpose(0, 2, 1).reshape(len(m1), -1)
+    for k in range(len(starts)):
+        writer.write(f"{name}_start_{k:04d}.vtu", m=m1[k], u=u[k])
+    lowest = int(numpy.argmin(table[:, 2]))
+    writer.write(f"{name}_lowest.vtu", m=m1[lowest], u=u[lowest])
+
+    with open(name + "_stats.txt", "w") as file:
+        file.write(
+            inspect.cleandoc(
+                f"""
+                Solve time: {total_time} s.
+                Starts: {len(starts)}.
+                Lowest energy start: {lowest}.
+                NCG iterations: {int(table[:, 4].sum())}.
+                Energy evaluations: {int(table[:, 5].sum())}.
+                """
+            ) + "\n"
+        )
+    return table
+
+if __name__ == "__main__":
+    try:
+        name = sys.argv[1]
+    except IndexError:
+        sys.exit("usage run-escript multistart.py modelname")
+
+    run(name)
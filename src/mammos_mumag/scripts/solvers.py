@@ -1,231 +1,469 @@
-import jax
-import jax.numpy as np
-from jax import jit, lax
-from functools import partial
-
-# Inner loop of algorithm 7.1 in nocedal wright
-@partial(jit, static_argnums=(0,))
-def truncated_cg_diag_precond_jit(Bk, grad_fk, Dk, max_iter=100):
-    """
-    Solve Bk * p ≈ -grad_fk by preconditioned truncated CG, using a
-    diagonal preconditioner from Dk (the diagonal of Bk), and short-circuit
-    the iteration as soon as we detect negative curvature or convergence.
-
-    Parameters
-    ----------
-    Bk : (n, n) array_like
-        Symmetric matrix (e.g. approximate Hessian).
-    grad_fk : (n,) array_like
-        Gradient of f at the current iterate.
-    Dk : (n,) array_like
-        Diagonal entries of Bk. We assume these are positive for preconditioning.
-    max_iter : int
-        Maximum number of CG iterations.
-
-    Returns
-    -------
-    p : (n,) array_like
-        The truncated CG step (solution approximation).
-    """
-
-    # Tolerance: e_k = min(0.5, sqrt(||grad_fk||) * ||grad_fk||)
-    norm_grad = np.linalg.norm(grad_fk)
-    epsilon_k = np.minimum(0.5, np.sqrt(norm_grad) * norm_grad)
-
-    # Diagonal preconditioner M^{-1}:  M^{-1} v = v / Dk
-    def precond(v):
-        return v / Dk  # Assumes Dk[i] != 0 and Dk[i] > 0
-
-    #---------------------------
-    # INITIAL STATE
-    #---------------------------
-    # We'll store:
-    #   i:    iteration count
-    #   done: boolean indicating we've converged or found negative curvature
-    #   p:    current solution approximation
-    #   r:    current residual  (r = Bk * p + grad_fk)
-    #   z:    preconditioned residual (z = M^{-1} * r)
-    #   d:    current search direction
-    i0 = np.array(0)
-    done0 = np.array(False)
-
-    p0 = np.zeros_like(grad_fk)
-    r0 = grad_fk                # Because p0 = 0 => r0 = Bk*0 + grad_fk = grad_fk
-    z0 = precond(r0)
-    d0 = -z0
-
-    init_state = (i0, done0, p0, r0, z0, d0)
-
-    #---------------------------
-    # CONDITION FUNCTION
-    #---------------------------
-    # The loop continues while i < max_iter AND not done
-    def cond_fun(state):
-        i, done, p, r, z, d = state
-        return (i < max_iter) & (~done)
-
-    #---------------------------
-    # BODY FUNCTION
-    #---------------------------
-    def body_fun(state):
-        i, done, p, r, z, d = state
-
-        # d^T (Bk d)
-        denom = d @ (Bk(d))
-
-        # Check negative curvature
-        negative_curv = (denom <= 0.0)
-
-        # If denom > 0, alpha = (r^T z) / (d^T Bk d), else alpha = 0
-        rz = r @ z
-        alpha = np.where(~negative_curv, rz / denom, 0.0)
-
-        # Proposed updates
-        p_new = p + alpha * d
-        r_new = r + alpha * (Bk(d))
-        z_new = precond(r_new)
-
-        # Check convergence
-        conv = np.linalg.norm(r_new) <= epsilon_k
-
-        # If either negative_curv or conv is true, we are done
-        done_new = negative_curv | conv
-
-        #-----------------------------------------
-        # Decide final p if we are done this step
-        #-----------------------------------------
-        # Standard truncated-CG rule:
-        #   if negative_curv -> return old p
-        #   else if converged -> return new p
-        #   else keep going with new p
-        p_candidate = np.where(negative_curv, p, p_new)
-        p_out       = np.where(~negative_curv & conv, p_new, p_candidate)
-
-        # For r,z,d, if we are done, we won't do another iteration,
-        # but to keep the state well-defined, we can "freeze" them:
-        r_out = np.where(negative_curv, r, r_new)
-        z_out = np.where(negative_curv, z, z_new)
-
-        # Beta = (r_{j+1}^T z_{j+1}) / (r_j^T z_j)
-        beta = np.where(
-            (~negative_curv & ~conv),
-            (r_new @ z_new) / (rz + 1e-16),
-            0.0
-        )
-        d_new = -z_new + beta * d
-        d_out = np.where(negative_curv, d, d_new)
-
-        return (i+1, done_new, p_out, r_out, z_out, d_out)
-
-    #---------------------------
-    # RUN THE WHILE LOOP
-    #---------------------------
-    final_state = lax.while_loop(cond_fun, body_fun, init_state)
-    _, _, p_final, _, _, _ = final_state
-
-    return lax.cond(
-        np.all(p_final == 0),
-        lambda _: -grad_fk,
-        lambda _: p_final,
-        operand=None
-    )
-
-
-
-@partial(jit, static_argnums=(0,))
-def truncated_cg_jit(Bk, grad_fk, max_iter=100):
-    """
-    Solve Bk * p ≈ -grad_fk by truncated Conjugate Gradient (no preconditioning),
-    with short-circuit termination on negative curvature or convergence.
-
-    Parameters
-    ----------
-    Bk : (n, n) array_like
-        Symmetric matrix (e.g. approximate Hessian).
-    grad_fk : (n,) array_like
-        Gradient of f at the current iterate.
-    max_iter : int
-        Maximum number of CG iterations.
-
-    Returns
-    -------
-    p : (n,) array_like
-        The truncated CG step (solution approximation).
-    """
-    # Tolerance: epsilon_k = min(0.5, sqrt(||grad_fk||) * ||grad_fk||)
-    norm_grad = np.linalg.norm(grad_fk)
-    epsilon_k = np.minimum(0.5, np.sqrt(norm_grad) * norm_grad)
-
-    # Initial state
-    #   i: iteration count
-    #   done: boolean that indicates we've converged or found negative curvature
-    #   p: current solution approximation
-    #   r: current residual = Bk*p + grad_fk
-    #   d: current search direction
-    i0 = np.array(0)
-    done0 = np.array(False)
-
-    p0 = np.zeros_like(grad_fk)   # start from 0
-    r0 = grad_fk                   # r0 = Bk * p0 + grad_fk = grad_fk
-    d0 = -r0                       # initial direction
-
-    init_state = (i0, done0, p0, r0, d0)
-
-    def cond_fun(state):
-        i, done, p, r, d = state
-        return (i < max_iter) & (~done)
-
-    def body_fun(state):
-        i, done, p, r, d = state
-
-        # Negative curvature check
-        denom = d @ (Bk(d))
-        negative_curv = (denom <= 0.0)
-
-        # alpha = (r^T r) / (d^T Bk d) if denom>0
-        rr = r @ r
-        alpha = np.where(~negative_curv, rr / (denom + 1e-16), 0.0)
-
-        # Proposed updates
-        p_new = p + alpha * d
-        r_new = r + alpha * (Bk(d))
-
-        # Check convergence
-        conv = np.linalg.norm(r_new) <= epsilon_k
-
-        # If negative curvature or converged => done
-        done_new = negative_curv | conv
-
-        # If negative curvature => keep old p, else if converged => new p
-        p_candidate = np.where(negative_curv, p, p_new)
-        p_out = np.where(~negative_curv & conv, p_new, p_candidate)
-
-        # If we are continuing, compute beta and update d
-        # beta = (r_{j+1}^T r_{j+1}) / (r_j^T r_j)
-        rr_new = r_new @ r_new
-        beta = np.where(~negative_curv & ~conv, rr_new / (rr + 1e-16), 0.0)
-        d_new = -r_new + beta * d
-
-        # Freeze the residual/direction if done, so they won't matter
-        r_out = np.where(~done_new, r_new, r)
-        d_out = np.where(~done_new, d_new, d)
-
-        return (i + 1, done_new, p_out, r_out, d_out)
-
-    # Run the loop
-    final_state = lax.while_loop(cond_fun, body_fun, init_state)
-    _, _, p_final, _, _ = final_state
-    return p_final
-
-    
-@jit
-def jax_scipy_cg(A, D, b, x0, tol=1e-5, atol=0, maxiter=10000):
-    pc = lambda x: x * (1. / D) 
-    x, info = jax.scipy.sparse.linalg.cg(A,
-                                         b,
-                                         x0=x0,
-                                         M=pc,
-                                         tol=tol,
-                                         atol=atol,
-                                         maxiter=maxiter)
-    return x
+import jax
+import jax.numpy as np
+from jax import jit, lax
+from functools import partial
+
+# Inner loop of algorithm 7.1 in nocedal wright
+@partial(jit, static_argnums=(0,))
+def truncated_cg_diag_precond_jit(Bk, grad_fk, Dk, max_iter=100):
+    """
+    Solve Bk * p ≈ -grad_fk by preconditioned truncated CG, using a
+    diagonal preconditioner from Dk (the diagonal of Bk), and short-circuit
+    the iteration as soon as we detect negative curvature or convergence.
+
+    Parameters
+    ----------
+    Bk : (n, n) array_like
+        Symmetric matrix (e.g. approximate Hessian).
+    grad_fk : (n,) array_like
+        Gradient of f at the current iterate.
+    Dk : (n,) array_like
+        Diagonal entries of Bk. We assume these are positive for preconditioning.
+    max_iter : int
+        Maximum number of CG iterations.
+
+    Returns
+    -------
+    p : (n,) array_like
+        The truncated CG step (solution approximation).
+    """
+
+    # Tolerance: e_k = min(0.5, sqrt(||grad_fk||) * ||grad_fk||)
+    norm_grad = np.linalg.norm(grad_fk)
+    epsilon_k = np.minimum(0.5, np.sqrt(norm_grad) * norm_grad)
+
+    # Diagonal preconditioner M^{-1}:  M^{-1} v = v / Dk
+    def precond(v):
+        return v / Dk  # Assumes Dk[i] != 0 and Dk[i] > 0
+
+    #---------------------------
+    # INITIAL STATE
+    #---------------------------
+    # We'll store:
+    #   i:    iteration count
+    #   done: boolean indicating we've converged or found negative curvature
+    #   p:    current solution approximation
+    #   r:    current residual  (r = Bk * p + grad_fk)
+    #   z:    preconditioned residual (z = M^{-1} * r)
+    #   d:    current search direction
+    i0 = np.array(0)
+    done0 = np.array(False)
+
+    p0 = np.zeros_like(grad_fk)
+    r0 = grad_fk                # Because p0 = 0 => r0 = Bk*0 + grad_fk = grad_fk
+    z0 = precond(r0)
+    d0 = -z0
+
+    init_state = (i0, done0, p0, r0, z0, d0)
+
+    #---------------------------
+    # CONDITION FUNCTION
+    #---------------------------
+    # The loop continues while i < max_iter AND not done
+    def cond_fun(state):
+        i, done, p, r, z, d = state
+        return (i < max_iter) & (~done)
+
+    #---------------------------
+    # BODY FUNCTION
+    #---------------------------
+    def body_fun(state):
+        i, done, p, r, z, d = state
+
+        # d^T (Bk d)
+        denom = d @ (Bk(d))
+
+        # Check negative curvature
+        negative_curv = (denom <= 0.0)
+
+        # If denom > 0, alpha = (r^T z) / (d^T Bk d), else alpha = 0
+        rz = r @ z
+        alpha = np.where(~negative_curv, rz / denom, 0.0)
+
+        # Proposed updates
+        p_new = p + alpha * d
+        r_new = r + alpha * (Bk(d))
+        z_new = precond(r_new)
+
+        # Check convergence
+        conv = np.linalg.norm(r_new) <= epsilon_k
+
+        # If either negative_curv or conv is true, we are done
+        done_new = negative_curv | conv
+
+        #-----------------------------------------
+        # Decide final p if we are done this step
+        #-----------------------------------------
+        # Standard truncated-CG rule:
+        #   if negative_curv -> return old p
+        #   else if converged -> return new p
+        #   else keep going with new p
+        p_candidate = np.where(negative_curv, p, p_new)
+        p_out       = np.where(~negative_curv & conv, p_new, p_candidate)
+
+        # For r,z,d, if we are done, we won't do another iteration,
+        # but to keep the state well-defined, we can "freeze" them:
+        r_out = np.where(negative_curv, r, r_new)
+        z_out = np.where(negative_curv, z, z_new)
+
+        # Beta = (r_{j+1}^T z_{j+1}) / (r_j^T z_j)
+        beta = np.where(
+            (~negative_curv & ~conv),
+            (r_new @ z_new) / (rz + 1e-16),
+            0.0
+        )
+        d_new = -z_new + beta * d
+        d_out = np.where(negative_curv, d, d_new)
+
+        return (i+1, done_new, p_out, r_out, z_out, d_out)
+
+    #---------------------------
+    # RUN THE WHILE LOOP
+    #---------------------------
+    final_state = lax.while_loop(cond_fun, body_fun, init_state)
+    _, _, p_final, _, _, _ = final_state
+
+    return lax.cond(
+        np.all(p_final == 0),
+        lambda _: -grad_fk,
+        lambda _: p_final,
+        operand=None
+    )
+
+
+
+# Truncated CG of truncated_cg_diag_precond_jit for the operator
+# Bk v = K(v) - s*v with a constant linear part K, deflated by a recycled basis
+# W (rows, zero rows unused) with the images KW = K(W); s only scales, so the
+# images of W under Bk need no products with K. The CG starts from the Galerkin
+# projection onto W and keeps its directions Bk-orthogonal to W (Saad, Yeung,
+# Erhel, Guyomarc'h, SIAM J. Sci. Comput. 21 (2000) 1909-1926), if Bk is
+# positive definite on W; near a switching field Bk has a soft mode, along
+# which the Galerkin solution would be arbitrarily long, and the CG is not
+# deflated. Returns p, the number of products with K and the last directions
+# with their images under K (rows, one per row of W), from which ritz_basis
+# builds the next basis
+@partial(jit, static_argnums=(0,))
+def truncated_cg_recycled(K, s, grad_fk, Dk, W, KW, max_iter=100):
+    norm_grad = np.linalg.norm(grad_fk)
+    epsilon_k = np.minimum(0.5, np.sqrt(norm_grad) * norm_grad)
+    k = W.shape[0]
+
+    def precond(v):
+        return v / Dk
+
+    p0 = np.zeros_like(grad_fk)
+    r0 = grad_fk
+    BW = KW - s * W
+    Ginv = np.zeros((k, k), dtype=grad_fk.dtype)
+    if k > 0:
+        used = np.sum(W * W, axis=1) > 0
+        G = W @ BW.T
+        G = 0.5 * (G + G.T) + np.diag(np.where(used, 0.0, 1.0))
+        eig = np.linalg.eigvalsh(G)
+        deflate = np.any(used) & (eig[0] > 1e-8 * np.abs(eig[-1]))
+        Ginv = np.where(deflate, np.linalg.inv(np.where(deflate, G, np.eye(k))), 0.0)
+        a = Ginv @ -(W @ grad_fk)
+        p0 = a @ W
+        r0 = a @ BW + grad_fk
+
+    # part of v that is Bk-orthogonal to W
+    def deflated(v):
+        return v - (Ginv @ (BW @ v)) @ W
+
+    z0 = precond(r0)
+    V = KV = np.zeros_like(W)
+    init_state = (np.array(0), np.array(False), p0, r0, z0, -deflated(z0), V, KV)
+
+    def cond_fun(state):
+        i, done = state[:2]
+        return (i < max_iter) & (~done)
+
+    def body_fun(state):
+        i, done, p, r, z, d, V, KV = state
+        Kd = K(d)
+        Bd = Kd - s * d
+        denom = d @ Bd
+        negative_curv = (denom <= 0.0)
+        rz = r @ z
+        alpha = np.where(~negative_curv, rz / denom, 0.0)
+
+        # the last k directions of positive curvature, normalized
+        if k > 0:
+            nd = np.linalg.norm(d)
+            scale = 1.0 / np.where(nd > 0, nd, 1.0)
+            V = np.where(negative_curv, V, V.at[i % k].set(d * scale))
+            KV = np.where(negative_curv, KV, KV.at[i % k].set(Kd * scale))
+
+        p_new = p + alpha * d
+        r_new = r + alpha * Bd
+        z_new = precond(r_new)
+        conv = np.linalg.norm(r_new) <= epsilon_k
+        done_new = negative_curv | conv
+
+        # negative curvature: keep p, otherwise take the new p
+        p_out = np.where(negative_curv, p, p_new)
+        r_out = np.where(negative_curv, r, r_new)
+        z_out = np.where(negative_curv, z, z_new)
+        beta = np.where(
+            (~negative_curv & ~conv),
+            (r_new @ z_new) / (rz + 1e-16),
+            0.0
+        )
+        d_new = -deflated(z_new) + beta * d
+        d_out = np.where(negative_curv, d, d_new)
+        return (i+1, done_new, p_out, r_out, z_out, d_out, V, KV)
+
+    i, _, p, _, _, _, V, KV = lax.while_loop(cond_fun, body_fun, init_state)
+    fallback = np.all(p == 0)
+    return np.where(fallback, -grad_fk, p), i, V, KV
+
+# next basis of truncated_cg_recycled: the Ritz vectors of K to the smallest
+# Ritz values in the span of the basis W and the directions V of the last CG,
+# with the diagonal Dk of the preconditioner as inner product, so that the basis
+# approximates the slowest modes of the preconditioned CG. The images follow
+# from KW and KV without products with K; vectors (nearly) dependent on the
+# others leave rows unused
+@jit
+def ritz_basis(W, KW, V, KV, Dk):
+    Z = np.concatenate([W, V])
+    KZ = np.concatenate([KW, KV])
+    F = Z @ KZ.T
+    E = (Z * Dk) @ Z.T
+    ev, U = np.linalg.eigh(0.5 * (E + E.T))
+    independent = ev > 1e3 * np.finfo(ev.dtype).eps * ev[-1]
+    T = U * np.where(independent, 1.0 / np.sqrt(np.where(independent, ev, 1.0)), 0.0)
+    H = T.T @ (0.5 * (F + F.T)) @ T
+    shift = 2.0 * np.max(np.abs(H)) + 1.0
+    theta, Y = np.linalg.eigh(H + np.diag(np.where(independent, 0.0, shift)))
+    k = W.shape[0]
+    X = (T @ Y[:, :k]).T
+    W, KW = X @ Z, X @ KZ
+    norm = np.linalg.norm(W, axis=1, keepdims=True)
+    scale = np.where((theta[:k, None] < 0.5 * shift) & (norm > 0), 1.0 / np.where(norm > 0, norm, 1.0), 0.0)
+    return W * scale, KW * scale
+
+
+@partial(jit, static_argnums=(0,))
+def truncated_cg_jit(Bk, grad_fk, max_iter=100):
+    """
+    Solve Bk * p ≈ -grad_fk by truncated Conjugate Gradient (no preconditioning),
+    with short-circuit termination on negative curvature or convergence.
+
+    Parameters
+    ----------
+    Bk : (n, n) array_like
+        Symmetric matrix (e.g. approximate Hessian).
+    grad_fk : (n,) array_like
+        Gradient of f at the current iterate.
+    max_iter : int
+        Maximum number of CG iterations.
+
+    Returns
+    -------
+    p : (n,) array_like
+        The truncated CG step (solution approximation).
+    """
+    # Tolerance: epsilon_k = min(0.5, sqrt(||grad_fk||) * ||grad_fk||)
+    norm_grad = np.linalg.norm(grad_fk)
+    epsilon_k = np.minimum(0.5, np.sqrt(norm_grad) * norm_grad)
+
+    # Initial state
+    #   i: iteration count
+    #   done: boolean that indicates we've converged or found negative curvature
+    #   p: current solution approximation
+    #   r: current residual = Bk*p + grad_fk
+    #   d: current search direction
+    i0 = np.array(0)
+    done0 = np.array(False)
+
+    p0 = np.zeros_like(grad_fk)   # start from 0
+    r0 = grad_fk                   # r0 = Bk * p0 + grad_fk = grad_fk
+    d0 = -r0                       # initial direction
+
+    init_state = (i0, done0, p0, r0, d0)
+
+    def cond_fun(state):
+        i, done, p, r, d = state
+        return (i < max_iter) & (~done)
+
+    def body_fun(state):
+        i, done, p, r, d = state
+
+        # Negative curvature check
+        denom = d @ (Bk(d))
+        negative_curv = (denom <= 0.0)
+
+        # alpha = (r^T r) / (d^T Bk d) if denom>0
+        rr = r @ r
+        alpha = np.where(~negative_curv, rr / (denom + 1e-16), 0.0)
+
+        # Proposed updates
+        p_new = p + alpha * d
+        r_new = r + alpha * (Bk(d))
+
+        # Check convergence
+        conv = np.linalg.norm(r_new) <= epsilon_k
+
+        # If negative curvature or converged => done
+        done_new = negative_curv | conv
+
+        # If negative curvature => keep old p, else if converged => new p
+        p_candidate = np.where(negative_curv, p, p_new)
+        p_out = np.where(~negative_curv & conv, p_new, p_candidate)
+
+        # If we are continuing, compute beta and update d
+        # beta = (r_{j+1}^T r_{j+1}) / (r_j^T r_j)
+        rr_new = r_new @ r_new
+        beta = np.where(~negative_curv & ~conv, rr_new / (rr + 1e-16), 0.0)
+        d_new = -r_new + beta * d
+
+        # Freeze the residual/direction if done, so they won't matter
+        r_out = np.where(~done_new, r_new, r)
+        d_out = np.where(~done_new, d_new, d)
+
+        return (i + 1, done_new, p_out, r_out, d_out)
+
+    # Run the loop
+    final_state = lax.while_loop(cond_fun, body_fun, init_state)
+    _, _, p_final, _, _ = final_state
+    return p_final
+
+    
+@jit
+def jax_scipy_cg(A, D, b, x0, tol=1e-5, atol=0, maxiter=10000):
+    pc = lambda x: x * (1. / D) 
+    x, info = jax.scipy.sparse.linalg.cg(A,
+                                         b,
+                                         x0=x0,
+                                         M=pc,
+                                         tol=tol,
+                                         atol=atol,
+                                         maxiter=maxiter)
+    return x
+
+# multigrid V-cycle of an amg.amg_hierarchy with one damped Jacobi step
+# before and after the coarse grid correction (symmetric, as CG requires)
+def vcycle(levels, coarse, r):
+    if not levels:
+        return coarse @ r
+    A, R, P, w = levels[0]
+    x = w * r
+    x = x + P @ vcycle(levels[1:], coarse, R @ (r - A @ x))
+    return x + w * (r - A @ x)
+
+# preconditioner M: diagonal (array) or multigrid hierarchy (levels, coarse)
+def precondition(M, r):
+    if isinstance(M, tuple):
+        return vcycle(*M, r)
+    return r / M
+
+# preconditioned CG with the stopping rule of jax.scipy.sparse.linalg.cg,
+# ||r|| <= max(tol*||b||, atol); returns the solution and the number of iterations
+@jit
+def pcg(A, M, b, x0, tol=1e-5, atol=0, maxiter=10000):
+    atol2 = np.maximum(np.square(tol) * np.dot(b, b), np.square(atol))
+
+    def cond(state):
+        _, r, _, _, k = state
+        return (np.dot(r, r) > atol2) & (k < maxiter)
+
+    def body(state):
+        x, r, gamma, p, k = state
+        Ap = A @ p
+        alpha = gamma / np.dot(p, Ap)
+        x = x + alpha * p
+        r = r - alpha * Ap
+        z = precondition(M, r)
+        gamma_ = np.dot(r, z)
+        p = z + (gamma_ / gamma) * p
+        return x, r, gamma_, p, k + 1
+
+    r0 = b - A @ x0
+    z0 = precondition(M, r0)
+    state = x0, r0, np.dot(r0, z0), z0, 0
+    x, _, _, _, k = lax.while_loop(cond, body, state)
+    return x, k
+
+# mixed precision CG by iterative refinement: the residual and the solution
+# are float64, the corrections are solved by pcg with the float32 matrix A32
+# and preconditioner M32 to the relative tolerance inner_tol, or to the
+# remaining reduction of the residual if that is larger. The residual is
+# scaled to unit norm before it is rounded to float32. Returns the solution
+# and the total number of float32 iterations
+@jit
+def pcg_mixed(A, A32, M32, b, x0, tol=1e-5, atol=0, maxiter=10000, inner_tol=1e-4, max_refine=20):
+    atol2 = np.maximum(np.square(tol) * np.dot(b, b), np.square(atol))
+
+    def cond(state):
+        _, r, k, j = state
+        return (np.dot(r, r) > atol2) & (k < maxiter) & (j < max_refine)
+
+    def body(state):
+        x, r, k, j = state
+        s = np.linalg.norm(r)
+        r32 = (r / s).astype(np.float32)
+        rtol = np.maximum(inner_tol, np.sqrt(atol2) / s)
+        e, i = pcg(A32, M32, r32, np.zeros_like(r32), rtol, 0, maxiter - k)
+        x = x + s * e.astype(x.dtype)
+        return x, b - A @ x, k + i, j + 1
+
+    state = x0, b - A @ x0, 0, 0
+    x, _, k, _ = lax.while_loop(cond, body, state)
+    return x, k
+
+# time and accuracy of the inner solves in double and mixed precision: the
+# Poisson solve for the initial magnetization and the preconditioning CG of
+# the minimizer
+if __name__ == "__main__":
+    import sys
+    from time import time
+    from energies import total_eg
+    from jax_tools import mixed_pars
+    from loop import M_inv
+    from mapping import escript2arrays
+
+    try:
+        name = sys.argv[1]
+    except IndexError:
+        sys.exit("usage run-escript solvers.py modelname")
+
+    n_rep = 5
+    m, pars, _ = escript2arrays(name)
+    pars['m_init'] = m
+    mixed = mixed_pars(pars)
+    dx, dy, dz, A, D, _, _, _ = pars['hmag_pars']
+    A32, D32 = mixed['hmag32']
+    b = dx@m[0::3] + dy@m[1::3] + dz@m[2::3]
+    u0 = np.zeros(len(b))
+
+    def timed(f):
+        out = jax.block_until_ready(f())
+        t0 = time()
+        for _ in range(n_rep):
+            out = f()
+        jax.block_until_ready(out)
+        return out, (time() - t0) / n_rep
+
+    with open(name + "_precision.csv", "w") as file:
+        file.write("solve,precision,tol,iterations,time,relative_residual,relative_difference\n")
+        for tol in (1e-6, 1e-8, 1e-10):
+            reference, _ = pcg(A, D, b, u0, tol)
+            for precision, f in (('double', lambda: pcg(A, D, b, u0, tol)),
+                                 ('mixed', lambda: pcg_mixed(A, A32, D32, b, u0, tol))):
+                (u, k), elapsed = timed(f)
+                residual = np.linalg.norm(b - A @ u) / np.linalg.norm(b)
+                difference = np.linalg.norm(u - reference) / np.linalg.norm(reference)
+                file.write(f"poisson,{precision},{tol},{int(k)},{elapsed},{residual},{difference}\n")
+                print('poisson', precision, 'tol', tol, 'iterations', int(k), 'time', elapsed, 's')
+
+        args = pars['min_pars'][0], pars['hext_pars'][1], pars
+        _, g, alt_args, _ = total_eg(m, args, (u0, None), (0, 0))
+        reference = M_inv(m, g, args, alt_args, (0, 0, 0))[0]
+        precond_iter = pars['min_pars'][2]
+        for precision, p in (('double', pars), ('mixed', mixed)):
+            args = pars['min_pars'][0], pars['hext_pars'][1], p
+            d, elapsed = timed(lambda: M_inv(m, g, args, alt_args, (0, 0, 0))[0])
+            difference = np.linalg.norm(d - reference) / np.linalg.norm(reference)
+            file.write(f"precond,{precision},,{precond_iter},{elapsed},,{difference}\n")
+            print('precond', precision, 'time', elapsed, 's')
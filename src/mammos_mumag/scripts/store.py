@@ -1,26 +1,135 @@
+import configparser
+import hashlib
+import json
+import os
+import shutil
 import sys
-import pickle
+import tempfile
 import numpy
+import scipy.sparse
 from mapping import escript2arrays, pars2jax
-import jax.numpy as np
-
-# store parameters in a pickle file
-def to_pickle(name,m,pars):
-    with open(f"{name}.pkl", "wb") as f:
-        pickle.dump(m, f)
-        pickle.dump(pars, f)
-
-def from_pickle(name):
-    with open(f"{name}.pkl", "rb") as f:
-        m    = pickle.load(f)
-        pars = pickle.load(f)
-    return m, pars
-        
-def pickle2jax(name):
-    m, pars = from_pickle(name)
-    m = np.array(m)
-    pars2jax(pars)
-    return m, pars
+from mesh import mesh_file
+
+# Versioned matrix cache. Each entry is a directory <root>/<key> with one
+# .npy file per array (data, indices and indptr for sparse matrices) and a
+# manifest.json. The key is a hash of the mesh, the materials and the mesh
+# parameters, so an entry is only reused for the system it was built for.
+CACHE_VERSION = 1
+# set by Simulation, same name as CACHE_DIR_VARIABLE of mammos_mumag.simulation
+CACHE_DIR_VARIABLE = "MAMMOS_MUMAG_CACHE_DIR"
+
+# entries of pars that depend on mesh and materials only
+SPARSE = {
+    'exani_pars': ('C', None),
+    'hmag_pars': ('dx', 'dy', 'dz', 'stiff', None, 'gx', 'gy', 'gz'),
+}
+DENSE = {
+    'exani_pars': (None, 'D'),
+    'hmag_pars': (None, None, None, None, 'dia_stiff', None, None, None),
+}
+
+def cache_root():
+    return os.environ.get(CACHE_DIR_VARIABLE, ".")
+
+def cache_enabled():
+    return CACHE_DIR_VARIABLE in os.environ
+
+def cache_key(name):
+    h = hashlib.sha256(f"mammos_mumag matrix cache {CACHE_VERSION}".encode())
+    for path in (mesh_file(name), name + ".krn"):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    config = configparser.ConfigParser()
+    config.read(name + ".p2")
+    size = config.getfloat("mesh", "size", fallback=1.0e-9)
+    scale = config.getfloat("mesh", "scale", fallback=0.0)
+    h.update(f"size={size} scale={scale}".encode())
+    return h.hexdigest()[:32]
+
+# the key may be passed if already computed, hashing a large mesh takes time
+def cache_path(name, key=None):
+    return os.path.join(cache_root(), key or cache_key(name))
+
+# store matrices and arrays of pars in the cache
+def to_cache(name,pars,key=None):
+    path = cache_path(name, key)
+    if os.path.exists(os.path.join(path, "manifest.json")):
+        return path
+    os.makedirs(cache_root(), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=cache_root())
+    manifest = {
+        "version": CACHE_VERSION,
+        "key": os.path.basename(path),
+        "volume": float(pars['volume']),
+        "size": float(pars['size']),
+        "arrays": {},
+        "matrices": {},
+    }
+
+    def save(key, a):
+        a = numpy.asarray(a)
+        numpy.save(os.path.join(tmp, key + ".npy"), a)
+        manifest["arrays"][key] = {"dtype": a.dtype.str, "shape": list(a.shape)}
+
+    save('meas', pars['meas'])
+    for group in SPARSE:
+        for i, key in enumerate(SPARSE[group]):
+            if key is not None:
+                A = scipy.sparse.csr_matrix(pars[group][i])
+                A.sort_indices()
+                for part in ("data", "indices", "indptr"):
+                    save(f"{key}.{part}", getattr(A, part))
+                manifest["matrices"][key] = {"shape": list(A.shape), "nnz": int(A.nnz)}
+            key = DENSE[group][i]
+            if key is not None:
+                save(key, pars[group][i])
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    try:
+        os.rename(tmp, path)
+    except OSError:                                # stored concurrently by another run
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+# read matrices and arrays from the cache, arrays are memory mapped;
+# returns None if there is no entry for this system
+def from_cache(name, key=None):
+    path = cache_path(name, key)
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != CACHE_VERSION:
+        return None
+
+    def load(key):
+        return numpy.load(os.path.join(path, key + ".npy"), mmap_mode="r")
+
+    pars = {
+        'meas': load('meas'),
+        'volume': manifest["volume"],
+        'size': manifest["size"],
+    }
+    for group in SPARSE:
+        values = []
+        for key, dense in zip(SPARSE[group], DENSE[group]):
+            if key is not None:
+                values.append(scipy.sparse.csr_matrix(
+                    (load(f"{key}.data"), load(f"{key}.indices"), load(f"{key}.indptr")),
+                    shape=manifest["matrices"][key]["shape"],
+                ))
+            else:
+                values.append(load(dense))
+        pars[group] = tuple(values)
+    return pars
+
+def cache2jax(name, key=None):
+    pars = from_cache(name, key)
+    if pars is not None:
+        pars2jax(pars)
+    return pars
 
 if __name__ == "__main__":
     try:
@@ -29,7 +138,4 @@ if __name__ == "__main__":
         sys.exit("usage run-escript store.py modelname")
 
     m, pars, _ = escript2arrays(name,0,'numpy')
-    to_pickle(name, m, pars)
-    m, pars = pickle2jax(name)
-
-    
+    print('stored matrices in', to_cache(name, pars))
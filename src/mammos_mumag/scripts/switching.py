@@ -0,0 +1,120 @@
+import inspect
+import os
+import sys
+from time import time
+
+import numpy
+
+from loop import setup, minimize, compute_mh, initial_alt_args
+from tools import read_step_params, read_hc_tol
+from jax_tools import to_soa, soa_pars, mixed_pars, setup_compilation_cache
+
+# Switching field without the demagnetization curve. The field is swept with
+# hstep from hstart until a step changes mh by more than hstep_dm_jump. The
+# switching field is then bisected in the interval of this step until it is
+# narrower than hc_tol; every bisection step starts from the last stable
+# configuration, the one at the upper end of the interval.
+# If MAMMOS_MUMAG_REMANENCE is set, the sweep includes zero field and the
+# polarisation there is the remanence; if zero field is not reached before
+# the switching or the end of the sweep, it is computed from the last
+# configuration.
+# Output:
+#   <name>_switching.dat: one line per minimization: kind (0 sweep,
+#       1 bisection, 2 remanence), field, mh, stable (1) or switched (0),
+#       NCG iterations
+#   <name>_hc.dat: switching field and remanence in Tesla (nan if not found
+#       or not computed)
+REMANENCE_VARIABLE = "MAMMOS_MUMAG_REMANENCE"
+SWEEP, BISECTION, REMANENCE = 0, 1, 2
+
+def sweep_fields(hstart, hfinal, hstep, remanence):
+    n = int(abs(hfinal-hstart)/abs(hstep))
+    fields = [hstart + k*hstep for k in range(n+1)]
+    if remanence and hstart*fields[-1] < 0 and 0.0 not in fields:
+        k = next(k for k, h in enumerate(fields) if h*hstart < 0)
+        fields.insert(k, 0.0)
+    return fields
+
+def switching_field(m, pars, tol, remanence):
+    hdir, hstart, hfinal, hstep = pars['hext_pars']
+    dm_jump = pars['step_pars'][2]
+    mh_pars = hdir, pars['meas'], pars['volume']
+    steps = []
+
+    def relax(m, alt_args, h, kind):
+        _, m1, cg_iter, alt_args1, _ = minimize(m, h, pars, alt_args, (0, 0, 0, 0, 0), int(pars['min_pars'][10]))
+        mh = float(compute_mh(m1, mh_pars))
+        steps.append([kind, h, mh, 1, int(cg_iter)])
+        return m1, alt_args1, mh
+
+    fields = sweep_fields(hstart, hfinal, hstep, remanence)
+    alt_args = initial_alt_args(m, pars)
+    m, alt_args, mh = relax(m, alt_args, fields[0], SWEEP)
+    stable = m, alt_args, mh, fields[0]
+    switched = None
+    mr = numpy.nan
+    for h in fields[1:]:
+        m, alt_args, mh = relax(*stable[:2], h, SWEEP)
+        if abs(mh - stable[2]) > dm_jump:
+            steps[-1][3] = 0
+            switched = m, alt_args, mh, h
+            break
+        stable = m, alt_args, mh, h
+        if h == 0.0:
+            mr = mh
+    hc = numpy.nan
+    if switched is not None:
+        while abs(switched[3] - stable[3]) > tol:
+            h = 0.5*(stable[3] + switched[3])
+            m, alt_args, mh = relax(*stable[:2], h, BISECTION)
+            if abs(mh - stable[2]) > dm_jump:
+                steps[-1][3] = 0
+                switched = m, alt_args, mh, h
+            else:
+                stable = m, alt_args, mh, h
+        hc = 0.5*(stable[3] + switched[3])
+    if remanence and numpy.isnan(mr):
+        _, _, mr = relax(*(switched or stable)[:2], 0.0, REMANENCE)
+    return hc, mr, steps
+
+# returns the switching field and the remanence in Tesla
+def run(name):
+    setup_compilation_cache()
+    m, pars, tags = setup(name)
+    if pars['min_pars'][7] == 1:
+        m = to_soa(m)
+        pars = soa_pars(pars)
+    if pars['min_pars'][8] == 1:
+        pars = mixed_pars(pars)
+    pars['m_init'] = m
+    pars['step_pars'] = read_step_params(name)
+    remanence = bool(int(os.environ.get(REMANENCE_VARIABLE, "0")))
+
+    t0 = time()
+    hc, mr, steps = switching_field(m, pars, read_hc_tol(name), remanence)
+    total_time = time() - t0
+
+    with open(name + "_switching.dat", "w") as f:
+        for kind, h, mh, stable, cg_iter in steps:
+            f.write(f'{kind} {h} {mh} {stable} {cg_iter}\n')
+    with open(name + "_hc.dat", "w") as f:
+        f.write(f'{hc} {mr}\n')
+    with open(name + "_stats.txt", "w") as file:
+        file.write(
+            inspect.cleandoc(
+                f"""
+                Solve time: {total_time} s.
+                Minimizations: {len(steps)}.
+                NCG iterations: {sum(s[4] for s in steps)}.
+                """
+            ) + "\n"
+        )
+    return numpy.array([hc, mr])
+
+if __name__ == "__main__":
+    try:
+        name = sys.argv[1]
+    except IndexError:
+        sys.exit("usage run-escript switching.py modelname")
+
+    run(name)
@@ -1,6 +1,7 @@
 import configparser
 import math
 
+import numpy
 import scipy
 
 import psutil
@@ -17,12 +18,49 @@ def write_stats(header, total_time, cg_iter,function_calls,hmag_iter):
     print('  function calls         ', function_calls)
     # print('  iterations (hmag)      ', hmag_iter)
       
-def write_mh(name,mh):
-    with open(name + ".dat","w") as f:
+def write_mh(name,mh,mode="w"):
+    with open(name + ".dat",mode) as f:
         mu0 = get_mu0()
         for vtk_number,hext,m,energy in mh:
             f.write(f'{int(vtk_number)} {hext} {m} {energy/mu0}\n')
             
+# counters of each field step: field, NCG iterations, energy evaluations,
+# Poisson CG iterations, preconditioner CG iterations, SpMVs (see
+# loop.spmv_count), line search backtracks, NCG restarts and wall time in seconds
+def write_iterations(name,iters,mode="w"):
+    with open(name + "_iterations.dat",mode) as f:
+        for hext,cg_iter,function_calls,hmag_iter,precond_iter,spmv,backtracks,restarts,wall_time in iters:
+            f.write(f'{hext} {int(cg_iter)} {int(function_calls)} {int(hmag_iter)} {int(precond_iter)} {int(spmv)} {int(backtracks)} {int(restarts)} {wall_time}\n')
+
+# field directions of a multi-direction loop, one per line in <name>_directions.txt
+def read_directions(name):
+    fname = name + "_directions.txt"
+    if not os.path.exists(fname):
+        return None
+    return numpy.loadtxt(fname, ndmin=2).tolist()
+
+# initial states of a multi-start minimization, one line with the state and
+# the seed of the random state each in <name>_starts.txt
+def read_starts(name):
+    fname = name + "_starts.txt"
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return [(get_state_id(state), int(seed)) for state, seed in (line.split() for line in f if line.strip())]
+
+# id of the initial state in magnetization.getM; other states are uniform
+def get_state_id(state):
+    state_id = 0
+    if state.lower()=='flower':
+      state_id = 1
+    if state.lower()=='vortex':
+      state_id = 2      
+    if state.lower()=='twisted':
+      state_id = 3   
+    if state.lower()=='random':
+      state_id = 4   
+    return state_id
+
 def get_mu0():
     return scipy.constants.mu_0
           
@@ -72,6 +110,13 @@ def read_params(name):
             "tol_hmag_factor": 1.0,
             "precond_iter": 10,
             "iter_max": 1000,
+            "tol_hmag_adaptive": 0.0,
+            "extrapolate": 0,
+            "hmag_precond": 'jacobi',
+            "layout": 'aos',
+            "precision": 'double',
+            "precond_recycle": 0,
+            "minimizer": 'ncg',
             "verbose": 1,
         }
     )
@@ -86,16 +131,7 @@ def read_params(name):
             float(intial_state["mz"]),
         ]
     )
-    state = intial_state['state']
-    state_id = 0
-    if state.lower()=='flower':
-      state_id = 1
-    if state.lower()=='vortex':
-      state_id = 2      
-    if state.lower()=='twisted':
-      state_id = 3   
-    if state.lower()=='random':
-      state_id = 4   
+    state_id = get_state_id(intial_state['state'])
     h = normalize([float(field["hx"]), float(field["hy"]), float(field["hz"])])
     hstart, hfinal, hstep = (
         float(field["hstart"]),
@@ -109,12 +145,60 @@ def read_params(name):
     precond_iter = int(minimizer["precond_iter"])
     iter_max = int(minimizer["iter_max"])
     tol_u = tol_fun * tol_hmag_factor
+    tol_hmag_adaptive = float(minimizer["tol_hmag_adaptive"])
+    extrapolate = int(minimizer["extrapolate"])
+    hmag_precond_id = 0
+    if minimizer["hmag_precond"].lower()=='amg':
+      hmag_precond_id = 1
+    layout_id = 0
+    if minimizer["layout"].lower()=='soa':
+      layout_id = 1
+    precision_id = 0
+    if minimizer["precision"].lower()=='mixed':
+      precision_id = 1
+    precond_recycle = int(minimizer["precond_recycle"])
+    minimizer_id = 0
+    if minimizer["minimizer"].lower()=='bb':
+      minimizer_id = 1
+    if minimizer["minimizer"].lower()=='lbfgs':
+      minimizer_id = 2
     verbose = int(minimizer["verbose"])
     # print(f"tolerances: optimality tolerance {tol_fun}   hmag {tol_u}")
     return (                            
         (m,mstep,mfinal,state_id),                                 # magnetic state
         (h,hstart,hfinal,hstep),                                   # field steps
         hmag_on,                                                   # magnetostatics
-        (tol_u, tol_fun, precond_iter, iter_max),                  # solver parameters, 
+        (tol_u, tol_fun, precond_iter, iter_max,                   # solver parameters, 
+         tol_hmag_adaptive, extrapolate, hmag_precond_id, layout_id,
+         precision_id, precond_recycle, minimizer_id),
         verbose,                                                   # output
     ) # mag_pars, hext_pars, hmag_on, min_pars, verbose
+
+# adaptive field steps: the step is hstep times a power of two up to
+# 2**hstep_levels; it is doubled after steps with a change of mh below
+# hstep_dm_grow and at most hstep_iter_grow NCG iterations, and halved and
+# the step repeated if mh changes by more than hstep_dm_jump.
+# hstep_levels = 0 gives uniform steps
+def read_step_params(name):
+    config = configparser.ConfigParser(
+        {
+            "hstep_levels": 0,
+            "hstep_dm_grow": 0.005,
+            "hstep_dm_jump": 0.05,
+            "hstep_iter_grow": 50,
+        }
+    )
+    config.read(name + ".p2")
+    field = config["field"]
+    return (
+        int(field["hstep_levels"]),
+        float(field["hstep_dm_grow"]),
+        float(field["hstep_dm_jump"]),
+        int(field["hstep_iter_grow"]),
+    ) # levels, dm_grow, dm_jump, iter_grow
+
+# width of the field interval of the switching field bisection
+def read_hc_tol(name):
+    config = configparser.ConfigParser({"hc_tol": 1e-3})
+    config.read(name + ".p2")
+    return float(config["field"]["hc_tol"])
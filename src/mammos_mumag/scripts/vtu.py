@@ -0,0 +1,249 @@
+import io
+import os
+import queue
+import sys
+import threading
+import zipfile
+from time import time
+
+import numpy
+import esys.escript as e
+
+from mesh import read_fly_arrays, mesh_file
+
+# VTK XML unstructured grid of nodal fields written from numpy arrays,
+# without conversion to escript data and weipa.
+# The points are the nodes of the mesh file in file order, the cells the
+# elements of the first element section. The geometry is encoded once per
+# mesh, a snapshot writes the header, the stored geometry and the fields
+# as raw appended data.
+VTK_TYPES = {
+    'Line2': (3, 2), 'Tri3': (5, 3), 'Rec4': (9, 4), 'Tri6': (22, 6),
+    'Tet4': (10, 4), 'Hex8': (12, 8), 'Tet10': (24, 10),
+}
+
+def appended(a):
+    a = numpy.ascontiguousarray(a)
+    return numpy.uint64(a.nbytes).tobytes() + a.tobytes()
+
+def data_array(name, a, offset):
+    ncomp = a.shape[1] if a.ndim == 2 else 1
+    dtype = {'f8': 'Float64', 'i8': 'Int64', 'u1': 'UInt8'}[a.dtype.str[1:]]
+    return (f'<DataArray type="{dtype}" Name="{name}" NumberOfComponents="{ncomp}" '
+            f'format="appended" offset="{offset}"/>\n')
+
+class VtuWriter:
+    def __init__(self, name, domain):
+        node_ids, x, elements, _ = read_fly_arrays(name)
+        etype = next(iter(elements))
+        _, etags, enodes = elements[etype]
+        vtk_type, k = VTK_TYPES[etype]
+        order = numpy.argsort(node_ids)
+        # escript samples of the nodes to points
+        ids = numpy.array(e.Solution(domain).getReferenceIDs())
+        self.points = order[numpy.searchsorted(node_ids[order], ids)]
+        connectivity = order[numpy.searchsorted(node_ids[order], enodes[:, :k])]
+        x = numpy.asarray(x, dtype='<f8')
+        x = numpy.pad(x, ((0, 0), (0, 3 - x.shape[1])))             # 3D points
+        geometry = [
+            ('Points', x),
+            ('connectivity', connectivity.astype('<i8').ravel()),
+            ('offsets', numpy.arange(k, k*len(enodes) + 1, k, dtype='<i8')),
+            ('types', numpy.full(len(enodes), vtk_type, dtype='u1')),
+            ('tags', etags.astype('<f8')),
+        ]
+        self.geometry_arrays = dict(geometry)
+        self.arrays = {}
+        blocks = []
+        offset = 0
+        for key, a in geometry:
+            self.arrays[key] = data_array(key, a, offset)
+            blocks.append(appended(a))
+            offset += len(blocks[-1])
+        self.geometry = b''.join(blocks)
+        self.num_points = len(x)
+        self.num_cells = len(enodes)
+
+    # values at the escript samples, shape (N,) or (3N,) / (N,3), to the points
+    def point_values(self, values, dtype='<f8'):
+        values = numpy.asarray(values, dtype=dtype)
+        if values.size == 3*self.num_points:
+            values = values.reshape(-1, 3)
+        a = numpy.empty_like(values)
+        a[self.points] = values
+        return a
+
+    # fields: name -> values at the escript samples
+    def write(self, filename, **fields):
+        offset = len(self.geometry)
+        point_data, blocks = [], []
+        for key, values in fields.items():
+            a = self.point_values(values)
+            point_data.append(data_array(key, a, offset))
+            blocks.append(appended(a))
+            offset += len(blocks[-1])
+        header = (
+            '<?xml version="1.0"?>\n'
+            '<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" header_type="UInt64">\n'
+            '<UnstructuredGrid>\n'
+            f'<Piece NumberOfPoints="{self.num_points}" NumberOfCells="{self.num_cells}">\n'
+            '<Points>\n' + self.arrays['Points'] + '</Points>\n'
+            '<Cells>\n' + self.arrays['connectivity'] + self.arrays['offsets'] + self.arrays['types'] + '</Cells>\n'
+            '<PointData>\n' + ''.join(point_data) + '</PointData>\n'
+            '<CellData>\n' + self.arrays['tags'] + '</CellData>\n'
+            '</Piece>\n'
+            '</UnstructuredGrid>\n'
+            '<AppendedData encoding="raw">\n_'
+        )
+        with open(filename, 'wb') as f:
+            f.write(header.encode())
+            f.write(self.geometry)
+            for block in blocks:
+                f.write(block)
+            f.write(b'\n</AppendedData>\n</VTKFile>\n')
+
+# snapshot k of a loop as the file <prefix>_<k>.vtu
+class VtuFiles:
+    def __init__(self, writer, prefix):
+        self.writer = writer
+        self.prefix = prefix
+
+    def write(self, index, **fields):
+        self.writer.write(f"{self.prefix}_{index:04d}.vtu", **fields)
+
+    def close(self):
+        pass
+
+# All snapshots of a loop in one zip archive readable by numpy.load. The
+# geometry of the VtuWriter is stored once, the fields of snapshot k are
+# appended as compressed members <field>/<k>.npy in point order, optionally
+# as float32. The archive is reopened for every snapshot, so that it is
+# complete after each write.
+SERIES_VERSION = 1
+
+def add_array(archive, key, a):
+    buffer = io.BytesIO()
+    numpy.lib.format.write_array(buffer, numpy.ascontiguousarray(a), allow_pickle=False)
+    archive.writestr(key + '.npy', buffer.getvalue())
+
+# a resumed loop keeps the snapshots up to the snapshot of its checkpoint
+class SeriesWriter:
+    def __init__(self, writer, filename, dtype='float64', resume_counter=None):
+        self.writer = writer
+        self.filename = filename
+        self.dtype = numpy.dtype(dtype).newbyteorder('<')
+        if resume_counter is not None and os.path.exists(filename):
+            with zipfile.ZipFile(filename) as old, zipfile.ZipFile(filename + '.tmp', 'w') as new:
+                for info in old.infolist():
+                    key = info.filename[:-len('.npy')]
+                    if '/' not in key or int(key.split('/')[1]) <= resume_counter:
+                        new.writestr(info, old.read(info))
+            os.replace(filename + '.tmp', filename)
+            return
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+            add_array(archive, 'version', numpy.array(SERIES_VERSION))
+            for key, a in writer.geometry_arrays.items():
+                add_array(archive, key, a)
+
+    def write(self, index, **fields):
+        with zipfile.ZipFile(self.filename, 'a', zipfile.ZIP_DEFLATED) as archive:
+            for key, values in fields.items():
+                add_array(archive, f"{key}/{index:04d}", self.writer.point_values(values, self.dtype))
+
+    def close(self):
+        pass
+
+# snapshot output selected by the environment: <prefix>_<k>.vtu files or the
+# single file <prefix>_series.npz; a series file of an earlier run is removed
+SNAPSHOTS_VARIABLE = "MAMMOS_MUMAG_SNAPSHOTS"
+SNAPSHOT_DTYPE_VARIABLE = "MAMMOS_MUMAG_SNAPSHOT_DTYPE"
+
+def snapshot_writer(writer, prefix, resume_counter=None):
+    filename = prefix + "_series.npz"
+    if os.environ.get(SNAPSHOTS_VARIABLE, 'vtu') == 'series':
+        return SeriesWriter(writer, filename, os.environ.get(SNAPSHOT_DTYPE_VARIABLE, 'float64'), resume_counter)
+    if os.path.exists(filename):
+        os.remove(filename)
+    return VtuFiles(writer, prefix)
+
+# Snapshots written by a background thread, so that the computation of the
+# next field steps overlaps with the output. The queue is bounded, a full queue
+# blocks the caller. Errors are collected and returned by close(), which
+# waits until all snapshots are written.
+SNAPSHOT_QUEUE = 4
+
+class AsyncWriter:
+    def __init__(self, writer, maxsize=SNAPSHOT_QUEUE):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize)
+        self.errors = []
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            function, args, kwargs = item
+            try:
+                function(*args, **kwargs)
+            except Exception as exc:
+                self.errors.append(f"{function.__name__} {args[0] if args else ''}: {exc!r}")
+
+    # the arrays are copied, buffers passed to a callback may be reused by jax
+    def write(self, index, **fields):
+        self.queue.put((self.writer.write, (index,), {key: numpy.array(values) for key, values in fields.items()}))
+
+    # other output in order with the snapshots
+    def call(self, function, *args):
+        self.queue.put((function, args, {}))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            self.writer.close()
+        except Exception as exc:
+            self.errors.append(repr(exc))
+        return self.errors
+
+# writer of the last mesh, reused while the mesh file and domain are unchanged
+writers = {}
+
+def get_writer(name, domain):
+    path = os.path.abspath(mesh_file(name))
+    stat = os.stat(path)
+    key = path, stat.st_mtime_ns, stat.st_size, id(domain)
+    if writers.get('key') != key:
+        writers.clear()
+        writers['writer'] = VtuWriter(name, domain)
+        writers['key'] = key
+    return writers['writer']
+
+# time of a snapshot of m and u with weipa and with the direct writer
+if __name__ == "__main__":
+    from esys.weipa import saveVTK
+    from converters import toEscriptScalar, toEscriptVector
+    from escript_tools import readmesh_get_tags
+
+    try:
+        name = sys.argv[1]
+    except IndexError:
+        sys.exit("usage run-escript vtu.py modelname")
+
+    tags = readmesh_get_tags(name)
+    domain = tags.getDomain()
+    x = e.convertToNumpy(e.interpolate(domain.getX(), e.Solution(domain))).T
+    m = (x / numpy.maximum(numpy.linalg.norm(x, axis=1, keepdims=True), 1e-30)).reshape(-1)
+    u = x[:, 0].copy()
+
+    with open(name + "_vtu.csv", "w") as file:
+        file.write("writer,time\n")
+        t0 = time()
+        saveVTK(f"{name}_weipa", tags=tags, m=toEscriptVector(m, domain), u=toEscriptScalar(u, domain))
+        file.write(f"weipa,{time() - t0}\n")
+        writer = get_writer(name, domain)
+        t0 = time()
+        writer.write(f"{name}_direct.vtu", m=m, u=u)
+        file.write(f"direct,{time() - t0}\n")
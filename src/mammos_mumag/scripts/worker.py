@@ -0,0 +1,62 @@
+import importlib
+import os
+import pickle
+import runpy
+import sys
+import traceback
+
+# Long-lived process of the in-process backend of Simulation.
+# Requests (script, directory, name, environment) are read as pickles from
+# stdin, replies (ok, result) are written as pickles to the original stdout.
+# Output of the scripts goes to stderr.
+# esys, jax, scipy and the imported scripts stay loaded between requests.
+# A script that defines run(name) is imported once and keeps its state, e.g.
+# the mesh and the matrices of loop.py; its return value is the result.
+# Other scripts are executed as __main__ and return None.
+# MAMMOS_MUMAG_WORKER is set for the scripts, loop.py keeps its system only
+# in the worker.
+
+def run_request(script, directory, name, env):
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+    argv = sys.argv
+    try:
+        os.chdir(directory)
+        os.environ.update(env)
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script + ".py")
+        sys.argv = [path, name]
+        module = importlib.import_module(script)
+        if hasattr(module, 'run'):
+            return module.run(name)
+        runpy.run_path(path, run_name="__main__")
+        return None
+    finally:
+        sys.stdout.flush()
+        sys.argv = argv
+        os.environ.clear()
+        os.environ.update(environ)
+        os.chdir(cwd)
+
+def serve(requests, replies):
+    while True:
+        try:
+            request = pickle.load(requests)
+        except EOFError:
+            return
+        try:
+            reply = True, run_request(*request)
+        except SystemExit as exc:
+            if exc.code in (None, 0):
+                reply = True, None
+            else:
+                reply = False, f"{request[0]} exited with {exc.code}"
+        except BaseException:
+            reply = False, traceback.format_exc()
+        pickle.dump(reply, replies)
+        replies.flush()
+
+if __name__ == "__main__":
+    replies = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    os.environ["MAMMOS_MUMAG_WORKER"] = "1"
+    serve(sys.stdin.buffer, replies)
@@ -0,0 +1,70 @@
+"""Single-file output of the configurations of a loop."""
+
+from __future__ import annotations
+
+import pathlib
+import re
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pyvista as pv
+
+if TYPE_CHECKING:
+    import pyvista
+
+SERIES_SUFFIX = "_series.npz"
+"""Suffix of the series file `<name>_series.npz` of a loop."""
+
+
+def configuration_indices(filepath: str | pathlib.Path) -> list[int]:
+    """Return the indices of the configurations stored in a series file.
+
+    Args:
+        filepath: Path of the series file.
+
+    Returns:
+        Sorted configuration indices.
+
+    """
+    with np.load(filepath) as data:
+        indices = {
+            int(match.group(1))
+            for match in map(re.compile(r"[^/]+/(\d+)$").match, data.files)
+            if match
+        }
+    return sorted(indices)
+
+
+def read_configuration(
+    filepath: str | pathlib.Path, idx: int
+) -> pyvista.UnstructuredGrid:
+    """Read one configuration of a series file.
+
+    The series file is a `zip` archive in the format of :py:func:`numpy.savez`.
+    It holds the mesh once, as the arrays `Points`, `connectivity`, `offsets`,
+    `types` and `tags` of a `vtk` unstructured grid, and the fields of the
+    configuration `k` as compressed arrays `<field>/<k>`. Only the mesh and
+    the fields of configuration `idx` are read.
+
+    Args:
+        filepath: Path of the series file.
+        idx: Index of the configuration.
+
+    Returns:
+        Mesh with the fields of the configuration as point data.
+
+    """
+    suffix = f"/{idx:04d}"
+    with np.load(filepath) as data:
+        connectivity = data["connectivity"]
+        offsets = data["offsets"]
+        sizes = np.diff(offsets, prepend=0)
+        cells = np.insert(connectivity, offsets - sizes, sizes)
+        grid = pv.UnstructuredGrid(cells, data["types"], data["Points"])
+        grid.cell_data["tags"] = data["tags"]
+        fields = [key for key in data.files if key.endswith(suffix)]
+        if not fields:
+            raise KeyError(f"configuration {idx} not in {filepath}")
+        for key in fields:
+            grid.point_data[key.removesuffix(suffix)] = data[key]
+    return grid
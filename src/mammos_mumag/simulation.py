@@ -1,22 +1,45 @@
 """Simulation class."""
 
+import atexit
+import contextlib
 import datetime
 import json
 import os
 import pathlib
+import pickle
 import shlex
 import shutil
 import subprocess
+from typing import Any, Literal
 
+import numpy as np
 from pydantic import Field
 from pydantic.dataclasses import dataclass
 
 import mammos_mumag
 from mammos_mumag.materials import MaterialDomain, Materials
+from mammos_mumag.mesh import DOMAIN_DUMP_SUFFIX, MESH_SUFFIXES
+from mammos_mumag.mesh_store import MeshStore
 from mammos_mumag.parameters import Parameters
 from mammos_mumag.tools import check_dir, check_esys_escript
 
 IS_POSIX = os.name == "posix"
+# Environment variables read by the scripts. The scripts run under
+# `run-escript` without this package, so each name is defined again in the
+# script that reads it (store.py, jax_tools.py, vtu.py, switching.py, loop.py).
+CACHE_DIR_VARIABLE = "MAMMOS_MUMAG_CACHE_DIR"
+COMPILATION_CACHE_DIR_VARIABLE = "MAMMOS_MUMAG_COMPILATION_CACHE_DIR"
+SNAPSHOTS_VARIABLE = "MAMMOS_MUMAG_SNAPSHOTS"
+SNAPSHOT_DTYPE_VARIABLE = "MAMMOS_MUMAG_SNAPSHOT_DTYPE"
+REMANENCE_VARIABLE = "MAMMOS_MUMAG_REMANENCE"
+CHECKPOINT_INTERVAL_VARIABLE = "MAMMOS_MUMAG_CHECKPOINT_INTERVAL"
+RESUME_VARIABLE = "MAMMOS_MUMAG_RESUME"
+THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
 
 
 @dataclass
@@ -25,11 +48,21 @@ class Simulation:
 
     Args:
         material_domain_list: TODO
-        mesh_filepath: TODO
+        mesh_filepath: Path of the `fly` mesh, or of the binary `npz` mesh written
+            by :py:func:`mammos_mumag.mesh.convert_to_npz`.
         paretials_filepath: TODO
         parameters_filepath: TODO
         materials: class managing materials.
         parameters: class managing parameters.
+        backend: How scripts are executed. With `"subprocess"` every script runs
+            in a new `esys.escript` process. With `"inprocess"` all scripts run in
+            one long-lived worker process, which keeps `esys.escript`, `jax` and
+            `scipy` imported, and keeps meshes and matrices of the loop script in
+            memory between calls.
+        mesh_store: Content-addressed store of meshes. If given, the working
+            directories of the runs reference the stored mesh instead of a copy
+            of it, and the matrix cache of the mesh in the store is used if no
+            `cache_dir` is given.
 
     """
 
@@ -39,6 +72,8 @@ class Simulation:
     parameters_filepath: pathlib.Path | None = Field(default=None, repr=False)
     materials: Materials | None = Field(default=None)
     parameters: Parameters | None = Field(default=None)
+    backend: Literal["subprocess", "inprocess"] = Field(default="subprocess")
+    mesh_store: MeshStore | None = Field(default=None, repr=False)
 
     def __post_init__(self) -> None:
         """Post-initialization.
@@ -66,6 +101,61 @@ class Simulation:
             if self.__getattribute__(attr) is None:
                 raise AttributeError(f"Attribute `{attr}` has not been defined yet.")
 
+    def copy_mesh(self, outdir: pathlib.Path, name: str) -> None:
+        """Copy the mesh to the working directory.
+
+        The mesh is copied to `<name>.fly`, or to `<name>.npz` for a binary mesh.
+        With a mesh store, it is linked to the stored mesh instead of copied.
+        A mesh of the other format left in `outdir` by an earlier run is removed,
+        since the scripts read `<name>.npz` if it exists.
+
+        For a binary mesh, `<name>_domain.nc` is a symbolic link to the
+        `esys.finley` dump of its domain, `<stem>_domain.nc` next to the mesh or
+        `domain/domain.nc` of the stored mesh, so that the domain is built only
+        once, see :py:func:`mammos_mumag.mesh.convert_to_npz`. The copy keeps the
+        modification time of the mesh, which tells if the dump is up to date.
+
+        Args:
+            outdir: Working directory.
+            name: System name.
+
+        """
+        mesh_filepath = pathlib.Path(self.mesh_filepath)
+        suffix = ".npz" if mesh_filepath.suffix == ".npz" else ".fly"
+        # the old files may be links to a stored mesh, they are never overwritten
+        for old in (*MESH_SUFFIXES, DOMAIN_DUMP_SUFFIX):
+            (outdir / f"{name}{old}").unlink(missing_ok=True)
+        if self.mesh_store is None:
+            shutil.copy2(mesh_filepath, outdir / f"{name}{suffix}")
+        else:
+            self.mesh_store.link_to(mesh_filepath, outdir / f"{name}{suffix}")
+        if suffix == ".npz":
+            if self.mesh_store is None:
+                dump = mesh_filepath.with_name(mesh_filepath.stem + DOMAIN_DUMP_SUFFIX)
+            else:
+                dump = self.mesh_store.artifact_dir(mesh_filepath, "domain")
+                dump = dump / "domain.nc"
+            # without symbolic links the dump is written to outdir
+            with contextlib.suppress(OSError):
+                os.symlink(dump.resolve(), outdir / f"{name}{DOMAIN_DUMP_SUFFIX}")
+
+    def matrix_cache_dir(
+        self, cache_dir: str | pathlib.Path | None
+    ) -> str | pathlib.Path | None:
+        """Directory of the matrix cache.
+
+        Args:
+            cache_dir: Directory of the matrix cache given to the run method.
+
+        Returns:
+            `cache_dir` if it is given, otherwise the `matrices` directory of the
+            mesh in the mesh store, or `None` without mesh store.
+
+        """
+        if cache_dir is None and self.mesh_store is not None:
+            return self.mesh_store.artifact_dir(self.mesh_filepath, "matrices")
+        return cache_dir
+
     @classmethod
     def run_file(
         cls, file: str | pathlib.Path, outdir: str | pathlib.Path = "out"
@@ -85,22 +175,42 @@ class Simulation:
         _run_subprocess(cmd, cwd=outdir)
 
     @classmethod
-    def run_script(cls, script: str, outdir: str | pathlib.Path, name: str) -> None:
+    def run_script(
+        cls,
+        script: str,
+        outdir: str | pathlib.Path,
+        name: str,
+        env: dict[str, str] | None = None,
+        backend: Literal["subprocess", "inprocess"] = "subprocess",
+        cpus: list[int] | None = None,
+    ) -> Any:
         """Run pre-defined script.
 
         Args:
             script: Name of pre-defined script.
             outdir: Working directory
             name: System name
+            env: Additional environment variables for the script.
+            backend: Run the script in a new process (`"subprocess"`) or in the
+                long-lived worker process (`"inprocess"`).
+            cpus: CPUs the new process is bound to.
+
+        Returns:
+            Result of the script if it is run in the worker process and the
+            script returns one, otherwise `None`.
 
         """
         check_esys_escript()
-        cmd = shlex.split(
-            f"{mammos_mumag._run_escript_bin} "
-            f"{mammos_mumag._scripts_directory / script}.py {name}",
-            posix=IS_POSIX,
-        )
-        _run_subprocess(cmd, cwd=outdir)
+        if backend == "inprocess":
+            result = _get_worker().run(script, outdir, name, env)
+        else:
+            cmd = shlex.split(
+                f"{mammos_mumag._run_escript_bin} "
+                f"{mammos_mumag._scripts_directory / script}.py {name}",
+                posix=IS_POSIX,
+            )
+            _run_subprocess(cmd, cwd=outdir, env=env, cpus=cpus)
+            result = None
         with open(outdir / "info.json", "w") as file:
             json.dump(
                 {
@@ -111,6 +221,7 @@ class Simulation:
                 },
                 file,
             )
+        return result
 
     def run_exani(
         self,
@@ -130,7 +241,7 @@ class Simulation:
 
         This scripts creates the following files in `outdir`:
 
-        * `<name>.fly`: mesh file.
+        * `<name>.fly`: mesh file, `<name>.npz` for a binary mesh.
 
         * `<name>.krn`: materials file.
 
@@ -149,13 +260,14 @@ class Simulation:
         """
         outdir = check_dir(outdir)
         self.check_attribute("mesh_filepath", "materials")
-        shutil.copyfile(self.mesh_filepath, outdir / f"{name}.fly")
+        self.copy_mesh(outdir, name)
         self.materials.write_krn(outdir / f"{name}.krn")
 
         self.run_script(
             script="exani",
             outdir=outdir,
             name=name,
+            backend=self.backend,
         )
 
     def run_external(
@@ -169,7 +281,7 @@ class Simulation:
 
         This scripts creates the following files in `outdir`:
 
-        * `<name>.fly`: mesh file.
+        * `<name>.fly`: mesh file, `<name>.npz` for a binary mesh.
 
         * `<name>.krn`: materials file.
 
@@ -185,7 +297,7 @@ class Simulation:
         """
         outdir = check_dir(outdir)
         self.check_attribute("mesh_filepath", "materials", "parameters")
-        shutil.copyfile(self.mesh_filepath, outdir / f"{name}.fly")
+        self.copy_mesh(outdir, name)
         self.materials.write_krn(outdir / f"{name}.krn")
         self.parameters.write_p2(outdir / f"{name}.p2")
 
@@ -193,6 +305,7 @@ class Simulation:
             script="external",
             outdir=outdir,
             name=name,
+            backend=self.backend,
         )
 
     def run_hmag(self, outdir: str | pathlib.Path = "hmag", name: str = "out") -> None:
@@ -208,7 +321,7 @@ class Simulation:
 
         This scripts creates the following files in `outdir`:
 
-        * `<name>.fly`: mesh file.
+        * `<name>.fly`: mesh file, `<name>.npz` for a binary mesh.
 
         * `<name>.krn`: materials file.
 
@@ -246,23 +359,81 @@ class Simulation:
         """
         outdir = check_dir(outdir)
         self.check_attribute("mesh_filepath", "materials")
-        shutil.copyfile(self.mesh_filepath, outdir / f"{name}.fly")
+        self.copy_mesh(outdir, name)
         self.materials.write_krn(outdir / f"{name}.krn")
 
         self.run_script(
             script="hmag",
             outdir=outdir,
             name=name,
+            backend=self.backend,
         )
 
-    def run_loop(self, outdir: str | pathlib.Path = "loop", name: str = "out") -> None:
+    def run_loop(
+        self,
+        outdir: str | pathlib.Path = "loop",
+        name: str = "out",
+        cache_dir: str | pathlib.Path | None = None,
+        directions: list[list[float]] | None = None,
+        compilation_cache_dir: str | pathlib.Path | None = None,
+        threads: int | None = None,
+        cpus: list[int] | None = None,
+        snapshots: Literal["vtu", "series"] = "vtu",
+        snapshot_dtype: Literal["float64", "float32"] = "float64",
+        checkpoint_interval: int | None = None,
+        resume: bool = False,
+    ) -> np.ndarray | list[np.ndarray] | None:
         r"""Run "loop" script.
 
         Compute demagnetization curves.
 
+        If `cache_dir` is given, the sparse matrices are read from the matrix
+        cache in this directory, or computed and added to it. Cache entries are
+        identified by a hash of the mesh, the materials, and the mesh size and
+        scale parameters, so they can be shared by all runs on the same system.
+        Without `cache_dir`, the matrix cache of the mesh in the mesh store is
+        used. Without both, matrices stored in `outdir` by :py:meth:`run_store`
+        are used if they match the system.
+
+        If `directions` is given, one demagnetization curve is computed for each
+        field direction, replacing the direction of the parameters. All curves are
+        computed in one process that reuses the sparse matrices and the compiled
+        solver. The `<name>.dat` and `vtu` files of the :math:`k`-th direction are
+        written to the subdirectory `<k>` of `outdir`.
+
+        If `compilation_cache_dir` is given, the compiled solver is stored in this
+        persistent `jax` compilation cache and reused by later runs with the same
+        mesh size and number of field steps.
+
+        If `threads` is given, the number of threads used by `OpenMP` and the
+        `BLAS` libraries of the script is limited to `threads`, and with
+        `threads=1` the `Eigen` operations of `XLA` are single threaded. `XLA`
+        sizes its thread pool by the number of CPUs the process may run on, so
+        its threads are limited by binding the script to the CPUs `cpus`
+        (on Linux), which sets `threads` to `len(cpus)` if it is not given.
+        Loops running at the same time should get disjoint `cpus` to avoid
+        oversubscription of the cores. The limits apply only to the
+        `"subprocess"` backend.
+
+        With `snapshots="series"` the saved configurations are appended to the
+        single file `<name>_series.npz` instead of one `vtu` file each. The mesh
+        is stored once and the fields `m` and `u` of every configuration are
+        compressed, as `float32` if `snapshot_dtype="float32"`. See
+        :py:mod:`mammos_mumag.series` for reading the file.
+
+        The rows of `<name>.dat` and `<name>_iterations.dat` are appended after
+        every field step, so the tables of an interrupted loop are usable. Every
+        `checkpoint_interval` field steps the state of the loop is written to
+        `<name>_checkpoint.npz`; the state is copied from the device only for
+        these steps. With `resume=True` a loop continues from its
+        checkpoint in `outdir`, or starts from the beginning if there is none.
+        A completed loop keeps the checkpoint of its final state: resuming it
+        computes no further field steps, unless `mfinal` was lowered. The mesh,
+        materials and the other parameters must be the ones of the first run.
+
         This scripts creates the following files in `outdir`:
 
-        * `<name>.fly`: mesh file.
+        * `<name>.fly`: mesh file, `<name>.npz` for a binary mesh.
 
         * `<name>.krn`: materials file.
 
@@ -270,7 +441,30 @@ class Simulation:
 
         * `<name>_{i}.vtu`: saved `vtk` files. TODO
 
-        * `<name>_stats.txt`: memory usage information.
+        * `<name>_series.npz`: saved configurations with `snapshots="series"`.
+
+        * `<name>_checkpoint.npz`: state of the loop for `resume=True`.
+
+        * `<name>_stats.txt`: memory usage, compilation cache hits and misses,
+          compile time, solve time, total iteration counts and the numbers of
+          field steps and of repeated adaptive field steps.
+
+        * `<name>_iterations.dat`: iteration counts of each field step. The
+          columns are :math:`\mu_0 H_{\mathsf{ext}}` in Tesla, the number of
+          nonlinear conjugate gradient iterations, the number of energy
+          evaluations, the number of conjugate gradient iterations of the
+          magnetic scalar potential, the number of conjugate gradient
+          iterations of the preconditioner, the total number of sparse
+          matrix-vector products including those of the multigrid
+          preconditioner, the number of line search backtracks, the number of
+          restarts of the nonlinear conjugate gradient method and the wall time
+          of the field step in seconds. With mixed precision, the residuals and
+          preconditioner applications of the refinement steps after the first
+          of each Poisson solve are not counted as matrix-vector products. The
+          counters are accumulated in the compiled loop without synchronization
+          with the host.
+          :py:attr:`mammos_mumag.hysteresis.Result.iterations` holds the table
+          as a dataframe.
 
         * `<name>.dat`: table data regarding the demagnetization curve.
           The columns of the file are:
@@ -290,18 +484,53 @@ class Simulation:
         Args:
             outdir: Working directory.
             name: System name.
+            cache_dir: Directory of the matrix cache.
+            directions: List of field directions.
+            compilation_cache_dir: Directory of the `jax` compilation cache.
+            threads: Number of threads of the script.
+            cpus: CPUs the script is bound to.
+            snapshots: Output of the saved configurations, `"vtu"` files or a
+                `"series"` file.
+            snapshot_dtype: Floating point type of the fields in the series file.
+            checkpoint_interval: Number of field steps between checkpoints,
+                `None` for no checkpoints.
+            resume: Continue from the checkpoint of an interrupted loop.
+
+        Returns:
+            With the `"inprocess"` backend the table of `<name>.dat` as array, or
+            a list of tables if `directions` is given. With the `"subprocess"`
+            backend `None`.
 
         """
         outdir = check_dir(outdir)
         self.check_attribute("mesh_filepath", "materials", "parameters")
-        shutil.copyfile(self.mesh_filepath, outdir / f"{name}.fly")
+        self.copy_mesh(outdir, name)
         self.materials.write_krn(outdir / f"{name}.krn")
         self.parameters.write_p2(outdir / f"{name}.p2")
-
-        self.run_script(
+        directions_file = outdir / f"{name}_directions.txt"
+        if directions is None:
+            directions_file.unlink(missing_ok=True)
+        else:
+            with open(directions_file, "w") as file:
+                file.writelines(f"{h[0]} {h[1]} {h[2]}\n" for h in directions)
+
+        if threads is None and cpus is not None:
+            threads = len(cpus)
+        return self.run_script(
             script="loop",
             outdir=outdir,
             name=name,
+            backend=self.backend,
+            cpus=cpus,
+            env=_script_env(
+                cache_dir=self.matrix_cache_dir(cache_dir),
+                compilation_cache_dir=compilation_cache_dir,
+                threads=threads,
+                snapshots=snapshots,
+                snapshot_dtype=snapshot_dtype,
+                checkpoint_interval=checkpoint_interval,
+                resume=resume,
+            ),
         )
 
     def run_magnetization(
@@ -320,7 +549,7 @@ class Simulation:
         """
         outdir = check_dir(outdir)
         self.check_attribute("mesh_filepath", "materials", "parameters")
-        shutil.copyfile(self.mesh_filepath, outdir / f"{name}.fly")
+        self.copy_mesh(outdir, name)
         self.materials.write_krn(outdir / f"{name}.krn")
         self.parameters.write_p2(outdir / f"{name}.p2")
 
@@ -328,6 +557,7 @@ class Simulation:
             script="magnetization",
             outdir=outdir,
             name=name,
+            backend=self.backend,
         )
 
     def run_mapping(
@@ -348,7 +578,7 @@ class Simulation:
         """
         outdir = check_dir(outdir)
         self.check_attribute("mesh_filepath", "materials", "parameters")
-        shutil.copyfile(self.mesh_filepath, outdir / f"{name}.fly")
+        self.copy_mesh(outdir, name)
         self.materials.write_krn(outdir / f"{name}.krn")
         self.parameters.write_p2(outdir / f"{name}.p2")
 
@@ -356,6 +586,7 @@ class Simulation:
             script="mapping",
             outdir=outdir,
             name=name,
+            backend=self.backend,
         )
 
     def run_materials(
@@ -372,31 +603,39 @@ class Simulation:
         """
         outdir = check_dir(outdir)
         self.check_attribute("mesh_filepath", "materials")
-        shutil.copyfile(self.mesh_filepath, outdir / f"{name}.fly")
+        self.copy_mesh(outdir, name)
         self.materials.write_krn(outdir / f"{name}.krn")
 
         self.run_script(
             script="materials",
             outdir=outdir,
             name=name,
+            backend=self.backend,
         )
 
     def run_store(
-        self, outdir: str | pathlib.Path = "magnetization", name: str = "out"
+        self,
+        outdir: str | pathlib.Path = "magnetization",
+        name: str = "out",
+        cache_dir: str | pathlib.Path | None = None,
     ) -> None:
         """Run "store" script.
 
         The sparse matrices used for computation can be stored
-        and reused for simulations with the same finite element mesh.
+        and reused for simulations with the same finite element mesh
+        and materials. They are written to the matrix cache in `cache_dir`,
+        or to the matrix cache of the mesh in the mesh store, or in `outdir` if
+        neither is given.
 
         Args:
             outdir: Working directory.
             name: System name.
+            cache_dir: Directory of the matrix cache.
 
         """
         outdir = check_dir(outdir)
         self.check_attribute("mesh_filepath", "materials", "parameters")
-        shutil.copyfile(self.mesh_filepath, outdir / f"{name}.fly")
+        self.copy_mesh(outdir, name)
         self.materials.write_krn(outdir / f"{name}.krn")
         self.parameters.write_p2(outdir / f"{name}.p2")
 
@@ -404,24 +643,354 @@ class Simulation:
             script="store",
             outdir=outdir,
             name=name,
+            backend=self.backend,
+            env=_script_env(cache_dir=self.matrix_cache_dir(cache_dir)),
+        )
+
+    def run_switching(
+        self,
+        outdir: str | pathlib.Path = "switching",
+        name: str = "out",
+        cache_dir: str | pathlib.Path | None = None,
+        compilation_cache_dir: str | pathlib.Path | None = None,
+        remanence: bool = False,
+        threads: int | None = None,
+    ) -> np.ndarray | None:
+        r"""Run "switching" script.
+
+        Compute the switching field without the demagnetization curve.
+
+        The external field is swept from `hstart` towards `hfinal` in steps of
+        `hstep` until the magnetic polarisation parallel to the field changes by
+        more than `hstep_dm_jump` in one step. The switching field is then
+        bisected in the interval of this step until the interval is narrower than
+        `hc_tol`. Every bisection step starts from the last stable configuration.
+        The number of minimizations grows with the logarithm of
+        `hstep / hc_tol` instead of linearly as for a sweep with step `hc_tol`.
+
+        If `remanence` is set, the sweep includes zero field and the polarisation
+        at zero field is computed.
+
+        The matrix cache and the compilation cache are used as in
+        :py:meth:`run_loop`.
+
+        This scripts creates the following files in `outdir`:
+
+        * `<name>.fly`: mesh file, `<name>.npz` for a binary mesh.
+
+        * `<name>.krn`: materials file.
+
+        * `<name>.p2`: simulation parameters file.
+
+        * `<name>_stats.txt`: solve time, number of minimizations and total
+          iteration count.
+
+        * `<name>_switching.dat`: one line per minimization with the kind of step
+          (0 sweep, 1 bisection, 2 remanence), :math:`\mu_0 H_{\mathsf{ext}}` in
+          Tesla, the magnetic polarisation parallel to the field in Tesla, 1 if
+          the configuration is stable and 0 if it has switched, and the number
+          of nonlinear conjugate gradient iterations.
+
+        * `<name>_hc.dat`: the switching field :math:`\mu_0 H_{\mathsf{sw}}` and
+          the remanent polarisation in Tesla, `nan` if no switching occurred in
+          the field range or the remanence was not computed.
+
+        Args:
+            outdir: Working directory.
+            name: System name.
+            cache_dir: Directory of the matrix cache.
+            compilation_cache_dir: Directory of the `jax` compilation cache.
+            remanence: Compute the remanent polarisation.
+            threads: Number of threads of the script.
+
+        Returns:
+            With the `"inprocess"` backend the switching field and the remanent
+            polarisation in Tesla as array, with the `"subprocess"` backend
+            `None`.
+
+        """
+        outdir = check_dir(outdir)
+        self.check_attribute("mesh_filepath", "materials", "parameters")
+        self.copy_mesh(outdir, name)
+        self.materials.write_krn(outdir / f"{name}.krn")
+        self.parameters.write_p2(outdir / f"{name}.p2")
+
+        return self.run_script(
+            script="switching",
+            outdir=outdir,
+            name=name,
+            backend=self.backend,
+            env=_script_env(
+                cache_dir=self.matrix_cache_dir(cache_dir),
+                compilation_cache_dir=compilation_cache_dir,
+                threads=threads,
+                remanence=remanence,
+            ),
         )
 
+    def run_multistart(
+        self,
+        outdir: str | pathlib.Path = "multistart",
+        name: str = "out",
+        starts: list[tuple[str, int]] | None = None,
+        cache_dir: str | pathlib.Path | None = None,
+        compilation_cache_dir: str | pathlib.Path | None = None,
+        threads: int | None = None,
+    ) -> np.ndarray | None:
+        r"""Run "multistart" script.
+
+        Minimize the energy from several initial states at the field `hstart`.
+
+        All starts are minimized together with `jax.vmap` on the same assembled
+        matrices, in one process and with one compiled minimizer, instead of one
+        run per initial state. The minimization ends when the last start has
+        converged. Each start is an initial state (`"uniform"`, `"flower"`,
+        `"vortex"`, `"twisted"` or `"random"`) and the seed of the random state,
+        so that random states are reproducible. Without `starts` the initial
+        state of the parameters is the only start.
+
+        The matrix cache and the compilation cache are used as in
+        :py:meth:`run_loop`.
+
+        This scripts creates the following files in `outdir`:
+
+        * `<name>.fly`: mesh file, `<name>.npz` for a binary mesh.
 
-def _run_subprocess(cmd: list[str], cwd: str | pathlib.Path) -> None:
+        * `<name>.krn`: materials file.
+
+        * `<name>.p2`: simulation parameters file.
+
+        * `<name>_starts.txt`: initial state and seed of each start.
+
+        * `<name>_stats.txt`: solve time, number of starts, the start with the
+          lowest energy and total iteration counts.
+
+        * `<name>_multistart.dat`: one line per start with the id of the initial
+          state (0 uniform, 1 flower, 2 vortex, 3 twisted, 4 random), the seed,
+          the energy density in :math:`\mathrm{J}/\mathrm{m}^3`, the magnetic
+          polarisation parallel to the field in Tesla, the number of nonlinear
+          conjugate gradient iterations and the number of energy evaluations.
+
+        * `<name>_start_{k}.vtu`: final configuration of the start `k`.
+
+        * `<name>_lowest.vtu`: final configuration with the lowest energy.
+
+        Args:
+            outdir: Working directory.
+            name: System name.
+            starts: Initial state and seed of each start.
+            cache_dir: Directory of the matrix cache.
+            compilation_cache_dir: Directory of the `jax` compilation cache.
+            threads: Number of threads of the script.
+
+        Returns:
+            With the `"inprocess"` backend the table of `<name>_multistart.dat`,
+            with the `"subprocess"` backend `None`.
+
+        """
+        outdir = check_dir(outdir)
+        self.check_attribute("mesh_filepath", "materials", "parameters")
+        self.copy_mesh(outdir, name)
+        self.materials.write_krn(outdir / f"{name}.krn")
+        self.parameters.write_p2(outdir / f"{name}.p2")
+        starts_file = outdir / f"{name}_starts.txt"
+        if starts is None:
+            starts_file.unlink(missing_ok=True)
+        else:
+            with open(starts_file, "w") as file:
+                file.writelines(f"{state} {int(seed)}\n" for state, seed in starts)
+
+        return self.run_script(
+            script="multistart",
+            outdir=outdir,
+            name=name,
+            backend=self.backend,
+            env=_script_env(
+                cache_dir=self.matrix_cache_dir(cache_dir),
+                compilation_cache_dir=compilation_cache_dir,
+                threads=threads,
+            ),
+        )
+
+
+class _Worker:
+    """Long-lived `esys.escript` process running the pre-defined scripts.
+
+    Requests and results are exchanged as pickles through the standard input and
+    output of the process, see `scripts/worker.py`.
+    """
+
+    def __init__(self) -> None:
+        """Start the worker process."""
+        cmd = shlex.split(
+            f"{mammos_mumag._run_escript_bin} "
+            f"{mammos_mumag._scripts_directory / 'worker'}.py",
+            posix=IS_POSIX,
+        )
+        self.process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    def run(
+        self,
+        script: str,
+        outdir: str | pathlib.Path,
+        name: str,
+        env: dict[str, str] | None = None,
+    ) -> Any:
+        """Run pre-defined script in the worker process.
+
+        Args:
+            script: Name of pre-defined script.
+            outdir: Working directory.
+            name: System name.
+            env: Additional environment variables for the script.
+
+        Returns:
+            Result of the script.
+
+        Raises:
+            RuntimeError: Simulation has failed or the worker process has died.
+
+        """
+        request = script, str(pathlib.Path(outdir).resolve()), name, env or {}
+        try:
+            pickle.dump(request, self.process.stdin)
+            self.process.stdin.flush()
+            ok, result = pickle.load(self.process.stdout)
+        except (BrokenPipeError, EOFError) as exc:
+            raise RuntimeError(
+                "Simulation has failed. Worker process exited with code "
+                f"{self.process.wait()}."
+            ) from exc
+        if not ok:
+            raise RuntimeError(f"Simulation has failed. Exit with error: \n{result}")
+        return result
+
+    def alive(self) -> bool:
+        """Check if the worker process is running."""
+        return self.process.poll() is None
+
+    def close(self) -> None:
+        """Stop the worker process."""
+        if self.alive():
+            self.process.stdin.close()
+            self.process.wait()
+
+
+_worker: _Worker | None = None
+
+
+def _get_worker() -> _Worker:
+    """Get the worker process, start it if it is not running.
+
+    Returns:
+        Worker process.
+
+    """
+    global _worker
+    if _worker is None or not _worker.alive():
+        _worker = _Worker()
+        atexit.register(_worker.close)
+    return _worker
+
+
+def _script_env(
+    cache_dir: str | pathlib.Path | None = None,
+    compilation_cache_dir: str | pathlib.Path | None = None,
+    threads: int | None = None,
+    snapshots: str | None = None,
+    snapshot_dtype: str | None = None,
+    remanence: bool = False,
+    checkpoint_interval: int | None = None,
+    resume: bool = False,
+) -> dict[str, str] | None:
+    """Environment variables selecting cache directories and threads of a script.
+
+    Args:
+        cache_dir: Directory of the matrix cache.
+        compilation_cache_dir: Directory of the `jax` compilation cache.
+        threads: Number of threads of `XLA`, `OpenMP` and `BLAS`.
+        snapshots: Output of the saved configurations of the loop.
+        snapshot_dtype: Floating point type of the fields in the series file.
+        remanence: Compute the remanence in the switching field script.
+        checkpoint_interval: Number of field steps between checkpoints of the loop.
+        resume: Resume the loop from its checkpoint.
+
+    Returns:
+        Environment variables or `None` if no option is given.
+
+    """
+    env = {}
+    if cache_dir is not None:
+        env[CACHE_DIR_VARIABLE] = str(check_dir(cache_dir).resolve())
+    if compilation_cache_dir is not None:
+        env[COMPILATION_CACHE_DIR_VARIABLE] = str(
+            check_dir(compilation_cache_dir).resolve()
+        )
+    if threads is not None:
+        env.update(_thread_env(threads))
+    if snapshots is not None:
+        env[SNAPSHOTS_VARIABLE] = snapshots
+    if snapshot_dtype is not None:
+        env[SNAPSHOT_DTYPE_VARIABLE] = snapshot_dtype
+    if remanence:
+        env[REMANENCE_VARIABLE] = "1"
+    if checkpoint_interval is not None:
+        env[CHECKPOINT_INTERVAL_VARIABLE] = str(checkpoint_interval)
+    if resume:
+        env[RESUME_VARIABLE] = "1"
+    return env or None
+
+
+def _thread_env(threads: int) -> dict[str, str]:
+    """Environment variables limiting the number of threads of a process.
+
+    Args:
+        threads: Number of threads.
+
+    Returns:
+        Environment variables.
+
+    """
+    env = {variable: str(threads) for variable in THREAD_VARIABLES}
+    if threads == 1:
+        xla_flags = os.environ.get("XLA_FLAGS", "").split()
+        env["XLA_FLAGS"] = " ".join([*xla_flags, "--xla_cpu_multi_thread_eigen=false"])
+    return env
+
+
+def _run_subprocess(
+    cmd: list[str],
+    cwd: str | pathlib.Path,
+    env: dict[str, str] | None = None,
+    cpus: list[int] | None = None,
+) -> None:
     """Run command using `subprocess` in the specified directory.
 
     Args:
         cmd: command to execute
         cwd: working directory
+        env: additional environment variables
+        cpus: CPUs the process is bound to, ignored if the platform does not
+            support CPU affinity
 
     Raises:
         RuntimeError: Simulation has failed.
 
     """
+    preexec_fn = None
+    if cpus is not None and hasattr(os, "sched_setaffinity"):
+
+        def preexec_fn():
+            os.sched_setaffinity(0, cpus)
+
     res = subprocess.run(
         cmd,
         cwd=cwd,
         stderr=subprocess.PIPE,
+        env=None if env is None else {**os.environ, **env},
+        preexec_fn=preexec_fn,
     )
     return_code = res.returncode
 
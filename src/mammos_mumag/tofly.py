@@ -1,6 +1,6 @@
 """Convert unv mesh files to the fly format.
 
-usage: tofly.py [-h] [-e DIMENSIONS] [UNV] [FLY]
+usage: python -m mammos_mumag.tofly [-h] [-e DIMENSIONS] [-t] [UNV] [FLY]
 
 Convert unv files to the fly format. Elements that belong to a group called
 'contact' will be converted to their contact counterparts. First and secound
@@ -19,11 +19,27 @@ optional arguments:
   -e DIMENSIONS, --exclude DIMENSIONS
                         Comma separated list of dimensions that shall be
                         ignored while converting (e.g. '-e 1,2' only converts
-                        3D elements).
+                        3D elements, the default).
+  -t, --time            Print the throughput of the conversion to stderr.
+
+The unv file is read in blocks of complete lines. Node and element records are
+split into columns of tokens with strided slices and written with one
+formatting operation per block, so the coordinates are copied as they are
+written in the unv file. Element sections are spooled to temporary files per
+element type, so the memory does not grow with the size of the mesh.
 """
 
+import argparse
 import functools
+import itertools
 import pathlib
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
 
 CONTACT_GRP = "contact"
 
@@ -41,6 +57,8 @@ UNV_index = {
 }
 FLY_MESH_NAME = "Mesh"
 
+BLOCK_SIZE = 1 << 22  # bytes read at once
+
 FLY_NODES = "Nodes"
 FLY_LINE2 = "Line2"
 FLY_LINE3 = "Line3"
@@ -103,190 +121,240 @@ class EndOfSectionError(Exception):
     pass
 
 
-def scanUnv(file, exclude):
-    index = {}
-    groups = {}
-    nodes = []
-    contact = set()
-    t = findSection(file)
-    while t is not None:
-        if t == UNV_NODES:
-            indexNodes(nodes, file)
-        elif t == UNV_ELEMS:
-            indexElems(index, file, exclude)
-        elif t == UNV_GROUPS:
-            parseGroups(groups, contact, file)
-        else:
-            skipSection(file)
-        t = findSection(file)
-    return nodes, index, groups, contact
-
-
-def findSection(file):
-    secType = ""
-    line = file.readline()
-    while line and secType == "":
-        if line.startswith(UNV_DELIM):
-            secType = file.readline().strip()
-        else:
-            line = file.readline()
-    if secType == "":
-        return None
-    return secType
-
-
-def skipSection(file):
-    line = file.readline()
-    while not line.startswith(UNV_DELIM):
-        line = file.readline()
-
-
-def indexNodes(nodes, file):
-    data = (file.tell(), countUnvNodes(file))
-    nodes.append(data)
+_DELIM = re.compile(b"^" + UNV_DELIM.encode(), re.MULTILINE)
+_BEAM = set(t.encode() for t in UNV_BEAM)
+_CONTACT = CONTACT_GRP.encode()
+_NO_GROUP = b"-1"
 
 
-def countUnvNodes(file):
-    num = 7
-    cnt = 0
-    data = parse(file, num, 0b1)
-    while data:
-        data = parse(file, num, 0b1)
-        cnt += 1
-    return cnt
-
-
-def static_vars(**kwargs):
-    def decorate(func):
-        for k in kwargs:
-            setattr(func, k, kwargs[k])
-        return func
-
-    return decorate
-
-
-@static_vars(rem=[])
-def parse(f, num, pattern):
-    cache = filter(parse.rem, 0, pattern)
-    wCnt = len(parse.rem)
-    parse.rem = []
-    line = ""
-    words = []
-    while wCnt < num:
-        line = f.readline()
-        if line.startswith(UNV_DELIM):
+def readBlocks(file, start=0, end=None, block_size=BLOCK_SIZE):
+    """Yield blocks of complete lines of file from byte offset start to end."""
+    file.seek(start)
+    rest = b""
+    while end is None or start < end:
+        size = block_size if end is None else min(block_size, end - start)
+        data = file.read(size)
+        if not data:
             break
-        words = line.split()
-        new = filter(words, wCnt, pattern)
-        cache.extend(new)
-        wCnt += len(words)
-    diff = wCnt - num
-    if diff > 0:
-        parse.rem = words[len(words) - diff :]
-    if cache and wCnt < num:
+        start += len(data)
+        data = rest + data
+        cut = data.rfind(b"\n") + 1
+        rest = data[cut:]
+        if cut:
+            yield data[:cut]
+    if rest:
+        yield rest
+
+
+def scanUnv(file, block_size=BLOCK_SIZE):
+    """List of (type, start, end) byte offsets of the data of all sections."""
+    delims = []
+    size = 0
+    for block in readBlocks(file, block_size=block_size):
+        delims.extend(size + mo.start() for mo in _DELIM.finditer(block))
+        size += len(block)
+    sections = []
+    for k in range(0, len(delims), 2):
+        file.seek(delims[k])
+        file.readline()
+        secType = file.readline().strip().decode()
+        end = delims[k + 1] if k + 1 < len(delims) else size
+        sections.append((secType, file.tell(), end))
+    return sections
+
+
+def readWords(file, start, end, block_size=BLOCK_SIZE):
+    """Yield the words of a section block-wise.
+
+    The generator receives the number of words of incomplete records at the
+    end of a block, they are prepended to the next block.
+    """
+    rest = []
+    for block in readBlocks(file, start, end, block_size):
+        words = block.split()
+        if rest:
+            words = rest + words
+        used = yield words
+        rest = words[used:]
+        yield
+    if rest:
         raise EndOfSectionError()
-    return cache
-
-
-def filter(words, i, pattern):
-    ret = []
-    for v in words:
-        if ((1 << i) & pattern) > 0:
-            ret.append(v)
-        i += 1
-    return ret
-
-
-def indexElems(index, file, exclude):
-    posPrev = file.tell()
-    curr = nextType(file)
-    prev = curr
-    count = 0
-    while curr is not None:
-        count += 1
-        pos = file.tell()
-        curr = nextType(file)
-        if curr != prev:
-            if prev not in exclude:
-                data = (posPrev, count)
-                regIndex(prev, data, index)
-            posPrev = pos
-            prev = curr
-            count = 0
-
-
-def regIndex(t, data, index):
-    list = index.get(t, [])
-    list.append(data)
-    index[t] = list
-
-
-def nextType(file):
-    data = parse(file, 6, 0b100010)
-    if data:
-        t = data[0]
-        n = int(data[1])
-        if t in UNV_BEAM:
-            n += 3
-        data = parse(file, n, 0b1)
-        if not data:
-            raise EndOfSectionError()
-        return t
-    return None
-
-
-def parseGroups(groups, contact, file):
-    data = parse(file, 9, 0b110000000)
-    while data:
-        num = int(data[0])
-        group = data[1]
-        elems = []
-        while num > 0:
-            data = parse(file, 4, 0b0010)
-            if not data:
-                raise EndOfSectionError()
-            (entity,) = data
-            elems.append(entity)
-            num -= 1
-        if group == CONTACT_GRP:
-            contact |= set(elems)
-        else:
-            for e in elems:
-                groups[e] = group
-        data = parse(file, 9, 0b110000000)
-
-
-def writeFly(nodes, groups, index, contact, unvFile, flyFile, exclude):
-    writeHeader(flyFile)
-    convertNodes(nodes, unvFile, flyFile)
-    convertElemsContact(index, groups, contact, unvFile, flyFile)
-    if UNV_index[2].issubset(exclude):  # if 2D is excluded
-        writeFooter(flyFile)
-    else:
-        writeFooter2(flyFile)
 
 
-def writeHeader(file):
-    file.write(FLY_MESH_NAME + "\n")
+def countNodes(file, sections, block_size=BLOCK_SIZE):
+    # two lines per node
+    cnt = 0
+    for start, end in sections:
+        for block in readBlocks(file, start, end, block_size):
+            cnt += block.count(b"\n")
+    return cnt // 2
 
 
-def convertNodes(nodes, unvFile, flyFile):
-    sum = 0
-    for pos, num in nodes:
-        sum += num
-    flyFile.write("3D-nodes %d\n" % sum)
-    for pos, num in nodes:
-        unvFile.seek(pos)
-        while num > 0:
-            nId, x, y, z = parseNode(unvFile)
-            flyFile.write(
-                nId + " " + nId + " 0 " + str(x) + " " + str(y) + " " + str(z) + "\n"
-            )
-            num -= 1
+def convertNodes(sections, unv, fly, block_size=BLOCK_SIZE):
+    num = countNodes(unv, sections, block_size)
+    fly.write(b"3D-nodes %d\n" % num)
+    cnt = 0
+    for start, end in sections:
+        words = readWords(unv, start, end, block_size)
+        for w in words:
+            n = len(w) // 7
+            ids = w[0 : 7 * n : 7]
+            rows = zip(ids, ids, w[4::7], w[5::7], w[6::7])
+            fly.write(b"%s %s 0 %s %s %s\n" * n % tuple(itertools.chain.from_iterable(rows)))
+            cnt += n
+            words.send(7 * n)
+    if cnt != num:
+        raise ParseError("%d nodes expected, %d found" % (num, cnt))
+    return num
+
+
+def readElems(file, start, end, block_size=BLOCK_SIZE):
+    """Yield runs of consecutive elements with the same type and node count.
+
+    A run is (type, ids, nodes) with the element ids and the node ids as a
+    list of columns. The length of a run is found by comparing the type and
+    node count at the positions given by the stride of its first record.
+    """
+    words = readWords(file, start, end, block_size)
+    for w in words:
+        p = 0
+        size = len(w)
+        while size - p >= 6:
+            t, nStr = w[p + 1], w[p + 5]
+            first = 9 if t in _BEAM else 6
+            stride = first + int(nStr)
+            cnt = (size - p) // stride
+            if cnt == 0:
+                break
+            stop = p + cnt * stride
+            types = w[p + 1 : stop : stride]
+            counts = w[p + 5 : stop : stride]
+            if types.count(t) != cnt or counts.count(nStr) != cnt:
+                other = (np.array(types) != t) | (np.array(counts) != nStr)
+                cnt = int(np.argmax(other))
+                stop = p + cnt * stride
+            nodes = [w[p + first + j : stop : stride] for j in range(stride - first)]
+            yield t.decode(), w[p:stop:stride], nodes
+            p = stop
+        words.send(p)
+
+
+def parseGroups(sections, file, block_size=BLOCK_SIZE):
+    """Group names by entity tag and the tags of the contact group.
+
+    Returns the sorted tags, their group names and the sorted contact tags.
+    A tag listed in several groups belongs to the last one.
+    """
+    names, tags, index, contact = [], [], [], []
+    for start, end in sections:
+        group, num = None, 0
+        words = readWords(file, start, end, block_size)
+        for w in words:
+            p = 0
+            while True:
+                if num == 0:
+                    if len(w) - p < 9:
+                        break
+                    num = int(w[p + 7])
+                    group = w[p + 8]
+                    if group != _CONTACT:
+                        names.append(group)
+                    p += 9
+                    continue
+                cnt = min(num, (len(w) - p) // 4)
+                if cnt == 0:
+                    break
+                entities = np.array(w[p + 1 : p + 4 * cnt : 4]).astype(np.int64)
+                if group == _CONTACT:
+                    contact.append(entities)
+                else:
+                    tags.append(entities)
+                    index.append(np.full(cnt, len(names) - 1))
+                p += 4 * cnt
+                num -= cnt
+            words.send(p)
+        if num:
+            raise EndOfSectionError()
+    tags = np.concatenate(tags) if tags else np.zeros(0, dtype=np.int64)
+    index = np.concatenate(index) if index else np.zeros(0, dtype=np.int64)
+    order = np.argsort(tags, kind="stable")
+    tags, index = tags[order], index[order]
+    last = np.append(tags[1:] != tags[:-1], True)[: len(tags)]
+    labels = np.array(names + [_NO_GROUP], dtype=object)[index[last]]
+    contact = np.unique(np.concatenate(contact)) if contact else np.zeros(0, dtype=np.int64)
+    return tags[last], labels, contact
+
+
+def lookupGroups(ids, tags, labels):
+    if len(tags) == 0:
+        return [_NO_GROUP] * len(ids)
+    i = np.minimum(np.searchsorted(tags, ids), len(tags) - 1)
+    return np.where(tags[i] == ids, labels[i], _NO_GROUP).tolist()
+
+
+def spool(buffers, key, columns):
+    if key not in buffers:
+        buffers[key] = [tempfile.TemporaryFile(), 0]
+    buff = buffers[key]
+    n = len(columns[0])
+    if n:
+        fmt = b" ".join([b"%s"] * len(columns)) + b"\n"
+        buff[0].write(fmt * n % tuple(itertools.chain.from_iterable(zip(*columns))))
+        buff[1] += n
+
+
+def take(columns, sel):
+    return [[c[i] for i in sel] for c in columns]
+
+
+def convertElemsContact(sections, groups, contact, unv, fly, exclude, block_size=BLOCK_SIZE):
+    # element lines without number, spooled per unv type in the order of
+    # their first appearance; contact elements are written after all others
+    buffs, contactBuffs = {}, {}
+    try:
+        for start, end in sections:
+            for t, ids, nodes in readElems(unv, start, end, block_size):
+                if t in exclude:
+                    continue
+                eIds = ids
+                if len(groups[0]) or len(contact):
+                    eIds = np.array(ids).astype(np.int64)
+                columns = [lookupGroups(eIds, *groups)] + nodes
+                isContact = np.isin(eIds, contact) if len(contact) else None
+                if isContact is not None and isContact.any():
+                    if t not in MCONTACT:
+                        raise UnsupportedElementError(t)
+                    spool(contactBuffs, t, take(columns, np.flatnonzero(isContact)))
+                    columns = take(columns, np.flatnonzero(~isContact))
+                spool(buffs, t, columns)
+        eCnt = 0
+        for t, buff in buffs.items():
+            if buff[1]:
+                if t not in MNORMAL:
+                    raise UnsupportedElementError(t)
+                eCnt = writeBuffer(fly, buff, MNORMAL[t], 1, block_size)
+        for t in buffs:
+            if t in contactBuffs:
+                writeBuffer(fly, contactBuffs[t], MCONTACT[t], eCnt, block_size)
+        return sum(b[1] for b in buffs.values()) + sum(b[1] for b in contactBuffs.values())
+    finally:
+        for buff in itertools.chain(buffs.values(), contactBuffs.values()):
+            buff[0].close()
+
+
+def writeBuffer(f, b, t, i, block_size=BLOCK_SIZE):
+    file, num = b
+    f.write(b"%s %d\n" % (t.encode(), num))
+    for block in readBlocks(file, block_size=block_size):
+        lines = block[:-1].split(b"\n")
+        n = len(lines)
+        f.write(b"%d %s\n" * n % tuple(itertools.chain.from_iterable(zip(range(i, i + n), lines))))
+        i += n
+    return i
 
 
 def writeFooter(fly):
-    fly.write("""Tri3 0
+    fly.write(b"""Tri3 0
 Tri3_Contact 0
 Point1 0
 Tags
@@ -294,64 +362,28 @@ Tags
 
 
 def writeFooter2(fly):
-    fly.write("""Tri3_Contact 0
+    fly.write(b"""Tri3_Contact 0
 Point1 0
 Tags
 """)
 
 
-def parseNode(file):
-    return parse(file, 7, 0b1110001)
-
-
-def convertElemsContact(index, groups, contact, unv, fly):
-    contactBuff = {}
-    eCnt = 0
-    for t, data in index.items():
-        buff = []
-        for pos, num in data:
-            unv.seek(pos)
-            while num > 0:
-                eId, ns = parseElem(t, unv)
-                grp = groups.get(eId, "-1")
-                line = grp + " " + " ".join(ns) + "\n"
-                if eId in contact:
-                    sif = MCONTACT[t]
-                    addTo(contactBuff, sif, line)
-                else:
-                    buff.append(line)
-                num -= 1
-        if buff:
-            eCnt = writeBuffer(fly, buff, t, MNORMAL)
-    for sif, buff in contactBuff.items():
-        writeBuffer(fly, buff, sif, i=eCnt)
-
-
-def writeBuffer(f, b, t, m=None, i=1):
-    if m is not None:
-        t = m[t]
-    f.write("%s %d\n" % (t, len(b)))
-    for ll in b:
-        f.write(str(i) + " " + ll)
-        i += 1
-    return i
-
+def writeFly(unv, fly, exclude, block_size=BLOCK_SIZE):
+    """Convert the open binary unv file to fly, return the number of nodes and elements."""
+    sections = scanUnv(unv, block_size)
 
-def addTo(m, k, d):
-    ls = m.get(k, [])
-    ls.append(d)
-    m[k] = ls
+    def ofType(secType):
+        return [(start, end) for t, start, end in sections if t == secType]
 
-
-def parseElem(t, file):
-    eId, t, nStr = parse(file, 6, 0b100011)
-    n = int(nStr)
-    p = ~0b0
-    if t in UNV_BEAM:
-        n += 3
-        p = ~0b111
-    data = parse(file, n, p)
-    return eId, data
+    groups = parseGroups(ofType(UNV_GROUPS), unv, block_size)
+    fly.write(FLY_MESH_NAME.encode() + b"\n")
+    nodes = convertNodes(ofType(UNV_NODES), unv, fly, block_size)
+    elems = convertElemsContact(ofType(UNV_ELEMS), groups[:2], groups[2], unv, fly, exclude, block_size)
+    if UNV_index[2].issubset(exclude):  # if 2D is excluded
+        writeFooter(fly)
+    else:
+        writeFooter2(fly)
+    return nodes, elems
 
 
 def get_exclude_set(exclude_list):
@@ -362,6 +394,8 @@ def get_exclude_set(exclude_list):
     )
 
 
+
+
 def convert(
     unv_path: str | pathlib.Path,
     fly_path: str | pathlib.Path,
@@ -376,11 +410,49 @@ def convert(
             exclude 1D and 2D elements.
 
     """
-    infile = open(unv_path)
     pathlib.Path(fly_path).parent.mkdir(exist_ok=True, parents=True)
-    outfile = open(fly_path, "w")
-    exclude_set = get_exclude_set(exclude_list)
-    nodes, index, groups, contact = scanUnv(infile, exclude_set)
-    writeFly(nodes, groups, index, contact, infile, outfile, exclude_set)
-    infile.close()
-    outfile.close()
+    with open(unv_path, "rb") as infile, open(fly_path, "wb") as outfile:
+        writeFly(infile, outfile, get_exclude_set(exclude_list))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m mammos_mumag.tofly",
+        description="Convert unv files to the fly format.",
+    )
+    parser.add_argument("unv", metavar="UNV", nargs="?", default="-")
+    parser.add_argument("fly", metavar="FLY", nargs="?", default="-")
+    parser.add_argument("-e", "--exclude", metavar="DIMENSIONS", default="1,2")
+    parser.add_argument("-t", "--time", action="store_true")
+    args = parser.parse_args(argv)
+    exclude = get_exclude_set([int(d) for d in args.exclude.split(",") if d])
+
+    t0 = time.perf_counter()
+    with tempfile.TemporaryFile() as spooled:
+        if args.unv == "-":  # the converter seeks, stdin is copied to a file
+            shutil.copyfileobj(sys.stdin.buffer, spooled)
+            unv = spooled
+        else:
+            unv = open(args.unv, "rb")
+        try:
+            if args.fly == "-":
+                nodes, elems = writeFly(unv, sys.stdout.buffer, exclude)
+                sys.stdout.flush()
+            else:
+                pathlib.Path(args.fly).parent.mkdir(exist_ok=True, parents=True)
+                with open(args.fly, "wb") as fly:
+                    nodes, elems = writeFly(unv, fly, exclude)
+            size = unv.seek(0, 2)
+        finally:
+            unv.close()
+    if args.time:
+        seconds = time.perf_counter() - t0
+        print(
+            "%d bytes, %d nodes, %d elements in %.3f s: %.1f MB/s, %.0f elements/s"
+            % (size, nodes, elems, seconds, size / seconds / 1e6, elems / seconds),
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
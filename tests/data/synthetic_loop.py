@@ -0,0 +1,113 @@
+"""Hysteresis loops of loop.py on a synthetic system.
+
+Run with `run-escript synthetic_loop.py` in the output directory. The system is
+a uniaxial particle on a regular grid of n^3 nodes with a random magnetostatic
+coupling; it needs no mesh, so that every variant of the minimizer runs in a few
+seconds. The loop of variant <label> is written to synthetic_<label>.dat and
+synthetic_<label>_iterations.dat.
+"""
+
+import sys
+
+import numpy
+import scipy.sparse as sp
+
+import mammos_mumag
+
+sys.path.insert(0, str(mammos_mumag._scripts_directory))
+
+import jax.numpy as np  # noqa: E402
+import loop  # noqa: E402
+from converters import csr2bcoo  # noqa: E402
+from jax_tools import mixed_pars, soa_pars, to_soa  # noqa: E402
+
+# min_pars: tol_u, tol_fun, precond_iter, iter_max, tol_hmag_adaptive,
+# extrapolate, hmag_precond, layout, precision, precond_recycle, minimizer
+MIN_PARS = [1e-10, 1e-10, 10, 1000, 0.0, 0, 0, 0, 0, 0, 0]
+VARIANTS = {
+    "ncg": {},
+    "recycle": {9: 3},
+    "extrapolate": {5: 1},
+    "soa": {7: 1},
+    "mixed": {8: 1},
+    "bb": {10: 1},
+    "lbfgs": {10: 2},
+}
+
+
+class NullWriter:
+    """Writer of the snapshots that writes nothing."""
+
+    geometry_arrays = {}
+
+    def write(self, filename, **fields):
+        """Ignore the snapshot."""
+
+
+def laplacian(n):
+    """Return the graph Laplacian of a regular grid of n^3 nodes."""
+    d = sp.diags(
+        [-numpy.ones(n - 1), 2 * numpy.ones(n), -numpy.ones(n - 1)], [-1, 0, 1]
+    )
+    eye = sp.eye(n)
+    return (
+        sp.kron(sp.kron(d, eye), eye)
+        + sp.kron(sp.kron(eye, d), eye)
+        + sp.kron(sp.kron(eye, eye), d)
+    ).tocsr()
+
+
+def system(n, min_pars, density=4):
+    """Return the initial magnetization and the pars of loop.loop."""
+    size = n**3
+    lap = laplacian(n)
+    a, k = 0.05 / size, 0.25 / size
+    C = sp.kron(lap, sp.eye(3)) * a + sp.diags(numpy.tile([0.0, 0.0, -2 * k], size))
+    C = C.tocsr()
+    D = numpy.abs(C.diagonal()) + 2 * k
+    dxyz = [
+        sp.random(size, size, density=density / size, random_state=s).tocsr() * 0.1
+        for s in (1, 2, 3)
+    ]
+    A = (lap + 0.1 * sp.eye(size)).tocsr()
+    gxyz = [csr2bcoo((0.5 / size * d.T).tocsr()) for d in dxyz]
+    pars = {
+        "exani_pars": (csr2bcoo(C), np.array(D)),
+        "hmag_pars": (
+            *[csr2bcoo(d) for d in dxyz],
+            csr2bcoo(A),
+            np.array(A.diagonal()),
+            *gxyz,
+        ),
+        "hmag_on": 1,
+        "mag_pars": ([0.0, 0.0, 1.0], 0.4, -1.2, 0),
+        "hext_pars": ([0.01745, 0.0, 0.99984], 1.0, -1.0, -0.1),
+        "min_pars": tuple(min_pars),
+        "verbose": 0,
+        "meas": np.ones(size) / size,
+        "volume": 1.0,
+        "size": 1e-9,
+        "step_pars": (0, 0.005, 0.05, 50),
+    }
+    m = np.tile(np.array([0.0, 0.0, 1.0]), size)
+    if min_pars[7] == 1:
+        m = to_soa(m)
+        pars = soa_pars(pars)
+    if min_pars[8] == 1:
+        pars = mixed_pars(pars)
+    pars["m_init"] = m
+    return m, pars
+
+
+if __name__ == "__main__":
+    loop.writer = NullWriter()
+    for label, changes in VARIANTS.items():
+        min_pars = list(MIN_PARS)
+        for index, value in changes.items():
+            min_pars[index] = value
+        m, pars = system(4, min_pars)
+        loop.loop("synthetic", m, pars, prefix=f"synthetic_{label}")
+    # matrices of the same size with another nnz need another executable
+    _, pars = system(4, MIN_PARS)
+    _, other = system(4, MIN_PARS, density=8)
+    assert loop.signature(pars) != loop.signature(other)
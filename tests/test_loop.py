@@ -1,9 +1,73 @@
 """Check loop script."""
 
+import inspect
+import json
+import os
+import sys
+
 import numpy as np
+import pytest
 import pyvista as pv
 
-from mammos_mumag.simulation import Simulation
+from mammos_mumag import simulation
+from mammos_mumag.hysteresis import ITERATIONS_COLUMNS, _read_result, run_many
+from mammos_mumag.mesh import convert_to_npz
+from mammos_mumag.mesh_store import MeshStore
+from mammos_mumag.series import configuration_indices, read_configuration
+from mammos_mumag.simulation import Simulation, _run_subprocess, _thread_env
+
+
+@pytest.fixture
+def sim(DATA):
+    """Return the simulation of the reference loop of the cube."""
+    return Simulation(
+        mesh_filepath=DATA / "cube.fly",
+        materials_filepath=DATA / "cube.krn",
+        parameters_filepath=DATA / "cube.p2",
+    )
+
+
+def assert_reference_loop(DATA, outdir, **tolerance):
+    """Check `<outdir>/cube.dat` against the reference loop and return it."""
+    data_loop = np.loadtxt(DATA / "loop" / "cube.dat")
+    sim_loop = np.loadtxt(outdir / "cube.dat")
+    assert np.allclose(data_loop, sim_loop, **tolerance)
+    return sim_loop
+
+
+def total_spmvs(outdir):
+    """Return the sparse matrix-vector products of the loop in `outdir`."""
+    return np.loadtxt(outdir / "cube_iterations.dat")[:, 5].sum()
+
+
+@pytest.fixture(scope="module")
+def reference_spmvs(DATA, tmp_path_factory):
+    """Return the sparse matrix-vector products of the reference loop."""
+    outdir = tmp_path_factory.mktemp("reference")
+    Simulation(
+        mesh_filepath=DATA / "cube.fly",
+        materials_filepath=DATA / "cube.krn",
+        parameters_filepath=DATA / "cube.p2",
+    ).run_loop(outdir=outdir, name="cube")
+    return total_spmvs(outdir)
+
+
+def assert_reference_vtus(DATA, outdir):
+    """Check the `vtu` files in `outdir` against the ones of the reference loop."""
+    vtu_list = [i.name for i in outdir.iterdir() if i.suffix == ".vtu"]
+    assert vtu_list
+    for vtu_name in vtu_list:
+        mesh_data = pv.read(DATA / "loop" / vtu_name)
+        mesh_sim = pv.read(outdir / vtu_name)
+        assert np.allclose(mesh_data.points, mesh_sim.points)
+        assert np.allclose(mesh_data.point_data["m"], mesh_sim.point_data["m"])
+
+
+def first_cpus(n):
+    """Return the first n CPUs the tests may run on, None without CPU affinity."""
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    return sorted(os.sched_getaffinity(0))[:n]
 
 
 def test_loop(DATA, tmp_path):
@@ -28,3 +92,341 @@ def test_loop(DATA, tmp_path):
         mesh_data = pv.read(DATA / "loop" / vtu_name)
         mesh_sim = pv.read(tmp_path / vtu_name)
         assert np.allclose(mesh_data.point_data["m"], mesh_sim.point_data["m"])
+
+
+def test_loop_matrix_cache(DATA, tmp_path, sim, capfd):
+    """Test loop with matrices from the matrix cache."""
+    cache_dir = tmp_path / "cache"
+
+    # first run fills the cache, second run reads it
+    sim.run_loop(outdir=tmp_path / "first", name="cube", cache_dir=cache_dir)
+    entries = [i for i in cache_dir.iterdir() if not i.name.startswith(".")]
+    assert len(entries) == 1
+    assert (entries[0] / "manifest.json").is_file()
+    capfd.readouterr()
+    sim.run_loop(outdir=tmp_path / "second", name="cube", cache_dir=cache_dir)
+    assert "read stored matrices" in capfd.readouterr().out
+
+    for outdir in ["first", "second"]:
+        assert_reference_loop(DATA, tmp_path / outdir)
+
+
+def test_loop_directions(tmp_path, sim):
+    """Test loop over several field directions in one process."""
+    # the direction of cube.p2 and a tilted one
+    directions = [[0.01745, 0.0, 0.99984], [0.5, 0.0, 0.8660254]]
+    sim.run_loop(outdir=tmp_path / "directions", name="cube", directions=directions)
+
+    # every direction gives the loop of a separate run with that direction
+    for k, h in enumerate(directions):
+        sim.parameters.h_vect = h
+        sim.run_loop(outdir=tmp_path / f"single_{k}", name="cube")
+        single_loop = np.loadtxt(tmp_path / f"single_{k}" / "cube.dat")
+        sim_loop = np.loadtxt(tmp_path / "directions" / str(k) / "cube.dat")
+        assert np.allclose(single_loop, sim_loop)
+    # the polarization is the component along the field direction
+    loops = [np.loadtxt(tmp_path / f"single_{k}" / "cube.dat") for k in range(2)]
+    assert not np.isclose(loops[0][0, 2], loops[1][0, 2])
+
+
+def test_loop_compilation_cache(DATA, tmp_path, sim):
+    """Test loop with the persistent compilation cache."""
+    cache_dir = tmp_path / "jax_cache"
+
+    # first run compiles the solver, second run reads it from the cache
+    for outdir in ["first", "second"]:
+        sim.run_loop(
+            outdir=tmp_path / outdir, name="cube", compilation_cache_dir=cache_dir
+        )
+    assert any(cache_dir.iterdir())
+    stats = (tmp_path / "second" / "cube_stats.txt").read_text()
+    assert "Compilation cache hits: 0." not in stats
+
+    for outdir in ["first", "second"]:
+        assert_reference_loop(DATA, tmp_path / outdir)
+
+
+def test_loop_inprocess(DATA, tmp_path, sim):
+    """Test loop in the worker process of the in-process backend."""
+    sim.backend = "inprocess"
+
+    # second run reuses mesh and matrices of the worker process
+    for outdir in ["first", "second"]:
+        result = sim.run_loop(outdir=tmp_path / outdir, name="cube")
+        sim_loop = assert_reference_loop(DATA, tmp_path / outdir)
+        assert np.allclose(sim_loop, result)
+
+
+def test_loop_threads(DATA, tmp_path, sim, monkeypatch):
+    """Test that the loop process gets the thread limits and its CPUs."""
+    calls = []
+
+    def run_subprocess(cmd, cwd, env=None, cpus=None):
+        calls.append((env, cpus))
+        _run_subprocess(cmd, cwd, env=env, cpus=cpus)
+
+    monkeypatch.setattr(simulation, "_run_subprocess", run_subprocess)
+    cpus = first_cpus(1)
+    sim.run_loop(outdir=tmp_path, name="cube", cpus=cpus)
+
+    ((env, loop_cpus),) = calls
+    assert loop_cpus == cpus
+    assert env["OMP_NUM_THREADS"] == "1"
+    assert "--xla_cpu_multi_thread_eigen=false" in env["XLA_FLAGS"].split()
+    assert_reference_loop(DATA, tmp_path)
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "sched_getaffinity"), reason="CPU affinity not supported"
+)
+def test_thread_limit(tmp_path):
+    """Test that the threads of XLA are limited to the CPUs of the process."""
+    cpus = first_cpus(1)
+    check = inspect.cleandoc(
+        """
+        import json, os
+        import jax.numpy as jnp
+        x = jnp.ones((256, 256))
+        (x @ x).block_until_ready()
+        comm = [
+            open(f"/proc/self/task/{t}/comm").read().strip()
+            for t in os.listdir("/proc/self/task")
+        ]
+        with open("threads.json", "w") as file:
+            json.dump({
+                "cpus": sorted(os.sched_getaffinity(0)),
+                "xla_threads": sum("XLAEigen" in c for c in comm),
+                "omp": os.environ["OMP_NUM_THREADS"],
+                "xla_flags": os.environ["XLA_FLAGS"],
+            }, file)
+        """
+    )
+    _run_subprocess(
+        [sys.executable, "-c", check], cwd=tmp_path, env=_thread_env(1), cpus=cpus
+    )
+
+    with open(tmp_path / "threads.json") as file:
+        threads = json.load(file)
+    assert threads["cpus"] == cpus
+    assert threads["xla_threads"] <= 1
+    assert threads["omp"] == "1"
+    assert "--xla_cpu_multi_thread_eigen=false" in threads["xla_flags"].split()
+
+
+def test_run_many_unknown_parameter(DATA, tmp_path):
+    """Test that a loop with an unknown parameter yields a ValueError."""
+    params = {
+        "Ms": 1.0,
+        "A": 1e-11,
+        "K1": 1e5,
+        "mesh_filepath": DATA / "cube.fly",
+        "hstart": 1.0,
+        "hfinal": -1.0,
+        "hsteps": 10,
+    }
+    ((index, result),) = run_many([params], outdir=tmp_path)
+    assert index == 0
+    assert isinstance(result, ValueError)
+    assert "hsteps" in str(result)
+
+
+def test_loop_iterations(tmp_path, sim):
+    """Test iteration counts per field step."""
+    sim.run_loop(outdir=tmp_path, name="hystloop")
+
+    sim_loop = np.loadtxt(tmp_path / "hystloop.dat")
+    iterations = np.loadtxt(tmp_path / "hystloop_iterations.dat")
+    assert iterations.shape == (len(sim_loop), 9)
+    assert np.allclose(iterations[:, 0], sim_loop[:, 1])
+    assert np.all(iterations[:, 1:] >= 0)
+    assert iterations[:, 3].sum() > 0
+    assert iterations[:, 4].sum() > 0
+    assert np.all(iterations[:, 5] >= iterations[:, 2:5].sum(axis=1))
+    assert np.all(iterations[:, 6] <= iterations[:, 2])
+    assert np.all(iterations[:, 7] <= iterations[:, 1])
+    assert np.all(iterations[:, 8] > 0)
+
+    result = _read_result(tmp_path)
+    assert list(result.iterations.columns) == ITERATIONS_COLUMNS
+    assert np.allclose(result.iterations.to_numpy(), iterations)
+
+
+def test_loop_recycle(DATA, tmp_path, sim, reference_spmvs):
+    """Test loop with the recycled preconditioner basis."""
+    sim.parameters.precond_recycle = 8
+
+    sim.run_loop(outdir=tmp_path, name="cube")
+
+    assert_reference_loop(DATA, tmp_path, rtol=1e-5)
+    iterations = np.loadtxt(tmp_path / "cube_iterations.dat")
+    assert iterations[:, 4].sum() > 0
+    assert total_spmvs(tmp_path) < reference_spmvs
+
+
+def test_loop_inexact_hmag(DATA, tmp_path, sim, reference_spmvs):
+    """Test loop with the adaptive Poisson tolerance and the extrapolation."""
+    for name, value in [("tol_hmag_adaptive", 0.1), ("extrapolate", 1)]:
+        setattr(sim.parameters, name, value)
+        sim.run_loop(outdir=tmp_path / name, name="cube")
+        setattr(sim.parameters, name, 0)
+
+        assert_reference_loop(DATA, tmp_path / name, rtol=1e-5)
+        assert total_spmvs(tmp_path / name) < reference_spmvs
+
+
+def test_loop_amg(DATA, tmp_path, sim):
+    """Test loop with the multigrid preconditioner of the Poisson solve."""
+    sim.parameters.hmag_precond = "amg"
+
+    sim.run_loop(outdir=tmp_path, name="cube")
+
+    assert_reference_loop(DATA, tmp_path, atol=1e-6)
+
+
+def test_loop_soa(DATA, tmp_path, sim):
+    """Test loop with the (3, N) layout of the magnetization."""
+    sim.parameters.layout = "soa"
+
+    sim.run_loop(outdir=tmp_path, name="cube")
+
+    assert_reference_loop(DATA, tmp_path)
+    assert_reference_vtus(DATA, tmp_path)
+
+
+def test_loop_mixed(DATA, tmp_path, sim):
+    """Test loop with the inner solves in mixed precision."""
+    sim.parameters.precision = "mixed"
+
+    sim.run_loop(outdir=tmp_path, name="cube")
+
+    assert_reference_loop(DATA, tmp_path, rtol=1e-5)
+
+
+def test_loop_minimizers(DATA, tmp_path, sim):
+    """Test loop with the Barzilai-Borwein and L-BFGS minimizers."""
+    for minimizer in ["bb", "lbfgs"]:
+        sim.parameters.minimizer = minimizer
+        sim.run_loop(outdir=tmp_path / minimizer, name="cube")
+
+        assert_reference_loop(DATA, tmp_path / minimizer, rtol=1e-4)
+        iterations = np.loadtxt(tmp_path / minimizer / "cube_iterations.dat")
+        assert np.all(iterations[:, 4] == 0)
+
+
+def test_loop_adaptive(DATA, tmp_path, sim):
+    """Test loop with adaptive field steps."""
+    sim.parameters.hstep_levels = 2
+    sim.parameters.hstep_iter_grow = 1000
+
+    sim.run_loop(outdir=tmp_path, name="cube")
+
+    data_loop = np.loadtxt(DATA / "loop" / "cube.dat")
+    sim_loop = np.loadtxt(tmp_path / "cube.dat")
+    assert len(sim_loop) < len(data_loop)
+    assert np.isclose(sim_loop[-1, 1], data_loop[-1, 1])
+    # the fields are fields of the uniform loop
+    rows = [np.argmin(abs(data_loop[:, 1] - h)) for h in sim_loop[:, 1]]
+    assert np.allclose(data_loop[rows, 1], sim_loop[:, 1])
+    assert np.allclose(data_loop[rows, 2], sim_loop[:, 2], atol=1e-6)
+
+
+def test_loop_npz_mesh(DATA, tmp_path, sim):
+    """Test loop on the binary mesh."""
+    sim.mesh_filepath = convert_to_npz(DATA / "cube.fly", tmp_path / "cube.npz")
+    outdir = tmp_path / "loop"
+    # a fly mesh of an earlier run must not be used
+    outdir.mkdir()
+    (outdir / "cube.fly").write_text("not a mesh\n")
+
+    sim.run_loop(outdir=outdir, name="cube")
+
+    assert not (outdir / "cube.fly").exists()
+    assert (outdir / "cube.npz").read_bytes() == sim.mesh_filepath.read_bytes()
+    assert_reference_loop(DATA, outdir)
+    # the vtu files get their geometry from the arrays of the binary mesh
+    assert_reference_vtus(DATA, outdir)
+    # the domain is dumped next to the mesh and loaded from the dump next time
+    dump = tmp_path / "cube_domain.nc"
+    assert (outdir / "cube_domain.nc").resolve() == dump.resolve()
+    mtime = dump.stat().st_mtime_ns
+    sim.run_loop(outdir=outdir, name="cube")
+    assert dump.stat().st_mtime_ns == mtime
+    assert_reference_loop(DATA, outdir)
+
+
+def test_loop_mesh_store(DATA, tmp_path, sim, capfd):
+    """Test loops referencing the mesh in the mesh store."""
+    store = MeshStore(root=tmp_path / "store")
+    sim.mesh_store = store
+    sim.run_loop(outdir=tmp_path / "first", name="cube")
+    capfd.readouterr()
+    sim.run_loop(outdir=tmp_path / "second", name="cube")
+
+    # the second loop reads the matrices cached in the store by the first
+    assert "read stored matrices" in capfd.readouterr().out
+    stored = store.add(DATA / "cube.fly")
+    assert len(list(store.root.iterdir())) == 1
+    matrices = store.artifact_dir(DATA / "cube.fly", "matrices")
+    assert len([i for i in matrices.iterdir() if not i.name.startswith(".")]) == 1
+    for outdir in ["first", "second"]:
+        assert (tmp_path / outdir / "cube.fly").samefile(stored)
+        assert_reference_loop(DATA, tmp_path / outdir)
+
+
+def test_loop_series(DATA, tmp_path, sim):
+    """Test loop writing the configurations to one series file."""
+    sim.run_loop(outdir=tmp_path, name="cube", snapshots="series")
+    assert not list(tmp_path.glob("*.vtu"))
+
+    sim_loop = assert_reference_loop(DATA, tmp_path)
+
+    series = tmp_path / "cube_series.npz"
+    indices = configuration_indices(series)
+    assert indices == sorted(int(k) for k in np.unique(sim_loop[:, 0]) if k > 0)
+    for idx in indices:
+        mesh_data = pv.read(DATA / "loop" / f"cube_{idx:04d}.vtu")
+        mesh_sim = read_configuration(series, idx)
+        assert np.allclose(mesh_data.points, mesh_sim.points)
+        assert np.allclose(mesh_data.point_data["m"], mesh_sim.point_data["m"])
+
+
+def test_loop_resume(DATA, tmp_path, sim):
+    """Test loop continued from its checkpoint."""
+    # stop half way
+    sim.parameters.mfinal = 1.6096
+    sim.run_loop(outdir=tmp_path, name="cube", checkpoint_interval=1)
+    assert (tmp_path / "cube_checkpoint.npz").exists()
+
+    data_loop = np.loadtxt(DATA / "loop" / "cube.dat")
+    sim_loop = np.loadtxt(tmp_path / "cube.dat")
+    assert 0 < len(sim_loop) < len(data_loop)
+    assert np.allclose(data_loop[: len(sim_loop)], sim_loop)
+
+    # continue to the end of the loop
+    sim.parameters.mfinal = -1.2
+    sim.run_loop(outdir=tmp_path, name="cube", checkpoint_interval=1, resume=True)
+    assert_reference_loop(DATA, tmp_path)
+    assert_reference_vtus(DATA, tmp_path)
+
+    # a completed loop is not computed again; without checkpoint interval no
+    # checkpoint is kept
+    sim.run_loop(outdir=tmp_path, name="cube", resume=True)
+    assert_reference_loop(DATA, tmp_path)
+    assert not (tmp_path / "cube_checkpoint.npz").exists()
+
+
+def test_loop_synthetic(DATA, tmp_path):
+    """Test all minimizer variants of loop.py on a synthetic system."""
+    Simulation.run_file(DATA / "synthetic_loop.py", outdir=tmp_path)
+
+    ref = np.loadtxt(tmp_path / "synthetic_ncg.dat")
+    assert ref[0, 2] > 0 > ref[-1, 2]
+    for label in ["recycle", "extrapolate", "soa", "mixed", "bb", "lbfgs"]:
+        sim_loop = np.loadtxt(tmp_path / f"synthetic_{label}.dat")
+        assert np.allclose(ref, sim_loop, atol=1e-5)
+        iterations = np.loadtxt(tmp_path / f"synthetic_{label}_iterations.dat")
+        assert iterations.shape == (len(sim_loop), 9)
+        assert np.all(iterations[:, 1] > 0)
+    # the line search of L-BFGS backtracks from the unit step
+    iterations = np.loadtxt(tmp_path / "synthetic_lbfgs_iterations.dat")
+    assert iterations[:, 6].sum() > 0
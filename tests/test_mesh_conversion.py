@@ -2,6 +2,9 @@
 
 import filecmp
 
+import numpy as np
+
+from mammos_mumag.mesh import convert_to_npz, read_fly
 from mammos_mumag.tofly import convert
 
 
@@ -9,3 +12,16 @@ def test_mesh_conversion(DATA, tmp_path):
     """Test mesh conversion."""
     convert(DATA / "mesh.unv", tmp_path / "mesh.fly")
     assert filecmp.cmp(tmp_path / "mesh.fly", DATA / "unvtofly" / "mesh.fly")
+
+
+def test_npz_conversion(DATA, tmp_path):
+    """Test conversion to the binary mesh."""
+    npz_filepath = convert_to_npz(DATA / "cube.fly", tmp_path / "cube.npz")
+    arrays = read_fly(DATA / "cube.fly")
+    with np.load(npz_filepath) as npz:
+        assert set(npz.files) == set(arrays) | {"version"}
+        for key, value in arrays.items():
+            assert np.array_equal(npz[key], value)
+    assert list(arrays["sections"]) == ["Tet4", "Tri3", "Tri3_Contact", "Point1"]
+    assert arrays["x"].shape == (len(arrays["node_ids"]), 3)
+    assert arrays["nodes0"].shape == (len(arrays["ids0"]), 4)
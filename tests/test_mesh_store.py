@@ -0,0 +1,21 @@
+"""Check mesh store."""
+
+import os
+
+from mammos_mumag.mesh_store import MeshStore
+
+
+def test_mesh_store(DATA, tmp_path):
+    """Test that runs link to one stored mesh."""
+    store = MeshStore(root=tmp_path / "store")
+    stored = store.link_to(DATA / "cube.fly", tmp_path / "a" / "cube.fly")
+    assert store.link_to(DATA / "cube.fly", tmp_path / "b" / "cube.fly") == stored
+    assert stored == tmp_path / "store" / store.key(DATA / "cube.fly") / "mesh.fly"
+    assert len(list((tmp_path / "store").iterdir())) == 1
+    for run in ["a", "b"]:
+        assert os.path.samefile(tmp_path / run / "cube.fly", stored)
+    assert stored.read_bytes() == (DATA / "cube.fly").read_bytes()
+
+    matrices = store.artifact_dir(DATA / "cube.fly", "matrices")
+    assert matrices == stored.parent / "matrices"
+    assert matrices.is_dir()
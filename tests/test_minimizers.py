@@ -0,0 +1,66 @@
+"""Check the event counters of the minimizers."""
+
+import sys
+
+import jax.numpy as jnp
+import numpy as np
+
+import mammos_mumag
+
+sys.path.insert(0, str(mammos_mumag._scripts_directory))
+
+import jax_tools  # noqa: E402
+import minimizers  # noqa: E402
+
+STATS = (0, 0, 0, 0, 0)
+
+
+def quadratic(a):
+    """Return the energy a/2 x.x - x[0], counting evaluations in stats[0]."""
+
+    def func(x, func_args, alt_args, stats):
+        g = a * x - jnp.eye(len(x))[0]
+        return 0.5 * jnp.vdot(x, a * x) - x[0], g, alt_args, (stats[0] + 1, *stats[1:])
+
+    return func
+
+
+def test_backtracking_counts():
+    """Test that the backtracks of the Armijo line search are counted."""
+    func = quadratic(100.0)
+    x = jnp.ones(4)
+    f, g, _, _ = func(x, None, (), STATS)
+
+    x1, f1, _, _, stats = minimizers.backtracking(
+        x, f, g, -g, func, None, (), STATS, jax_tools.update_x
+    )
+
+    # the unit step overshoots by a factor of 100
+    assert f1 < f
+    assert int(stats[minimizers.BACKTRACKS]) > 0
+    assert int(stats[0]) == int(stats[minimizers.BACKTRACKS]) + 1
+
+
+def test_ncg_counts_restarts():
+    """Test that NCG counts the restarts with an uphill preconditioner."""
+    func = quadratic(2.0)
+
+    def uphill(x, g, func_args, alt_args, stats):
+        return -g, alt_args, stats
+
+    f, x, k, _, stats = minimizers.hestenes_stiefel_ncg(
+        jnp.zeros(4), func, None, (), STATS, 1e-10, jax_tools.update_x, uphill
+    )
+
+    assert np.allclose(x, [0.5, 0, 0, 0])
+    assert len(stats) == len(STATS)
+    assert int(stats[minimizers.RESTARTS]) >= 1
+    assert int(stats[minimizers.RESTARTS]) <= 2 * int(k)
+    assert int(stats[0]) > 0
+
+
+def test_count_events_passes_other_stats():
+    """Test that stats without the counters are passed through."""
+    assert minimizers.count_events(7, minimizers.RESTARTS, 1) == 7
+    assert minimizers.count_events((1, 2), minimizers.RESTARTS, 1) == (1, 2)
+    assert minimizers.count_events(STATS, minimizers.RESTARTS, 2) == (0, 0, 0, 0, 2)
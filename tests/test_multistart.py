@@ -0,0 +1,29 @@
+"""Check multistart script."""
+
+import numpy as np
+
+from mammos_mumag.simulation import Simulation
+
+
+def test_multistart(DATA, tmp_path):
+    """Test multi-start minimization against the first step of the loop."""
+    sim = Simulation(
+        mesh_filepath=DATA / "cube.fly",
+        materials_filepath=DATA / "cube.krn",
+        parameters_filepath=DATA / "cube.p2",
+    )
+    starts = [("uniform", 0), ("flower", 0), ("random", 1), ("random", 1)]
+
+    sim.run_multistart(outdir=tmp_path, name="cube", starts=starts)
+
+    table = np.loadtxt(tmp_path / "cube_multistart.dat", ndmin=2)
+    data_loop = np.loadtxt(DATA / "loop" / "cube.dat")
+    assert table.shape == (len(starts), 6)
+    assert np.all(table[:, 0] == [0, 1, 4, 4])
+    assert np.allclose(table[0, 2:4], data_loop[0, [3, 2]], rtol=1e-5)
+    # random states are reproducible
+    assert np.array_equal(table[2], table[3])
+    for k in range(len(starts)):
+        assert (tmp_path / f"cube_start_{k:04d}.vtu").is_file()
+    assert (tmp_path / "cube_lowest.vtu").is_file()
+    assert np.min(table[:, 2]) <= table[0, 2]
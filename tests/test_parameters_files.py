@@ -54,6 +54,7 @@ def test_parameters_file(DATA, tmp_path):
         hstart=8.0,
         hfinal=-1.5,
         hstep=-0.01,
+        hstep_levels=3,
         iter_max=5000,
     )
 
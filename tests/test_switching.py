@@ -0,0 +1,33 @@
+"""Check switching script."""
+
+import numpy as np
+
+from mammos_mumag.simulation import Simulation
+
+
+def test_switching(DATA, tmp_path):
+    """Test switching field bisection against a hysteresis loop."""
+    sim = Simulation(
+        mesh_filepath=DATA / "cube.fly",
+        materials_filepath=DATA / "cube.krn",
+        parameters_filepath=DATA / "cube.p2",
+    )
+    sim.parameters.hfinal = -10.0
+    sim.parameters.hstep = -1.0
+    sim.parameters.mfinal = -2.0
+    sim.parameters.hc_tol = 0.01
+
+    sim.run_switching(outdir=tmp_path / "switching", name="cube", remanence=True)
+    sim.run_loop(outdir=tmp_path / "loop", name="cube")
+
+    hc, mr = np.loadtxt(tmp_path / "switching" / "cube_hc.dat")
+    steps = np.loadtxt(tmp_path / "switching" / "cube_switching.dat", ndmin=2)
+    sim_loop = np.loadtxt(tmp_path / "loop" / "cube.dat")
+
+    # the switching field is in the step of the loop with the jump
+    jump = np.flatnonzero(
+        np.abs(np.diff(sim_loop[:, 2])) > sim.parameters.hstep_dm_jump
+    )[0]
+    assert sim_loop[jump + 1, 1] <= hc <= sim_loop[jump, 1]
+    assert np.count_nonzero(steps[:, 0] == 1) <= np.ceil(np.log2(1.0 / 0.01))
+    assert np.isclose(mr, sim_loop[np.isclose(sim_loop[:, 1], 0.0), 2][0])